@@ -0,0 +1,206 @@
+# coding: utf8
+
+"""
+AsyncResult 的分配数量和单请求耗时
+
+一个经过 SteamBoat 的请求会创建三个 AsyncResult（SteamBoat、Cabin、Executor），
+本脚本模拟这条链路，并与旧的实现（Future + 字典 + 加锁生成 id）进行对比；
+最后测量完整的 SteamBoat 请求在开启、关闭时间点记录时，
+以及在三层 AsyncResult、共用一个 AsyncResult 两种分发方式下的耗时和内存
+
+用法：
+    python -m benchmarks.async_result_benchmark [--requests 20000]
+"""
+
+import argparse
+import gc
+import itertools
+import sys
+import threading
+import time
+from functools import partial
+from Queue import Queue, Full
+
+from concurrent.futures import Future
+
+from steamboat.executor import AsyncResult
+from steamboat.thread_pool_executor import ThreadPoolExecutor
+from steamboat.cabin import CabinBuilder
+from steamboat.steamboat import SteamBoat
+
+
+class LegacyAsyncResult(Future):
+    """
+    旧的实现，仅用于对比
+    """
+    counter = itertools.count().next
+    lock = threading.Lock()
+
+    def __init__(self, deadline=None, record_time_info=True):
+        Future.__init__(self)
+        self._time_info = {}
+        with self.lock:
+            self._id = self.counter()
+        self._deadline = deadline
+
+    @property
+    def time_info(self):
+        return self._time_info
+
+    def set_time_info(self, key, timestamp=None):
+        self._time_info[key] = timestamp or time.time()
+        return self
+
+    def merge_time_info(self, async_result):
+        self._time_info.update(async_result.time_info)
+        return self
+
+
+def _chain_callback(outer, inner):
+    outer.set_running_or_notify_cancel()
+    outer.set_time_info("left_cabin_at")
+    outer.merge_time_info(inner)
+    outer.set_result(inner.result())
+
+
+def simulate_request(cls, record_time_info):
+    steamboat_ar = cls(record_time_info=record_time_info)
+    steamboat_ar.set_time_info("putted_into_steamboat_at")
+    cabin_ar = cls(record_time_info=record_time_info)
+    cabin_ar.set_time_info("putted_into_cabin_at")
+    executor_ar = cls(record_time_info=record_time_info)
+    executor_ar.set_time_info("submitted_to_queue_at")
+    executor_ar.add_done_callback(partial(_chain_callback, cabin_ar))
+    cabin_ar.add_done_callback(partial(_chain_callback, steamboat_ar))
+
+    executor_ar.set_time_info("consumed_from_queue_at")
+    executor_ar.set_running_or_notify_cancel()
+    executor_ar.set_time_info("executed_completion_at").set_result(None)
+    return steamboat_ar, cabin_ar, executor_ar
+
+
+def deep_size(obj, seen):
+    """
+    粗略计算对象及其引用的对象（不包括类型、模块、函数）占用的内存
+    """
+    if id(obj) in seen or isinstance(obj, (type, type(sys), type(deep_size))):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    for referent in gc.get_referents(obj):
+        size = size + deep_size(referent, seen)
+    return size
+
+
+def measure_chain(cls, record_time_info, requests):
+    gc.collect()
+    gc.disable()
+    try:
+        object_count = len(gc.get_objects())
+        kept = [simulate_request(cls, record_time_info) for _ in range(1000)]
+        allocations = (len(gc.get_objects()) - object_count - 1) / 1000.
+    finally:
+        gc.enable()
+    seen = set()
+    size = sum(deep_size(ar, seen) for ars in kept for ar in ars) / 1000.
+    del kept
+
+    start_time = time.time()
+    for _ in range(requests):
+        simulate_request(cls, record_time_info)
+    ns_per_request = (time.time() - start_time) / requests * 1e9
+    return allocations, size, ns_per_request
+
+
+def create_steamboat(executor, record_time_info, shared_async_result):
+    cabin = CabinBuilder() \
+        .with_name("benchmark") \
+        .with_executor(executor) \
+        .with_timeout(60) \
+        .with_open_length(60) \
+        .with_closed_length(1) \
+        .with_half_open_length(1) \
+        .with_failure_ratio_threshold(1) \
+        .with_failure_count_threshold(1000000) \
+        .with_half_failure_count_threshold(1000000) \
+        .with_record_time_info(record_time_info) \
+        .with_shared_async_result(shared_async_result) \
+        .build()
+    return SteamBoat().add_cabin(cabin), cabin
+
+
+def measure_steamboat(record_time_info, shared_async_result, requests):
+    def reject_handler(queue, task_item):
+        raise Full
+
+    executor = ThreadPoolExecutor(
+        4, Queue(), reject_handler, record_time_info=record_time_info)
+    steamboat, cabin = create_steamboat(
+        executor, record_time_info, shared_async_result)
+
+    # 阻塞所有工作线程，测量在途请求占用的对象数量和内存
+    event = threading.Event()
+    blockers = [steamboat.submit_task("benchmark", event.wait)
+                for _ in range(4)]
+    time.sleep(0.1)
+    gc.collect()
+    gc.disable()
+    try:
+        existing = set(id(obj) for obj in gc.get_objects())
+        in_flight = [steamboat.submit_task("benchmark", int, ind)
+                     for ind in range(1000)]
+        # 在途请求新创建的、被 gc 跟踪的对象（不包括 in_flight 列表本身）
+        created = [obj for obj in gc.get_objects()
+                   if id(obj) not in existing and obj is not in_flight]
+        allocations = len(created) / 1000.
+        size = sum(sys.getsizeof(obj) for obj in created) / 1000.
+        del created
+    finally:
+        gc.enable()
+    event.set()
+    for async_result in blockers + in_flight:
+        async_result.result()
+    del in_flight
+
+    start_time = time.time()
+    async_results = [steamboat.submit_task("benchmark", int, ind)
+                     for ind in range(requests)]
+    for async_result in async_results:
+        async_result.result()
+    ns_per_request = (time.time() - start_time) / requests * 1e9
+    executor.shutdown()
+    cabin.shutdown()
+    return allocations, size, ns_per_request
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    print "three-result chain per request:"
+    print "%-18s %-7s %12s %12s %12s" % (
+        "implementation", "timing", "gc objects", "bytes", "ns")
+    for cls in (LegacyAsyncResult, AsyncResult):
+        for record_time_info in (True, False):
+            if cls is LegacyAsyncResult and not record_time_info:
+                continue
+            allocations, size, ns = measure_chain(
+                cls, record_time_info, args.requests)
+            print "%-18s %-7s %12.1f %12.0f %12.0f" % (
+                cls.__name__, record_time_info, allocations, size, ns)
+
+    print
+    print "SteamBoat end to end:"
+    print "%-8s %-7s %12s %12s %12s" % (
+        "dispatch", "timing", "gc objects", "bytes", "ns")
+    for shared_async_result in (False, True):
+        for record_time_info in (True, False):
+            allocations, size, ns = measure_steamboat(
+                record_time_info, shared_async_result, args.requests)
+            print "%-8s %-7s %12.1f %12.0f %12.0f" % (
+                "shared" if shared_async_result else "layered",
+                record_time_info, allocations, size, ns)
+
+if __name__ == "__main__":
+    main()
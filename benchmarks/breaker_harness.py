@@ -0,0 +1,397 @@
+# coding: utf8
+
+"""
+熔断参数的故障注入测试工具
+
+在进程内运行一个可编排的模拟后端（延迟分布、错误率、故障时间表），
+用若干个客户端线程通过配置好的 SteamBoat 持续调用它，并报告：
+    time_to_trip        故障开始之后，窗口进入关闭状态所用的时间
+    time_to_recover     故障结束之后，窗口重新打开所用的时间
+    wasted_calls        故障期间仍然到达后端的调用次数
+    rejected_good_calls 后端健康时被熔断拒绝的调用次数
+    p99 延迟
+支持对 Cabin 的参数进行网格扫描，不依赖任何外部服务
+
+用法：
+    python -m benchmarks.breaker_harness
+    python -m benchmarks.breaker_harness \\
+        --schedule 2:0,3:1,4:0 \\
+        --sweep failure_ratio_threshold=0.3,0.5,0.8 --sweep closed_length=0.5,2 \\
+        --output sweep.json
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from Queue import Queue, Full
+
+from steamboat.cabin import CabinBuilder
+from steamboat.degradation_strategy import DegradationStrategy
+from steamboat.steamboat import SteamBoat
+from steamboat.thread_pool_executor import ThreadPoolExecutor
+from steamboat.window import WindowStatus
+
+DEFAULT_CABIN_PARAMS = {
+    "timeout": 0.5,
+    "open_length": 1.,
+    "closed_length": 1.,
+    "half_open_length": 1.,
+    "failure_ratio_threshold": 0.5,
+    "failure_count_threshold": 10,
+    "half_failure_count_threshold": 3,
+    "recovery_ratio_threshold": None,
+    "recovery_count_threshold": None,
+    "half_open_probability": 0.3,
+}
+
+
+class BackendError(StandardError):
+    pass
+
+
+class Phase(object):
+    """
+    故障时间表中的一段
+    """
+    def __init__(self,
+                 duration,
+                 failure_ratio=0.,
+                 latency=0.002,
+                 latency_distribution="lognormal",
+                 outage=None):
+        """
+        @param duration float 持续时间（秒）
+        @param failure_ratio float 调用失败的概率
+        @param latency float 延迟的中位数（秒）
+        @param latency_distribution string fixed、uniform（0.5 到 1.5 倍）、
+            lognormal（长尾）
+        @param outage bool、None 是否算作故障期，默认是 failure_ratio >= 0.5
+        """
+        self.duration = duration
+        self.failure_ratio = failure_ratio
+        self.latency = latency
+        self.latency_distribution = latency_distribution
+        self.outage = failure_ratio >= 0.5 if outage is None else outage
+
+    def sample_latency(self):
+        if self.latency_distribution == "fixed":
+            return self.latency
+        if self.latency_distribution == "uniform":
+            return self.latency * random.uniform(0.5, 1.5)
+        return random.lognormvariate(0, 0.5) * self.latency
+
+    def to_dict(self):
+        return {"duration": self.duration,
+                "failure_ratio": self.failure_ratio,
+                "latency": self.latency,
+                "latency_distribution": self.latency_distribution,
+                "outage": self.outage}
+
+
+class StubBackend(object):
+    """
+    按照时间表模拟后端。start 之后，根据经过的时间决定当前所处的阶段
+    """
+    def __init__(self, phases):
+        self._phases = phases
+        self._phase_starts = []
+        offset = 0.
+        for phase in phases:
+            self._phase_starts.append(offset)
+            offset = offset + phase.duration
+        self._duration = offset
+        self._start_time = None
+        self._lock = threading.Lock()
+        self._call_counts = [0] * len(phases)
+
+    def start(self, start_time=None):
+        self._start_time = time.time() if start_time is None else start_time
+
+    def get_duration(self):
+        return self._duration
+
+    def get_phase_starts(self):
+        return list(self._phase_starts)
+
+    def get_phase_index(self, timestamp):
+        offset = timestamp - self._start_time
+        for index in range(len(self._phases) - 1, -1, -1):
+            if offset >= self._phase_starts[index]:
+                return index
+        return 0
+
+    def get_call_counts(self):
+        return list(self._call_counts)
+
+    def __call__(self):
+        index = self.get_phase_index(time.time())
+        phase = self._phases[index]
+        with self._lock:
+            self._call_counts[index] = self._call_counts[index] + 1
+        time.sleep(phase.sample_latency())
+        if random.random() < phase.failure_ratio:
+            raise BackendError("injected failure")
+        return "ok"
+
+
+class OutcomeStrategy(DegradationStrategy):
+    """
+    把降级的原因作为结果返回，便于统计
+    """
+    cheap = True
+
+    def on_submit_task_error(self, exc, f, a, kw):
+        return "submit_error"
+
+    def on_window_half_open(self, f, a, kw):
+        return "rejected"
+
+    def on_window_closed(self, f, a, kw):
+        return "rejected"
+
+    def on_timeout_reached(self, f, a, kw):
+        return "timeout"
+
+    def on_exception(self, exc, f, a, kw):
+        return "error"
+
+
+def reject_handler(queue, task_item):
+    raise Full
+
+
+def build_cabin(executor, params):
+    builder = CabinBuilder().with_name("backend").with_executor(executor)
+    for key, value in params.iteritems():
+        getattr(builder, "with_%s" % key)(value)
+    return builder.build()
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(int(len(sorted_values) * p / 100.), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def run_scenario(phases,
+                 cabin_params=None,
+                 clients=16,
+                 worker_count=8,
+                 queue_size=64,
+                 monitor_interval=0.005):
+    """
+    运行一次故障注入
+
+    @param phases list Phase 列表
+    @param cabin_params dict 覆盖 DEFAULT_CABIN_PARAMS 中的 Cabin 参数
+    @param clients int 客户端线程的数量（闭环，每个线程同一时刻只有一个请求）
+    @return dict 报告
+    """
+    params = dict(DEFAULT_CABIN_PARAMS)
+    params.update(cabin_params or {})
+    backend = StubBackend(phases)
+    executor = ThreadPoolExecutor(worker_count, Queue(queue_size), reject_handler)
+    cabin = build_cabin(executor, params)
+    steamboat = SteamBoat()
+    steamboat.set_default_cabin(cabin, OutcomeStrategy())
+
+    stopped = threading.Event()
+    transitions = []  # [(timestamp, status)]
+    calls = []  # [(start_time, latency, outcome)]
+    calls_lock = threading.Lock()
+
+    def _monitor():
+        window = cabin.get_window()
+        last_status = None
+        while not stopped.is_set():
+            now = time.time()
+            status = window.get_status(now)
+            if status != last_status:
+                transitions.append((now, status))
+                last_status = status
+            time.sleep(monitor_interval)
+
+    def _client():
+        local_calls = []
+        while not stopped.is_set():
+            start_time = time.time()
+            try:
+                outcome = steamboat.submit_task("backend", backend).result()
+            except Exception:
+                outcome = "error"
+            local_calls.append((start_time, time.time() - start_time, outcome))
+        with calls_lock:
+            calls.extend(local_calls)
+
+    start_time = time.time()
+    backend.start(start_time)
+    threads = [threading.Thread(target=_monitor)]
+    threads.extend(threading.Thread(target=_client) for _ in range(clients))
+    for thread in threads:
+        thread.setDaemon(True)
+        thread.start()
+    time.sleep(backend.get_duration())
+    stopped.set()
+    for thread in threads:
+        thread.join()
+    cabin.shutdown()
+    executor.shutdown()
+
+    return build_report(phases, params, backend, start_time, transitions, calls)
+
+
+def _first_transition(transitions, since, statuses):
+    for timestamp, status in transitions:
+        if timestamp >= since and status in statuses:
+            return timestamp
+    return None
+
+
+def build_report(phases, params, backend, start_time, transitions, calls):
+    phase_starts = [start_time + offset for offset in backend.get_phase_starts()]
+    call_counts = backend.get_call_counts()
+
+    outages = []
+    for index, phase in enumerate(phases):
+        if not phase.outage:
+            continue
+        outage_start = phase_starts[index]
+        outage_end = outage_start + phase.duration
+        tripped_at = _first_transition(
+            transitions, outage_start, (WindowStatus.CLOSED, ))
+        if tripped_at is not None and tripped_at >= outage_end:
+            tripped_at = None
+        recovered_at = _first_transition(
+            transitions, outage_end, (WindowStatus.OPEN, ))
+        outages.append({
+            "phase": index,
+            "time_to_trip": None if tripped_at is None
+            else tripped_at - outage_start,
+            "time_to_recover": None if recovered_at is None
+            else recovered_at - outage_end,
+            "wasted_calls": call_counts[index],
+        })
+
+    outcomes = {}
+    rejected_good_calls = 0
+    latencies = []
+    phase_latencies = [[] for _ in phases]
+    for call_start_time, latency, outcome in calls:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        index = backend.get_phase_index(call_start_time)
+        latencies.append(latency)
+        phase_latencies[index].append(latency)
+        if outcome == "rejected" and not phases[index].outage:
+            rejected_good_calls = rejected_good_calls + 1
+    latencies.sort()
+
+    return {
+        "cabin_params": params,
+        "phases": [phase.to_dict() for phase in phases],
+        "calls": len(calls),
+        "outcomes": outcomes,
+        "outages": outages,
+        "wasted_calls": sum(outage["wasted_calls"] for outage in outages),
+        "rejected_good_calls": rejected_good_calls,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p99": percentile(latencies, 99),
+        "phase_latency_p99": [percentile(sorted(values), 99)
+                              for values in phase_latencies],
+        "transitions": [
+            (timestamp - start_time,
+             {WindowStatus.OPEN: "open",
+              WindowStatus.HALF_OPEN: "half_open",
+              WindowStatus.CLOSED: "closed"}.get(status))
+            for timestamp, status in transitions],
+    }
+
+
+def sweep(phases, grid, **kwargs):
+    """
+    对 grid 中各个参数取值的笛卡尔积分别运行一次
+
+    @param grid dict 参数名称 -> 取值列表
+    @return list 报告列表
+    """
+    keys = sorted(grid)
+    reports = []
+    for values in itertools.product(*[grid[key] for key in keys]):
+        cabin_params = dict(zip(keys, values))
+        print >> sys.stderr, "running %s" % cabin_params
+        reports.append(run_scenario(phases, cabin_params, **kwargs))
+    return reports
+
+
+def parse_schedule(schedule, latency):
+    """
+    “持续时间:错误率”以逗号分隔，比如 2:0,3:1,4:0
+    """
+    phases = []
+    for item in schedule.split(","):
+        duration, failure_ratio = item.split(":")
+        phases.append(Phase(float(duration), float(failure_ratio), latency))
+    return phases
+
+
+def parse_value(value):
+    if value == "None":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--schedule", default="2:0,3:1,4:0",
+                        help="comma separated duration:failure_ratio phases")
+    parser.add_argument("--latency", type=float, default=0.002,
+                        help="median backend latency in seconds")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--set", action="append", default=[],
+                        help="cabin parameter, e.g. closed_length=2")
+    parser.add_argument("--sweep", action="append", default=[],
+                        help="cabin parameter to sweep, e.g. closed_length=1,2,4")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    phases = parse_schedule(args.schedule, args.latency)
+    base_params = {}
+    for item in args.set:
+        key, value = item.split("=", 1)
+        base_params[key] = parse_value(value)
+    grid = dict((key, [value]) for key, value in base_params.iteritems())
+    for item in args.sweep:
+        key, values = item.split("=", 1)
+        grid[key] = [parse_value(value) for value in values.split(",")]
+
+    reports = sweep(phases, grid, clients=args.clients)
+    for report in reports:
+        outage = report["outages"][0] if report["outages"] else {}
+        print >> sys.stderr, \
+            "%s trip=%s recover=%s wasted=%d rejected_good=%d p99=%.4f" % (
+                dict((key, report["cabin_params"][key]) for key in grid),
+                outage.get("time_to_trip"),
+                outage.get("time_to_recover"),
+                report["wasted_calls"],
+                report["rejected_good_calls"],
+                report["latency_p99"] or 0)
+
+    output = json.dumps(reports, indent=2, sort_keys=True)
+    if args.output is None:
+        print output
+    else:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# coding: utf8
+
+"""
+任务完成之后仍然存活的任务参数
+
+先提交 in_flight 个一直阻塞的长任务，使 Pending Tasks 中有大量在途任务；
+再提交 tasks 个携带较大参数的短任务，并等待它们完成。
+Cabin 的超时时间很长，检查线程不会因为超时而清理 Pending Tasks。
+调用方持有全部 AsyncResult，统计短任务完成之后仍然存活的参数数量与字节数，
+以及长任务阻塞期间进程消耗的 CPU，
+分别在三层 AsyncResult、共用一个 AsyncResult 两种分发方式下测量
+
+用法：
+    python -m benchmarks.payload_memory_benchmark \\
+        [--in-flight 300] [--tasks 200] [--size 262144]
+"""
+
+import argparse
+import gc
+import os
+import threading
+import time
+import weakref
+from Queue import Queue, Full
+
+from steamboat.thread_pool_executor import ThreadPoolExecutor
+from steamboat.cabin import CabinBuilder
+from steamboat.steamboat import SteamBoat
+
+
+class Payload(object):
+    def __init__(self, size):
+        self.data = bytearray(size)
+
+
+def consume(payload):
+    return len(payload.data)
+
+
+def reject_handler(queue, task_item):
+    raise Full
+
+
+def create_steamboat(executor, shared_async_result):
+    cabin = CabinBuilder() \
+        .with_name("benchmark") \
+        .with_executor(executor) \
+        .with_timeout(600) \
+        .with_open_length(60) \
+        .with_closed_length(1) \
+        .with_half_open_length(1) \
+        .with_failure_ratio_threshold(1) \
+        .with_failure_count_threshold(1000000) \
+        .with_half_failure_count_threshold(1000000) \
+        .with_shared_async_result(shared_async_result) \
+        .build()
+    return SteamBoat().add_cabin(cabin), cabin
+
+
+def measure(shared_async_result, in_flight, tasks, size):
+    executor = ThreadPoolExecutor(in_flight + 4, Queue(), reject_handler)
+    steamboat, cabin = create_steamboat(executor, shared_async_result)
+    event = threading.Event()
+    try:
+        blockers = [steamboat.submit_task("benchmark", event.wait)
+                    for _ in range(in_flight)]
+        payloads = []
+
+        def create_payload():
+            payload = Payload(size)
+            payloads.append(weakref.ref(payload))
+            return payload
+
+        async_results = [steamboat.submit_task("benchmark", consume,
+                                               create_payload())
+                         for _ in range(tasks)]
+        for async_result in async_results:
+            async_result.result()
+        # 等待回调全部执行完成
+        time.sleep(0.1)
+        gc.collect()
+        retained = sum(1 for payload in payloads if payload() is not None)
+        pending = cabin.get_pending_task_count()
+        # 在途任务阻塞期间，进程（主要是检查线程）消耗的 CPU 时间
+        cpu_time = sum(os.times()[:2])
+        time.sleep(1)
+        idle_cpu = sum(os.times()[:2]) - cpu_time
+        event.set()
+        for async_result in blockers:
+            async_result.result()
+        return retained, retained * size, pending, idle_cpu
+    finally:
+        event.set()
+        cabin.shutdown()
+        executor.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--in-flight", type=int, default=300)
+    parser.add_argument("--tasks", type=int, default=200)
+    parser.add_argument("--size", type=int, default=262144)
+    args = parser.parse_args()
+
+    print "%d completed tasks with %d-byte payloads, %d tasks in flight:" % (
+        args.tasks, args.size, args.in_flight)
+    print "%-8s %18s %14s %14s %14s" % (
+        "dispatch", "retained payloads", "retained MB", "pending tasks",
+        "idle cpu %")
+    for shared_async_result in (False, True):
+        retained, retained_bytes, pending, idle_cpu = measure(
+            shared_async_result, args.in_flight, args.tasks, args.size)
+        print "%-8s %18d %14.1f %14d %14.0f" % (
+            "shared" if shared_async_result else "layered",
+            retained, retained_bytes / 1048576., pending, idle_cpu * 100)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# coding: utf8
+
+"""
+对比逐个提交与批量提交的单任务开销
+
+用法：
+    python -m benchmarks.submit_many_benchmark [--tasks 20000]
+"""
+
+import argparse
+import time
+from Queue import Queue, Full
+
+from steamboat.thread_pool_executor import ThreadPoolExecutor
+from steamboat.cabin import CabinBuilder
+
+BATCH_SIZES = [1, 10, 100, 1000]
+
+
+def noop(ind):
+    return ind
+
+
+def reject_handler(queue, task_item):
+    raise Full
+
+
+def create_executor():
+    return ThreadPoolExecutor(4, Queue(), reject_handler)
+
+
+def create_cabin(executor):
+    return CabinBuilder() \
+        .with_name("benchmark") \
+        .with_executor(executor) \
+        .with_timeout(60) \
+        .with_open_length(60) \
+        .with_closed_length(1) \
+        .with_half_open_length(1) \
+        .with_failure_ratio_threshold(1) \
+        .with_failure_count_threshold(1000000) \
+        .with_half_failure_count_threshold(1000000) \
+        .build()
+
+
+def run_one_by_one(submit_task, task_count, batch_size):
+    submit_cost = 0.
+    async_results = []
+    start_time = time.time()
+    for _ in range(task_count // batch_size):
+        batch_start_time = time.time()
+        for ind in range(batch_size):
+            async_results.append(submit_task(noop, ind))
+        submit_cost = submit_cost + time.time() - batch_start_time
+    for async_result in async_results:
+        async_result.result()
+    return submit_cost, time.time() - start_time, len(async_results)
+
+
+def run_in_batches(submit_many, task_count, batch_size):
+    submit_cost = 0.
+    async_results = []
+    start_time = time.time()
+    for _ in range(task_count // batch_size):
+        tasks = [(noop, (ind, ), {}) for ind in range(batch_size)]
+        batch_start_time = time.time()
+        async_results.extend(submit_many(tasks))
+        submit_cost = submit_cost + time.time() - batch_start_time
+    for async_result in async_results:
+        async_result.result()
+    return submit_cost, time.time() - start_time, len(async_results)
+
+
+def report(target, mode, batch_size, costs):
+    submit_cost, total_cost, count = costs
+    print "%-8s %-10s %6d %14.0f %14.0f" % (
+        target,
+        mode,
+        batch_size,
+        submit_cost / count * 1e9,
+        total_cost / count * 1e9)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=20000)
+    args = parser.parse_args()
+
+    print "%-8s %-10s %6s %14s %14s" % (
+        "target", "mode", "batch", "submit ns/task", "total ns/task")
+    for batch_size in BATCH_SIZES:
+        executor = create_executor()
+        report("executor", "loop", batch_size,
+               run_one_by_one(executor.submit_task, args.tasks, batch_size))
+        report("executor", "batch", batch_size,
+               run_in_batches(executor.submit_many, args.tasks, batch_size))
+        executor.shutdown()
+
+    for batch_size in BATCH_SIZES:
+        executor = create_executor()
+        cabin = create_cabin(executor)
+        report("cabin", "loop", batch_size,
+               run_one_by_one(cabin.execute, args.tasks, batch_size))
+        report("cabin", "batch", batch_size,
+               run_in_batches(cabin.execute_many, args.tasks, batch_size))
+        executor.shutdown()
+        cabin.shutdown()
+
+
+if __name__ == "__main__":
+    main()
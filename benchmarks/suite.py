@@ -0,0 +1,542 @@
+# coding: utf8
+
+"""
+steamboat 热路径的基准测试集
+
+微基准：
+    Window.update_status、Window.get_status 在多线程竞争下的吞吐量
+    Cabin.execute 的准入开销（放行、拒绝），Cabin.call 的直接调用开销
+    AsyncResult 的创建与回调链
+    ThreadPoolExecutor、TornadoCoroutineExecutor 的吞吐量与延迟
+宏场景：
+    完整的 SteamBoat 在模拟后端（健康、部分失败、慢）上的吞吐量、延迟与结果分布
+
+结果以 JSON 格式输出，可以与其它提交的结果进行对比
+
+用法：
+    python -m benchmarks.suite [--filter window] [--scale 0.1] [--output result.json]
+    python -m benchmarks.suite --compare baseline.json --output result.json
+    python -m benchmarks.suite --list
+"""
+
+import argparse
+import json
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from functools import partial
+from Queue import Queue, Full
+
+from steamboat.cabin import CabinBuilder
+from steamboat.degradation_strategy import DegradationStrategy
+from steamboat.executor import AsyncResult, Executor
+from steamboat.inline_executor import InlineExecutor
+from steamboat.steamboat import SteamBoat
+from steamboat.thread_pool_executor import ThreadPoolExecutor
+from steamboat.window import Window, WindowStatus
+
+BENCHMARKS = []  # [(name, group, function)]
+
+
+def benchmark(name, group):
+    def _inner(function):
+        BENCHMARKS.append((name, group, function))
+        return function
+    return _inner
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(int(len(sorted_values) * p / 100.), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def latency_metrics(latencies):
+    latencies = sorted(latencies)
+    return {
+        "latency_p50_us": percentile(latencies, 50) * 1e6,
+        "latency_p99_us": percentile(latencies, 99) * 1e6,
+        "latency_max_us": latencies[-1] * 1e6,
+    }
+
+
+def run_in_threads(thread_count, target):
+    """
+    在 thread_count 个线程中同时执行 target，返回总耗时
+    """
+    barrier = threading.Event()
+
+    def _run():
+        barrier.wait()
+        target()
+
+    threads = [threading.Thread(target=_run) for _ in range(thread_count)]
+    for thread in threads:
+        thread.start()
+    start_time = time.time()
+    barrier.set()
+    for thread in threads:
+        thread.join()
+    return time.time() - start_time
+
+
+def reject_handler(queue, task_item):
+    raise Full
+
+
+def noop(*a):
+    return None
+
+
+class ImmediateExecutor(Executor):
+    """
+    在调用方线程中直接执行任务，用来单独测量 Cabin 的开销
+    """
+    def submit_task(self, func, *args, **kwargs):
+        return self.submit_task_with_result(AsyncResult(), func, *args, **kwargs)
+
+    def submit_task_with_result(self, async_result, func, *args, **kwargs):
+        async_result.set_running_or_notify_cancel()
+        async_result.set_result(func(*args, **kwargs))
+        return async_result
+
+    def shutdown(self, wait_time=None):
+        pass
+
+
+def create_window():
+    return Window(0, WindowStatus.OPEN, 10, 1, 1, 1., 10 ** 9, 10 ** 9, None, None)
+
+
+def create_cabin(executor, name="benchmark", timeout=60, failure_count_threshold=10 ** 9):
+    return CabinBuilder() \
+        .with_name(name) \
+        .with_executor(executor) \
+        .with_timeout(timeout) \
+        .with_open_length(10) \
+        .with_closed_length(1) \
+        .with_half_open_length(1) \
+        .with_failure_ratio_threshold(0.5) \
+        .with_failure_count_threshold(failure_count_threshold) \
+        .with_half_failure_count_threshold(10) \
+        .with_half_open_probability(0.5) \
+        .build()
+
+
+def window_benchmark(scale, method, thread_count):
+    window = create_window()
+    iterations = int(100000 * scale)
+    if method == "update_status":
+        def _target():
+            update_status = window.update_status
+            for _ in xrange(iterations):
+                update_status(time.time(), 1, 0, 0, 0)
+    else:
+        def _target():
+            get_status = window.get_status
+            for _ in xrange(iterations):
+                get_status(time.time())
+    elapsed = run_in_threads(thread_count, _target)
+    operations = iterations * thread_count
+    return {"threads": thread_count,
+            "ops_per_sec": operations / elapsed,
+            "ns_per_op": elapsed / operations * 1e9}
+
+
+for _thread_count in (1, 4, 16):
+    benchmark("window.update_status.threads_%d" % _thread_count, "micro")(
+        partial(window_benchmark, method="update_status",
+                thread_count=_thread_count))
+    benchmark("window.get_status.threads_%d" % _thread_count, "micro")(
+        partial(window_benchmark, method="get_status",
+                thread_count=_thread_count))
+
+
+def cabin_admission_benchmark(scale, admitted, shared_async_result):
+    cabin = CabinBuilder() \
+        .with_name("benchmark") \
+        .with_executor(ImmediateExecutor()) \
+        .with_timeout(60) \
+        .with_open_length(10) \
+        .with_closed_length(600) \
+        .with_half_open_length(1) \
+        .with_failure_ratio_threshold(0.5) \
+        .with_failure_count_threshold(1) \
+        .with_half_failure_count_threshold(1) \
+        .with_shared_async_result(shared_async_result) \
+        .build()
+    try:
+        if not admitted:
+            # 让窗口进入关闭状态，之后的请求都会被拒绝
+            cabin.get_window().update_status(time.time(), 0, 1, 0, 0)
+        iterations = int(50000 * scale)
+        execute = cabin.execute
+        start_time = time.time()
+        for _ in xrange(iterations):
+            execute(noop)
+        elapsed = time.time() - start_time
+    finally:
+        cabin.shutdown()
+    return {"ops_per_sec": iterations / elapsed,
+            "ns_per_op": elapsed / iterations * 1e9}
+
+
+for _admitted in (True, False):
+    for _shared in (False, True):
+        benchmark("cabin.execute.%s.%s" % (
+            "admitted" if _admitted else "rejected",
+            "shared" if _shared else "layered"), "micro")(
+                partial(cabin_admission_benchmark,
+                        admitted=_admitted, shared_async_result=_shared))
+
+
+@benchmark("cabin.call.inline", "micro")
+def cabin_inline_call_benchmark(scale):
+    executor = InlineExecutor(4)
+    cabin = create_cabin(executor)
+    try:
+        iterations = int(50000 * scale)
+        call = cabin.call
+        start_time = time.time()
+        for _ in xrange(iterations):
+            call(noop)
+        elapsed = time.time() - start_time
+    finally:
+        cabin.shutdown()
+        executor.shutdown()
+    return {"ops_per_sec": iterations / elapsed,
+            "ns_per_op": elapsed / iterations * 1e9}
+
+
+@benchmark("async_result.create", "micro")
+def async_result_create_benchmark(scale):
+    iterations = int(200000 * scale)
+    start_time = time.time()
+    for _ in xrange(iterations):
+        AsyncResult()
+    elapsed = time.time() - start_time
+    return {"ops_per_sec": iterations / elapsed,
+            "ns_per_op": elapsed / iterations * 1e9}
+
+
+def _transfer(outer, inner):
+    outer.set_running_or_notify_cancel()
+    outer.set_result(inner.result())
+
+
+@benchmark("async_result.callback_chain", "micro")
+def async_result_callback_chain_benchmark(scale):
+    """
+    三层 AsyncResult（SteamBoat、Cabin、Executor）通过回调传递结果
+    """
+    iterations = int(50000 * scale)
+    start_time = time.time()
+    for _ in xrange(iterations):
+        steamboat_result = AsyncResult()
+        cabin_result = AsyncResult()
+        executor_result = AsyncResult()
+        cabin_result.add_done_callback(partial(_transfer, steamboat_result))
+        executor_result.add_done_callback(partial(_transfer, cabin_result))
+        executor_result.set_running_or_notify_cancel()
+        executor_result.set_result(1)
+    elapsed = time.time() - start_time
+    return {"ops_per_sec": iterations / elapsed,
+            "ns_per_op": elapsed / iterations * 1e9}
+
+
+@benchmark("async_result.continuation_chain", "micro")
+def async_result_continuation_chain_benchmark(scale):
+    """
+    共用一个 AsyncResult，通过两层 continuation 传递结果
+    """
+    def _continuation(async_result, result, exception):
+        async_result.set_result(result)
+
+    iterations = int(50000 * scale)
+    start_time = time.time()
+    for _ in xrange(iterations):
+        async_result = AsyncResult()
+        async_result.add_continuation(_continuation)
+        async_result.add_continuation(_continuation)
+        async_result.set_running_or_notify_cancel()
+        async_result.set_result(1)
+    elapsed = time.time() - start_time
+    return {"ops_per_sec": iterations / elapsed,
+            "ns_per_op": elapsed / iterations * 1e9}
+
+
+def executor_throughput(executor, submit_task, function, task_count):
+    start_time = time.time()
+    async_results = [submit_task(function) for _ in xrange(task_count)]
+    for async_result in async_results:
+        async_result.result()
+    elapsed = time.time() - start_time
+    return {"ops_per_sec": task_count / elapsed,
+            "ns_per_op": elapsed / task_count * 1e9}
+
+
+def executor_latency(submit_task, function, task_count):
+    """
+    逐个提交任务，测量从提交到调用方拿到结果的延迟
+    """
+    latencies = []
+    for _ in xrange(task_count):
+        start_time = time.time()
+        submit_task(function).result()
+        latencies.append(time.time() - start_time)
+    return latency_metrics(latencies)
+
+
+@benchmark("thread_pool_executor.throughput", "micro")
+def thread_pool_executor_throughput_benchmark(scale):
+    executor = ThreadPoolExecutor(4, Queue(), reject_handler)
+    try:
+        return executor_throughput(
+            executor, executor.submit_task, noop, int(50000 * scale))
+    finally:
+        executor.shutdown()
+
+
+@benchmark("thread_pool_executor.latency", "micro")
+def thread_pool_executor_latency_benchmark(scale):
+    executor = ThreadPoolExecutor(4, Queue(), reject_handler)
+    try:
+        return executor_latency(executor.submit_task, noop, int(5000 * scale))
+    finally:
+        executor.shutdown()
+
+
+def _run_tornado_executor(run):
+    """
+    在后台线程中运行 IOLoop，使用 (executor, coroutine_function) 调用 run
+    """
+    from tornado import gen
+    from tornado.ioloop import IOLoop
+    from tornado.queues import Queue as TornadoQueue
+    from steamboat.tornado_coroutine_executor import TornadoCoroutineExecutor
+
+    @gen.coroutine
+    def coroutine_noop():
+        raise gen.Return(None)
+
+    io_loop = IOLoop()
+    started = threading.Event()
+    holder = {}
+
+    def _io_loop_thread_run():
+        io_loop.make_current()
+        holder["executor"] = TornadoCoroutineExecutor(
+            4, TornadoQueue(), reject_handler, io_loop=io_loop)
+        io_loop.add_callback(started.set)
+        io_loop.start()
+
+    thread = threading.Thread(target=_io_loop_thread_run)
+    thread.setDaemon(True)
+    thread.start()
+    started.wait()
+    try:
+        return run(holder["executor"], coroutine_noop)
+    finally:
+        io_loop.add_callback(io_loop.stop)
+        thread.join()
+        io_loop.close()
+
+
+@benchmark("tornado_coroutine_executor.throughput", "micro")
+def tornado_executor_throughput_benchmark(scale):
+    return _run_tornado_executor(
+        lambda executor, function: executor_throughput(
+            executor, executor.submit_task_threadsafe, function,
+            int(20000 * scale)))
+
+
+@benchmark("tornado_coroutine_executor.latency", "micro")
+def tornado_executor_latency_benchmark(scale):
+    return _run_tornado_executor(
+        lambda executor, function: executor_latency(
+            executor.submit_task_threadsafe, function, int(2000 * scale)))
+
+
+class SimulatedBackend(object):
+    """
+    模拟后端：按照给定的延迟和失败率处理请求
+    """
+    def __init__(self, latency, failure_ratio):
+        self._latency = latency
+        self._failure_ratio = failure_ratio
+
+    def __call__(self):
+        if self._latency:
+            time.sleep(self._latency * random.uniform(0.5, 1.5))
+        if random.random() < self._failure_ratio:
+            raise RuntimeError("backend failure")
+        return "ok"
+
+
+class DefaultValueStrategy(DegradationStrategy):
+    cheap = True
+
+    def on_submit_task_error(self, exc, f, a, kw):
+        return "degraded"
+
+    def on_window_half_open(self, f, a, kw):
+        return "degraded"
+
+    def on_window_closed(self, f, a, kw):
+        return "degraded"
+
+    def on_timeout_reached(self, f, a, kw):
+        return "degraded"
+
+    def on_exception(self, exc, f, a, kw):
+        return "degraded"
+
+
+def steamboat_scenario(scale, latency, failure_ratio, timeout):
+    """
+    16 个客户端线程在一段时间内不停地通过 SteamBoat 调用模拟后端
+    """
+    executor = ThreadPoolExecutor(8, Queue(64), reject_handler)
+    cabin = create_cabin(executor, timeout=timeout, failure_count_threshold=20)
+    steamboat = SteamBoat()
+    steamboat.set_default_cabin(cabin, DefaultValueStrategy())
+    backend = SimulatedBackend(latency, failure_ratio)
+    duration = 2. * scale
+    client_count = 16
+
+    lock = threading.Lock()
+    latencies = []
+    outcomes = {"ok": 0, "degraded": 0, "error": 0}
+
+    def _client():
+        local_latencies = []
+        local_outcomes = {"ok": 0, "degraded": 0, "error": 0}
+        deadline = time.time() + duration
+        while time.time() < deadline:
+            start_time = time.time()
+            try:
+                outcome = steamboat.submit_task("benchmark", backend).result()
+            except Exception:
+                outcome = "error"
+            local_latencies.append(time.time() - start_time)
+            local_outcomes[outcome] = local_outcomes[outcome] + 1
+        with lock:
+            latencies.extend(local_latencies)
+            for key, value in local_outcomes.iteritems():
+                outcomes[key] = outcomes[key] + value
+
+    try:
+        elapsed = run_in_threads(client_count, _client)
+    finally:
+        cabin.shutdown()
+        executor.shutdown()
+    metrics = {"requests_per_sec": len(latencies) / elapsed,
+               "clients": client_count}
+    metrics.update(latency_metrics(latencies))
+    for key, value in outcomes.iteritems():
+        metrics["%s_ratio" % key] = value / float(len(latencies))
+    return metrics
+
+
+benchmark("steamboat.scenario.healthy", "macro")(partial(
+    steamboat_scenario, latency=0.001, failure_ratio=0., timeout=1))
+benchmark("steamboat.scenario.flaky", "macro")(partial(
+    steamboat_scenario, latency=0.001, failure_ratio=0.6, timeout=1))
+benchmark("steamboat.scenario.slow", "macro")(partial(
+    steamboat_scenario, latency=0.05, failure_ratio=0., timeout=0.02))
+
+
+def get_git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            stderr=open("/dev/null", "w")).strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline):
+    """
+    打印与 baseline 相比的变化。对于吞吐量，比值大于 1 表示变好；
+    对于耗时、延迟，比值小于 1 表示变好
+    """
+    baseline_results = dict(
+        (result["name"], result["metrics"]) for result in baseline["results"])
+    print >> sys.stderr, "%-50s %-20s %14s %14s %8s" % (
+        "benchmark", "metric", "baseline", "current", "ratio")
+    for result in results:
+        baseline_metrics = baseline_results.get(result["name"])
+        if baseline_metrics is None:
+            continue
+        for key, value in sorted(result["metrics"].iteritems()):
+            baseline_value = baseline_metrics.get(key)
+            if not isinstance(value, float) or not baseline_value:
+                continue
+            print >> sys.stderr, "%-50s %-20s %14.1f %14.1f %8.2f" % (
+                result["name"], key, baseline_value, value,
+                value / baseline_value)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--filter", default=None,
+                        help="only run benchmarks whose name contains it")
+    parser.add_argument("--group", choices=("micro", "macro"), default=None)
+    parser.add_argument("--scale", type=float, default=1.,
+                        help="multiply iterations and durations by it")
+    parser.add_argument("--output", default=None,
+                        help="write JSON to this file instead of stdout")
+    parser.add_argument("--compare", default=None,
+                        help="JSON file of a previous run to compare against")
+    parser.add_argument("--list", action="store_true")
+    args = parser.parse_args()
+
+    selected = [(name, group, function) for name, group, function in BENCHMARKS
+                if (args.filter is None or args.filter in name) and
+                (args.group is None or args.group == group)]
+    if args.list:
+        for name, group, _ in selected:
+            print "%-6s %s" % (group, name)
+        return
+
+    results = []
+    for name, group, function in selected:
+        print >> sys.stderr, "running %s" % name
+        start_time = time.time()
+        metrics = function(args.scale)
+        results.append({
+            "name": name,
+            "group": group,
+            "metrics": metrics,
+            "wall_time": time.time() - start_time,
+        })
+
+    report = {
+        "meta": {
+            "commit": get_git_commit(),
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "timestamp": time.time(),
+            "scale": args.scale,
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output is None:
+        print output
+    else:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,11 @@ setup(
     test_suite='steamboat_tests',
     install_requires=[
         'futures',
+        'monotonic; python_version < "3.3"',
         'requests',
         'tornado'
-    ]
+    ],
+    extras_require={
+        'simulator': ['numpy']
+    }
 )
@@ -0,0 +1,83 @@
+# coding: utf8
+
+import itertools
+import math
+
+
+class AdaptiveTimeout(object):
+    """
+    根据最近的成功请求的延迟计算超时时间：
+        timeout = percentile 分位数 × multiplier，限制在 [floor, ceiling] 之间
+
+    最近的 window_size 个延迟保存在环形缓冲区中，每记录 update_every 个延迟
+    重新计算一次分位数。记录延迟时不加锁：写入位置由 itertools.count 生成，
+    list 的赋值在 GIL 的保护下是原子的；读取的是上一次计算的结果，没有额外开销。
+    只记录成功的请求，超时的请求的延迟是未知的，所以后端变慢时超时时间逐步增大，
+    直到 ceiling
+    """
+    def __init__(self,
+                 floor,
+                 ceiling,
+                 percentile=99,
+                 multiplier=1.5,
+                 window_size=1024,
+                 min_samples=100,
+                 update_every=64):
+        """
+        @param floor float 超时时间的下限（秒）
+        @param ceiling float 超时时间的上限（秒）
+        @param percentile float 0 到 100 之间
+        @param multiplier float 分位数的倍数
+        @param window_size int 保存最近多少个延迟
+        @param min_samples int 样本数量达到该值之前，get_timeout 返回 None
+        @param update_every int 每记录多少个延迟，重新计算一次超时时间
+        """
+        if floor > ceiling:
+            raise ValueError("floor is greater than ceiling")
+        self._floor = floor
+        self._ceiling = ceiling
+        self._percentile = percentile
+        self._multiplier = multiplier
+        self._window_size = window_size
+        self._min_samples = min(min_samples, window_size)
+        self._update_every = max(update_every, 1)
+
+        self._samples = [0.] * window_size
+        self._next_index = itertools.count().next
+        self._sample_count = 0
+        self._quantile = None
+        self._timeout = None
+
+    def observe(self, latency):
+        index = self._next_index()
+        self._samples[index % self._window_size] = latency
+        self._sample_count = index + 1
+        if (index + 1) % self._update_every == 0:
+            self.update()
+
+    def update(self):
+        """
+        重新计算分位数与超时时间
+        """
+        count = min(self._sample_count, self._window_size)
+        if count < self._min_samples:
+            return
+        samples = sorted(self._samples[:count])
+        # nearest-rank
+        rank = int(math.ceil(self._percentile / 100. * count))
+        quantile = samples[min(max(rank, 1), count) - 1]
+        self._quantile = quantile
+        self._timeout = min(max(quantile * self._multiplier, self._floor),
+                            self._ceiling)
+
+    def get_quantile(self):
+        return self._quantile
+
+    def get_timeout(self):
+        """
+        @return float、None 当前的超时时间，样本不足时返回 None
+        """
+        return self._timeout
+
+    def get_sample_count(self):
+        return self._sample_count
@@ -9,10 +9,20 @@ import heapq
 
 from .window import WindowHalfOpenError, WindowClosedError, WindowStatus, Window
 from .executor import *
+from .metrics import CabinMetrics
+from .phase_latency import PhaseLatencyRecorder
+from .adaptive_timeout import AdaptiveTimeout
+from .inline_executor import InlineExecutor, BulkheadFullError
+from .traffic_recorder import NAN, SUCCESS, FAILURE, TIMEOUT, \
+    REJECTED_CLOSED, REJECTED_HALF_OPEN, SUBMIT_ERROR
 
 LOGGER = logging.getLogger(__name__)
 
 
+def _create_window(name, *a):
+    return Window(*a)
+
+
 class BaseError(StandardError):
     """
     异常类的基类
@@ -69,11 +79,22 @@ class Cabin(object):
                  half_failure_count_threshold,
                  recovery_ratio_threshold,
                  recovery_count_threshold,
-                 half_open_probability):
+                 half_open_probability,
+                 record_time_info=True,
+                 shared_async_result=False,
+                 metrics_registry=None,
+                 record_phase_latency=False,
+                 traffic_recorder=None,
+                 window_factory=None,
+                 adaptive_timeout=None,
+                 load_balancer=None):
         self._name = name
         self._executor = executor
         self._timeout = timeout
-        self._window = Window(
+        if window_factory is None:
+            window_factory = _create_window
+        self._window = window_factory(
+            name,
             0,
             WindowStatus.OPEN,
             open_length,
@@ -85,11 +106,41 @@ class Cabin(object):
             recovery_ratio_threshold,
             recovery_count_threshold)
         self._half_open_probability = half_open_probability
+        # 样本不足时，使用固定的 timeout
+        self._adaptive_timeout = None
+        if adaptive_timeout is not None:
+            self._adaptive_timeout = AdaptiveTimeout(**adaptive_timeout)
+        self._record_time_info = record_time_info
+        self._shared_async_result = shared_async_result
+        self._metrics = None
+        if metrics_registry is not None:
+            self._metrics = CabinMetrics(metrics_registry, name)
+            self._metrics.bind(
+                lambda: self._window.get_status(time.time()),
+                self.get_pending_task_count,
+                executor,
+                self.get_timeout)
+        # 各个阶段的耗时依赖于 AsyncResult 中记录的时间点
+        self._phase_latency_recorder = None
+        if record_phase_latency and record_time_info:
+            self._phase_latency_recorder = PhaseLatencyRecorder(
+                name, metrics_registry)
+        self._traffic_recorder = traffic_recorder
+        self._traffic_cabin_id = None
+        if traffic_recorder is not None:
+            self._traffic_cabin_id = traffic_recorder.register_cabin(name)
+        # 设置之后，任务以 f(endpoint, *a, **kw) 的形式执行
+        self._load_balancer = load_balancer
 
         self._shut_down_lock = threading.Lock()
         self._shut_down = False
         self._pending_task_condition = threading.Condition()
+        # 最小堆，元素是 (deadline, AsyncResult 的 id)。
+        # 只有尚未完成的任务保存在 _pending_async_results 中，
+        # 已经完成的任务的堆元素由检查线程在到期或者清理时丢弃，
+        # 所以任务完成之后，Cabin 不再引用它的 AsyncResult 与结果
         self._pending_tasks = []
+        self._pending_async_results = {}  # Map: id -> AsyncResult
         self._completed_task_count = 0
         self._check_async_results_thread_event = threading.Event()
         self._check_async_results_thread = threading.Thread(
@@ -103,48 +154,106 @@ class Cabin(object):
     def get_window(self):
         return self._window
 
+    def get_executor(self):
+        return self._executor
+
+    def is_time_info_recorded(self):
+        return self._record_time_info
+
+    def is_async_result_shared(self):
+        return self._shared_async_result
+
+    def get_metrics(self):
+        """
+        返回 CabinMetrics，没有设置 MetricsRegistry 时返回 None
+        """
+        return self._metrics
+
+    def get_phase_latency_recorder(self):
+        """
+        返回 PhaseLatencyRecorder，没有开启阶段耗时统计时返回 None
+        """
+        return self._phase_latency_recorder
+
+    def get_adaptive_timeout(self):
+        return self._adaptive_timeout
+
+    def get_load_balancer(self):
+        """
+        返回 LoadBalancer，没有设置时返回 None
+        """
+        return self._load_balancer
+
+    def get_timeout(self):
+        """
+        返回当前生效的超时时间
+        """
+        adaptive_timeout = self._adaptive_timeout
+        if adaptive_timeout is not None:
+            timeout = adaptive_timeout.get_timeout()
+            if timeout is not None:
+                return timeout
+        return self._timeout
+
+    def get_pending_task_count(self):
+        """
+        返回尚未完成的任务数量
+        """
+        return len(self._pending_async_results)
+
     def execute(self, f, *a, **kw):
-        cabin_async_result = AsyncResult()
+        if self._shared_async_result:
+            return self.execute_with_result(
+                AsyncResult(record_time_info=self._record_time_info),
+                f,
+                *a,
+                **kw)
+
+        cabin_async_result = AsyncResult(record_time_info=self._record_time_info)
         if self._shut_down:
             cabin_async_result.set_exception(ShutDownError("cabin closed"))
             return cabin_async_result
 
+        metrics = self._metrics
+        if metrics is not None:
+            metrics.submitted.inc()
         current_timestamp = time.time()
         window_status = self._window.get_status(current_timestamp)
         if window_status is None:
             LOGGER.error("invalid timestamp %f", current_timestamp)
-        elif window_status == WindowStatus.CLOSED:
-            cabin_async_result.set_exception(WindowClosedError(self._name))
+        rejection = self._get_rejection(window_status)
+        if rejection is not None:
+            self._record_rejection(rejection, current_timestamp, window_status)
+            cabin_async_result.set_exception(rejection)
             return cabin_async_result
-        elif window_status == WindowStatus.HALF_OPEN:
-            if self._half_open_probability == 0:
-                cabin_async_result.set_exception(WindowHalfOpenError(self._name))
-                return cabin_async_result
-            elif self._half_open_probability == 1:
-                pass
-            else:
-                if random.random() > self._half_open_probability:
-                    cabin_async_result.set_exception(WindowHalfOpenError(self._name))
-                    return cabin_async_result
 
         cabin_async_result.set_time_info("putted_into_cabin_at")
+        load_balancer = self._load_balancer
+        if load_balancer is not None:
+            f = load_balancer.bind(f)
         # 提交任务
         try:
             executor_async_result = self._executor.submit_task(f, *a, **kw)
         except Exception as exc:
+            if load_balancer is not None:
+                f.release()
             self._window.update_status(current_timestamp, 0, 0, 0, 1)
-            cabin_async_result.set_exception(SubmitTaskError(exc))
+            rejection = SubmitTaskError(exc)
+            self._record_rejection(rejection, current_timestamp, window_status)
+            cabin_async_result.set_exception(rejection)
             return cabin_async_result
 
-        executor_async_result.deadline = current_timestamp + self._timeout
+        if load_balancer is not None:
+            executor_async_result.add_done_callback(f.on_done)
+        timeout = self.get_timeout()
+        executor_async_result.deadline = current_timestamp + timeout
+        executor_async_result.timeout = timeout
         # 成功提交任务之后，将 AsyncResult 对象保存到 Pending Tasks
         with self._pending_task_condition:
             if self._shut_down:
                 cabin_async_result.set_exception(ShutDownError("cabin closed"))
                 return cabin_async_result
-            heapq.heappush(self._pending_tasks, executor_async_result)
-            if len(self._pending_tasks) == 1:
-                self._pending_task_condition.notify_all()
+            self._add_pending_task(executor_async_result)
 
         executor_async_result.add_done_callback(
             partial(self._done_callback, cabin_async_result)
@@ -154,15 +263,390 @@ class Cabin(object):
 
     submit_task = execute
 
+    def execute_with_result(self, async_result, f, *a, **kw):
+        """
+        执行任务，并将结果设置到调用方提供的 async_result 上。
+        Cabin 与 Executor 共用该 AsyncResult，Cabin 通过 continuation
+        更新窗口的统计信息，而不是再创建一个 AsyncResult 并添加回调
+        """
+        if self._shut_down:
+            async_result.set_exception(ShutDownError("cabin closed"))
+            return async_result
+
+        metrics = self._metrics
+        if metrics is not None:
+            metrics.submitted.inc()
+        current_timestamp = time.time()
+        window_status = self._window.get_status(current_timestamp)
+        if window_status is None:
+            LOGGER.error("invalid timestamp %f", current_timestamp)
+        rejection = self._get_rejection(window_status)
+        if rejection is not None:
+            self._record_rejection(rejection, current_timestamp, window_status)
+            async_result.set_exception(rejection)
+            return async_result
+
+        async_result.set_time_info("putted_into_cabin_at")
+        timeout = self.get_timeout()
+        async_result.deadline = current_timestamp + timeout
+        async_result.timeout = timeout
+        # 在交给 Executor 之前保存到 Pending Tasks，并添加 continuation，
+        # 任务可能在 submit_task_with_result 返回之前就已经完成
+        with self._pending_task_condition:
+            if self._shut_down:
+                async_result.set_exception(ShutDownError("cabin closed"))
+                return async_result
+            self._add_pending_task(async_result)
+        continuation = self._continuation
+        async_result.add_continuation(continuation)
+        load_balancer = self._load_balancer
+        if load_balancer is not None:
+            f = load_balancer.bind(f)
+            async_result.add_done_callback(f.on_done)
+        # 提交任务
+        try:
+            self._executor.submit_task_with_result(async_result, f, *a, **kw)
+        except Exception as exc:
+            async_result.discard_continuation(continuation)
+            self._remove_pending_task(async_result)
+            self._window.update_status(current_timestamp, 0, 0, 0, 1)
+            rejection = SubmitTaskError(exc)
+            self._record_rejection(rejection, current_timestamp, window_status)
+            async_result.set_exception(rejection)
+            return async_result
+
+        return async_result
+
+    def cancel(self, async_result):
+        """
+        取消由该 Cabin 返回的、尚未开始执行的任务。
+        与 Future.cancel 不同，共享 AsyncResult 时，它同时把任务从 Pending Tasks 中移除，
+        使得 get_pending_task_count 立即减小；取消不会计入窗口的统计信息，
+        它与后端的健康无关。
+        不共享 AsyncResult 时，Executor 中的任务在完成或者超时时被移除
+
+        @return bool 是否已经被取消，正在执行或者已经完成的任务无法被取消
+        """
+        if async_result.cancelled():
+            return True
+        if not async_result.cancel():
+            return False
+        self._on_task_completed(async_result)
+        metrics = self._metrics
+        if metrics is not None:
+            metrics.cancelled.inc()
+        return True
+
+    def call(self, f, *a, **kw):
+        """
+        直接调用：返回任务的结果，或者抛出与 AsyncResult 中相同的异常
+        （WindowClosedError、WindowHalfOpenError、SubmitTaskError、任务本身的异常等）。
+        Executor 是 InlineExecutor 时，在当前线程中执行任务，不创建 AsyncResult，
+        也不经过超时检查线程；否则等价于 execute(f, *a, **kw).result()
+        """
+        executor = self._executor
+        if not isinstance(executor, InlineExecutor):
+            return self.execute(f, *a, **kw).result()
+
+        if self._shut_down or executor.is_shut_down():
+            raise ShutDownError("cabin closed")
+        metrics = self._metrics
+        if metrics is not None:
+            metrics.submitted.inc()
+        current_timestamp = time.time()
+        window_status = self._window.get_status(current_timestamp)
+        if window_status is None:
+            LOGGER.error("invalid timestamp %f", current_timestamp)
+        rejection = self._get_rejection(window_status)
+        if rejection is not None:
+            self._record_rejection(rejection, current_timestamp, window_status)
+            raise rejection
+        if not executor.try_acquire():
+            self._window.update_status(current_timestamp, 0, 0, 0, 1)
+            rejection = SubmitTaskError(BulkheadFullError(executor.get_name()))
+            self._record_rejection(rejection, current_timestamp, window_status)
+            raise rejection
+        if self._load_balancer is not None:
+            f = self._load_balancer.bind(f)
+
+        try:
+            try:
+                result = f(*a, **kw)
+            finally:
+                executor.release()
+        except Exception:
+            timestamp = time.time()
+            self._window.update_status(timestamp, 0, 1, 0, 0)
+            self._record_call(current_timestamp, timestamp, FAILURE)
+            raise
+        timestamp = time.time()
+        self._window.update_status(timestamp, 1, 0, 0, 0)
+        self._record_call(current_timestamp, timestamp, SUCCESS)
+        return result
+
+    def _record_call(self, started_at, completed_at, outcome):
+        """
+        记录一次直接调用的结果与延迟
+        """
+        if self._metrics is None and self._traffic_recorder is None and \
+                self._adaptive_timeout is None:
+            return
+        latency = max(completed_at - started_at, 0.)
+        self._record_outcome(outcome, latency)
+        if self._traffic_recorder is not None:
+            self._traffic_recorder.record(
+                started_at,
+                self._traffic_cabin_id,
+                outcome,
+                self._window.get_status(completed_at) or 0,
+                0.,
+                latency)
+
+    def _continuation(self, async_result, result, exception):
+        async_result.set_time_info("left_cabin_at")
+        # 任务在队列中被拒绝策略淘汰，记为提交失败，而不是后端的失败
+        if isinstance(exception, RejectedError):
+            try:
+                self._reject_submitted_task(exception)
+                async_result.set_exception(SubmitTaskError(exception.exc))
+            finally:
+                self._on_task_completed(async_result)
+            return
+        self._record_completion(async_result, exception)
+        if self._phase_latency_recorder is not None:
+            self._phase_latency_recorder.record(async_result)
+        try:
+            # 超时的任务已经由检查线程更新过窗口的统计信息
+            if not isinstance(exception, TimeoutReachedError):
+                timestamp = time.time()
+                if exception is None:
+                    self._window.update_status(timestamp, 1, 0, 0, 0)
+                else:
+                    self._window.update_status(timestamp, 0, 1, 0, 0)
+            if exception is None:
+                async_result.set_result(result)
+            else:
+                async_result.set_exception(exception)
+        finally:
+            self._on_task_completed(async_result)
+
+    def _record_rejection(self, rejection, timestamp, window_status, count=1):
+        metrics = self._metrics
+        traffic_recorder = self._traffic_recorder
+        if metrics is None and traffic_recorder is None:
+            return
+        if isinstance(rejection, WindowClosedError):
+            reason = "window_closed"
+            outcome = REJECTED_CLOSED
+        elif isinstance(rejection, WindowHalfOpenError):
+            reason = "window_half_open"
+            outcome = REJECTED_HALF_OPEN
+        else:
+            reason = "submit_error"
+            outcome = SUBMIT_ERROR
+        if metrics is not None:
+            metrics.rejected(reason).inc(count)
+        if traffic_recorder is not None:
+            for _ in xrange(count):
+                traffic_recorder.record(
+                    timestamp, self._traffic_cabin_id, outcome, window_status or 0)
+
+    def _record_completion(self, async_result, exception):
+        """
+        记录任务的结果与延迟。任务进入 Cabin 的时间是 deadline - timeout，
+        所以不需要为每个任务额外保存开始时间
+        """
+        metrics = self._metrics
+        traffic_recorder = self._traffic_recorder
+        adaptive_timeout = self._adaptive_timeout
+        if metrics is None and traffic_recorder is None and \
+                adaptive_timeout is None:
+            return
+        deadline = async_result.deadline
+        latency = None
+        if deadline is not None:
+            latency = max(time.time() - deadline + async_result.timeout, 0.)
+        if exception is None:
+            outcome = SUCCESS
+        elif isinstance(exception, TimeoutReachedError):
+            outcome = TIMEOUT
+        else:
+            outcome = FAILURE
+        self._record_outcome(outcome, latency)
+        if traffic_recorder is not None and deadline is not None:
+            self._record_traffic(traffic_recorder, async_result, outcome)
+
+    def _record_outcome(self, outcome, latency):
+        metrics = self._metrics
+        if metrics is not None:
+            if outcome == SUCCESS:
+                metrics.succeeded.inc()
+            elif outcome == TIMEOUT:
+                metrics.timed_out.inc()
+            else:
+                metrics.failed.inc()
+            if latency is not None:
+                metrics.latency.observe(latency)
+        adaptive_timeout = self._adaptive_timeout
+        if adaptive_timeout is not None and latency is not None and \
+                outcome == SUCCESS:
+            adaptive_timeout.observe(latency)
+
+    def _record_traffic(self, traffic_recorder, async_result, outcome):
+        """
+        记录一次完成的调用。窗口状态是调用结果将要计入的窗口的状态
+        """
+        timestamp = time.time()
+        queue_wait = execution_time = NAN
+        get_timestamp = async_result.get_timestamp
+        submitted_at = get_timestamp("submitted_to_queue_at")
+        consumed_at = get_timestamp("consumed_from_queue_at")
+        if consumed_at is not None:
+            if submitted_at is not None:
+                queue_wait = consumed_at - submitted_at
+            executed_at = get_timestamp("executed_completion_at")
+            if executed_at is not None:
+                execution_time = executed_at - consumed_at
+        traffic_recorder.record(
+            async_result.deadline - async_result.timeout,
+            self._traffic_cabin_id,
+            outcome,
+            self._window.get_status(timestamp) or 0,
+            queue_wait,
+            execution_time)
+
+    def _get_rejection(self, window_status):
+        """
+        根据窗口状态判断是否拒绝请求。拒绝时返回相应的异常，否则返回 None
+        """
+        if window_status == WindowStatus.CLOSED:
+            return WindowClosedError(self._name)
+        if window_status == WindowStatus.HALF_OPEN:
+            if self._half_open_probability == 0:
+                return WindowHalfOpenError(self._name)
+            elif self._half_open_probability == 1:
+                return None
+            elif random.random() > self._half_open_probability:
+                return WindowHalfOpenError(self._name)
+        return None
+
+    def execute_many(self, tasks):
+        """
+        批量执行任务。整批任务只检查一次窗口状态、
+        只获取一次 Pending Tasks 的锁、只唤醒一次检查线程
+
+        @param tasks iterable 其中的每个元素都是 (func, args, kwargs) 三元组
+        @return list 与 tasks 一一对应的 AsyncResult 列表
+        """
+        tasks = list(tasks)
+        cabin_async_results = [
+            AsyncResult(record_time_info=self._record_time_info)
+            for _ in tasks]
+        if self._shut_down:
+            for cabin_async_result in cabin_async_results:
+                cabin_async_result.set_exception(ShutDownError("cabin closed"))
+            return cabin_async_results
+
+        metrics = self._metrics
+        if metrics is not None:
+            metrics.submitted.inc(len(tasks))
+        current_timestamp = time.time()
+        window_status = self._window.get_status(current_timestamp)
+        if window_status is None:
+            LOGGER.error("invalid timestamp %f", current_timestamp)
+
+        admitted_tasks = []
+        admitted_async_results = []
+        for task, cabin_async_result in zip(tasks, cabin_async_results):
+            # 半开状态下，每个请求仍然按照概率独立地决定是否放行
+            rejection = self._get_rejection(window_status)
+            if rejection is not None:
+                self._record_rejection(
+                    rejection, current_timestamp, window_status)
+                cabin_async_result.set_exception(rejection)
+                continue
+            cabin_async_result.set_time_info("putted_into_cabin_at")
+            admitted_tasks.append(task)
+            admitted_async_results.append(cabin_async_result)
+        if not admitted_tasks:
+            return cabin_async_results
+
+        load_balancer = self._load_balancer
+        if load_balancer is not None:
+            admitted_tasks = [(load_balancer.bind(func), args, kwargs)
+                              for func, args, kwargs in admitted_tasks]
+        # 提交任务
+        try:
+            executor_async_results = self._executor.submit_many(admitted_tasks)
+        except Exception as exc:
+            if load_balancer is not None:
+                for func, _, _ in admitted_tasks:
+                    func.release()
+            self._window.update_status(
+                current_timestamp, 0, 0, 0, len(admitted_tasks))
+            rejection = SubmitTaskError(exc)
+            self._record_rejection(rejection, current_timestamp, window_status,
+                                   len(admitted_tasks))
+            for cabin_async_result in admitted_async_results:
+                cabin_async_result.set_exception(SubmitTaskError(exc))
+            return cabin_async_results
+
+        if load_balancer is not None:
+            for (func, _, _), executor_async_result in zip(
+                    admitted_tasks, executor_async_results):
+                executor_async_result.add_done_callback(func.on_done)
+        timeout = self.get_timeout()
+        deadline = current_timestamp + timeout
+        rejection_count = 0
+        submitted = []
+        for cabin_async_result, executor_async_result in zip(
+                admitted_async_results, executor_async_results):
+            if executor_async_result.done():
+                exc = executor_async_result.exception()
+                if isinstance(exc, RejectedError):
+                    rejection_count = rejection_count + 1
+                    cabin_async_result.set_exception(SubmitTaskError(exc.exc))
+                    continue
+            executor_async_result.deadline = deadline
+            executor_async_result.timeout = timeout
+            submitted.append((cabin_async_result, executor_async_result))
+        if rejection_count:
+            self._window.update_status(
+                current_timestamp, 0, 0, 0, rejection_count)
+            self._record_rejection(SubmitTaskError(None), current_timestamp,
+                                   window_status, rejection_count)
+
+        # 成功提交任务之后，将 AsyncResult 对象批量保存到 Pending Tasks
+        with self._pending_task_condition:
+            if self._shut_down:
+                for cabin_async_result, _ in submitted:
+                    cabin_async_result.set_exception(
+                        ShutDownError("cabin closed"))
+                return cabin_async_results
+            for _, executor_async_result in submitted:
+                self._add_pending_task(executor_async_result)
+
+        for cabin_async_result, executor_async_result in submitted:
+            executor_async_result.add_done_callback(
+                partial(self._done_callback, cabin_async_result))
+
+        return cabin_async_results
+
+    submit_many = execute_many
+
     def _done_callback(self, cabin_async_result, executor_async_result):
         try:
             if not cabin_async_result.set_running_or_notify_cancel():
+                # 调用方已经取消了任务，Executor 中的任务仍然会完成或者超时
+                self._on_abandoned_task_done(executor_async_result)
                 return
         except RuntimeError:
             return
 
         cabin_async_result.set_time_info("left_cabin_at")
-        cabin_async_result.update_time_info(executor_async_result.time_info)
+        cabin_async_result.merge_time_info(executor_async_result)
+        if self._phase_latency_recorder is not None:
+            self._phase_latency_recorder.record(cabin_async_result)
 
         try:
             timestamp = time.time()
@@ -171,6 +655,11 @@ class Cabin(object):
                 return
 
             exc_value = executor_async_result.exception()
+            if isinstance(exc_value, RejectedError):
+                self._reject_submitted_task(exc_value)
+                cabin_async_result.set_exception(SubmitTaskError(exc_value.exc))
+                return
+            self._record_completion(executor_async_result, exc_value)
             if exc_value is None:
                 self._window.update_status(timestamp, 1, 0, 0, 0)
                 cabin_async_result.set_result(executor_async_result.result())
@@ -178,24 +667,74 @@ class Cabin(object):
                 self._window.update_status(timestamp, 0, 1, 0, 0)
                 cabin_async_result.set_exception(exc_value)
         finally:
-            with self._pending_task_condition:
-                self._completed_task_count = self._completed_task_count + 1
-                if self._completed_task_count / (len(self._pending_tasks) + 0.001) >= 0.5:
-                    self._pending_task_condition.notify_all()
+            self._on_task_completed(executor_async_result)
+
+    def _on_abandoned_task_done(self, executor_async_result):
+        """
+        记录调用方已经取消的任务的结果：任务可能已经访问了后端，
+        它的结果仍然反映后端的健康
+        """
+        try:
+            if executor_async_result.cancelled():
+                return
+            exc_value = executor_async_result.exception()
+            if isinstance(exc_value, RejectedError):
+                self._reject_submitted_task(exc_value)
+                return
+            self._record_completion(executor_async_result, exc_value)
+            if isinstance(exc_value, TimeoutReachedError):
+                return
+            if exc_value is None:
+                self._window.update_status(time.time(), 1, 0, 0, 0)
+            else:
+                self._window.update_status(time.time(), 0, 1, 0, 0)
+        finally:
+            self._on_task_completed(executor_async_result)
+
+    def _reject_submitted_task(self, rejected_error):
+        timestamp = time.time()
+        self._window.update_status(timestamp, 0, 0, 0, 1)
+        self._record_rejection(SubmitTaskError(rejected_error.exc), timestamp,
+                               self._window.get_status(timestamp))
+
+    def _add_pending_task(self, async_result):
+        """
+        调用方需要持有 _pending_task_condition
+        """
+        entry = (async_result.deadline, async_result.ident)
+        self._pending_async_results[entry[1]] = async_result
+        heapq.heappush(self._pending_tasks, entry)
+        # 新任务的 deadline 最早时（比如超时时间变小了），
+        # 唤醒检查线程，重新计算等待的时间
+        if self._pending_tasks[0] is entry:
+            self._pending_task_condition.notify_all()
+
+    def _remove_pending_task(self, async_result):
+        with self._pending_task_condition:
+            self._pending_async_results.pop(async_result.ident, None)
+
+    def _on_task_completed(self, async_result):
+        with self._pending_task_condition:
+            self._pending_async_results.pop(async_result.ident, None)
+            # 当已经完成的任务较多时，唤醒检查线程，将它们从堆中移除
+            self._completed_task_count = self._completed_task_count + 1
+            if self._completed_task_count / (len(self._pending_tasks) + 0.001) >= 0.5:
+                self._pending_task_condition.notify_all()
 
     def _check_async_results_thread_run(self):
+        pending_async_results = self._pending_async_results
         while True:
             with self._pending_task_condition:
                 if self._shut_down:
                     break
 
-                # 将已经完成的任务移除
-                pending_tasks = self._pending_tasks
-                self._pending_tasks = []
-                for ar in pending_tasks:
-                    if not ar.done():
-                        heapq.heappush(self._pending_tasks, ar)
-                self._completed_task_count = 0
+                # 将已经完成的任务从堆中移除
+                if self._completed_task_count:
+                    self._pending_tasks = [
+                        entry for entry in self._pending_tasks
+                        if entry[1] in pending_async_results]
+                    heapq.heapify(self._pending_tasks)
+                    self._completed_task_count = 0
 
                 # 如果没有挂起的任务，则一直等待，直到被唤醒
                 if not self._pending_tasks:
@@ -204,26 +743,28 @@ class Cabin(object):
 
                 current_timestamp = time.time()
                 while self._pending_tasks:
+                    # 等待到堆顶元素达到超时，或被唤醒
+                    deadline, ident = self._pending_tasks[0]
+                    if deadline > current_timestamp:
+                        self._pending_task_condition.wait(
+                            deadline - current_timestamp)
+                        break
                     # 如果堆顶元素到达 deadline ，则弹出它，并将它取消
-                    ar = self._pending_tasks[0]
-                    if ar.deadline <= current_timestamp:
-                        heapq.heappop(self._pending_tasks)
-                        try:
-                            if ar.set_running_or_notify_cancel():
-                                self._window.update_status(
-                                    current_timestamp,
-                                    0,
-                                    0,
-                                    1,
-                                    0)
-                                ar.set_exception(TimeoutReachedError(self._timeout))
-                        except RuntimeError:
-                            pass
+                    heapq.heappop(self._pending_tasks)
+                    ar = pending_async_results.get(ident)
+                    if ar is None:
                         continue
-                    # 否则，等待到堆顶元素达到超时，或被唤醒
-                    self._pending_task_condition.wait(
-                        current_timestamp - ar.deadline)
-                    break
+                    # 正在执行的任务无法被取消，它完成时会被移除
+                    if ar.running():
+                        continue
+                    try:
+                        if not ar.set_running_or_notify_cancel():
+                            pending_async_results.pop(ident, None)
+                            continue
+                    except RuntimeError:
+                        continue
+                    self._window.update_status(current_timestamp, 0, 0, 1, 0)
+                    ar.set_exception(TimeoutReachedError(ar.timeout))
 
         self._check_async_results_thread_event.set()
         LOGGER.info("check async results thread exited")
@@ -239,14 +780,21 @@ class Cabin(object):
         LOGGER.info("begin to acquire pending task condition")
         with self._pending_task_condition:
             # 将所有未完成的任务置为失败
-            while self._pending_tasks:
-                ar = self._pending_tasks.pop(0)
+            pending_async_results = self._pending_async_results.values()
+            self._pending_async_results.clear()
+            self._pending_tasks = []
+            for ar in pending_async_results:
                 try:
                     if ar.set_running_or_notify_cancel():
                         ar.set_exception(ShutDownError("cabin closed"))
                 except RuntimeError:
                     pass
             self._pending_task_condition.notify_all()
+        if self._metrics is not None:
+            self._metrics.unbind()
+        if self._phase_latency_recorder is not None:
+            self._phase_latency_recorder.shutdown()
+        self._window.close()
         self._check_async_results_thread_event.wait(timeout)
 
 
@@ -264,6 +812,14 @@ class CabinBuilder(object):
         self._recovery_ratio_threshold = None
         self._recovery_count_threshold = None
         self._half_open_probability = 0.5
+        self._record_time_info = True
+        self._shared_async_result = False
+        self._metrics_registry = None
+        self._record_phase_latency = False
+        self._traffic_recorder = None
+        self._window_factory = None
+        self._adaptive_timeout = None
+        self._load_balancer = None
 
     def with_name(self, name):
         self._name = name
@@ -313,6 +869,51 @@ class CabinBuilder(object):
         self._half_open_probability = half_open_probability
         return self
 
+    def with_record_time_info(self, record_time_info):
+        self._record_time_info = record_time_info
+        return self
+
+    def with_shared_async_result(self, shared_async_result):
+        self._shared_async_result = shared_async_result
+        return self
+
+    def with_metrics_registry(self, metrics_registry):
+        self._metrics_registry = metrics_registry
+        return self
+
+    def with_record_phase_latency(self, record_phase_latency):
+        self._record_phase_latency = record_phase_latency
+        return self
+
+    def with_traffic_recorder(self, traffic_recorder):
+        self._traffic_recorder = traffic_recorder
+        return self
+
+    def with_adaptive_timeout(self, floor, ceiling, **kwargs):
+        """
+        根据最近的成功请求的延迟调整超时时间，参数见 AdaptiveTimeout。
+        样本不足时，使用 with_timeout 设置的超时时间
+        """
+        kwargs.update(floor=floor, ceiling=ceiling)
+        self._adaptive_timeout = kwargs
+        return self
+
+    def with_load_balancer(self, load_balancer):
+        """
+        @param load_balancer LoadBalancer 为每次调用选择一个 endpoint，
+            任务以 f(endpoint, *a, **kw) 的形式执行
+        """
+        self._load_balancer = load_balancer
+        return self
+
+    def with_window_factory(self, window_factory):
+        """
+        @param window_factory callable 使用 (Cabin 的名称, *Window 的参数) 调用，
+            返回 Window 或者它的子类的对象，比如 shared_window.shared_window_factory()
+        """
+        self._window_factory = window_factory
+        return self
+
     def build(self):
         if self._name is None:
             raise RuntimeError("missing argument name")
@@ -347,4 +948,12 @@ class CabinBuilder(object):
             self._half_failure_count_threshold,
             self._recovery_ratio_threshold,
             self._recovery_count_threshold,
-            self._half_open_probability)
+            self._half_open_probability,
+            self._record_time_info,
+            self._shared_async_result,
+            self._metrics_registry,
+            self._record_phase_latency,
+            self._traffic_recorder,
+            self._window_factory,
+            self._adaptive_timeout,
+            self._load_balancer)
@@ -0,0 +1,44 @@
+# coding: utf8
+
+"""
+单调时钟。AsyncResult 等组件使用它记录时间点，计算时间间隔；
+需要展示墙上时间时，再通过 monotonic_to_wall_time 进行转换
+"""
+
+import logging
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2 的 time 模块没有单调时钟，使用 setup.py 中依赖的 monotonic 包
+    try:
+        from monotonic import monotonic
+    except ImportError:
+        # 没有可用的单调时钟时，退化为 time.time，时间间隔会受到墙上时钟调整的影响
+        LOGGER.warning("no monotonic clock is available, fall back to "
+                       "time.time; install the monotonic package")
+        monotonic = time.time
+
+__all__ = ["monotonic", "monotonic_to_wall_time", "wall_time_to_monotonic",
+           "is_monotonic"]
+
+# 单调时钟与墙上时钟之间的差值
+_WALL_TIME_OFFSET = time.time() - monotonic()
+
+
+def is_monotonic():
+    """
+    @return bool monotonic 是否是真正的单调时钟，而不是退化的 time.time
+    """
+    return monotonic is not time.time
+
+
+def monotonic_to_wall_time(timestamp):
+    return timestamp + _WALL_TIME_OFFSET
+
+
+def wall_time_to_monotonic(timestamp):
+    return timestamp - _WALL_TIME_OFFSET
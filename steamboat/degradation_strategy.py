@@ -1,9 +1,15 @@
+# coding: utf8
+
 from abc import ABCMeta, abstractmethod
 
 
 class DegradationStrategy(object):
     __metaclass__ = ABCMeta
 
+    # 降级方法的开销很小（比如返回默认值）时，将其置为 True，
+    # SteamBoat 会在回调线程中直接执行降级方法，而不是再提交给 Executor
+    cheap = False
+
     @abstractmethod
     def on_submit_task_error(self, exc, func, a, kw):
         pass
@@ -0,0 +1,89 @@
+# coding: utf8
+
+"""
+使用指数衰减的统计信息的窗口
+
+Window 在每个窗口期结束时清空统计信息：流量小的时候，一次失败就可能使失败率
+达到 100%；流量大的时候，只有在窗口期的边界处才能得到完整的失败率，
+而边界之后的统计信息又从零开始。
+EwmaWindow 的成功、失败、超时、拒绝次数随时间按指数衰减，经过 half_life 秒
+衰减为原来的一半，每次更新的开销是 O(1)，没有窗口的滚动，也没有清零。
+打开状态不再有窗口期，只在进入某个状态时清空统计信息；
+关闭与半开状态的长度、各个阈值的含义与 Window 相同，
+只是次数阈值比较的是衰减之后的次数，即大约最近 1.44 × half_life 秒内的次数。
+因为先发生的失败已经衰减了一点，所以连续的 N 次失败略小于 N，
+次数阈值为 N 时可能需要 N + 1 次失败
+"""
+
+import math
+
+from .window import Window, WindowStatus
+
+
+class EwmaWindow(Window):
+    def __init__(self, half_life, *a):
+        """
+        @param half_life float 统计信息衰减为一半所需的时间（秒）
+        @param a Window 的参数，open_length 不再使用
+        """
+        if half_life <= 0:
+            raise ValueError("half_life must be positive")
+        self._decay_rate = math.log(2) / half_life
+        Window.__init__(self, *a)
+
+    def _initialize_statistics(self):
+        Window._initialize_statistics(self)
+        self._success_count = 0.
+        self._failure_count = 0.
+        self._timeout_count = 0.
+        self._rejection_count = 0.
+        self._last_position = self._start_position
+
+    def _get_end_position(self):
+        if self._status == WindowStatus.OPEN:
+            return float("inf")
+        return Window._get_end_position(self)
+
+    def _decay(self, position):
+        # 多个线程并发更新时，位置可能略有倒退，此时不衰减
+        if position <= self._last_position:
+            return
+        factor = math.exp(self._decay_rate * (self._last_position - position))
+        self._success_count = self._success_count * factor
+        self._failure_count = self._failure_count * factor
+        self._timeout_count = self._timeout_count * factor
+        self._rejection_count = self._rejection_count * factor
+        self._last_position = position
+
+    def update_status(self,
+                      position,
+                      success_count,
+                      failure_count,
+                      timeout_count,
+                      rejection_count):
+        with self._lock:
+            # 先处理状态的转换，再衰减新状态下的统计信息
+            status = self._fetch(position)
+            if status is None or status == WindowStatus.CLOSED:
+                return
+            self._decay(position)
+            Window.update_status(self,
+                                 position,
+                                 success_count,
+                                 failure_count,
+                                 timeout_count,
+                                 rejection_count)
+
+    def get_half_life(self):
+        return math.log(2) / self._decay_rate
+
+
+def ewma_window_factory(half_life):
+    """
+    返回可以交给 CabinBuilder.with_window_factory 的工厂函数
+
+    @param half_life float 统计信息衰减为一半所需的时间（秒）
+    """
+    def _factory(name, *a):
+        return EwmaWindow(half_life, *a)
+    return _factory
@@ -1,13 +1,21 @@
 # coding: utf8
 
-import time
 from abc import ABCMeta, abstractmethod
+from functools import partial
 import itertools
+import logging
 import threading
 
 from concurrent.futures import Future
+from concurrent.futures._base import PENDING, RUNNING, CANCELLED, \
+    CANCELLED_AND_NOTIFIED
 
-__all__ = ["BaseError", "ShutDownError", "AsyncResult", "TaskItem", "Executor"]
+from .clock import monotonic, monotonic_to_wall_time, wall_time_to_monotonic
+
+LOGGER = logging.getLogger(__name__)
+
+__all__ = ["BaseError", "ShutDownError", "RejectedError", "TIME_INFO_KEYS",
+           "AsyncResult", "TaskItem", "Executor"]
 
 
 class BaseError(StandardError):
@@ -25,33 +33,236 @@ class ShutDownError(BaseError):
     pass
 
 
+class RejectedError(BaseError):
+    """
+    批量提交任务时，提交某个任务所引发的异常（比如 reject_handler 抛出的异常）
+    不会向上抛出，而是被包装成该异常，并设置到该任务所对应的 AsyncResult 上
+    """
+    def __init__(self, exc, *a):
+        super(self.__class__, self).__init__(*a)
+        self._exc = exc
+
+    @property
+    def exc(self):
+        return self._exc
+
+
+# AsyncResult 中有固定字段的时间点，其它时间点保存在额外的字典中
+TIME_INFO_KEYS = (
+    "putted_into_steamboat_at",
+    "putted_into_cabin_at",
+    "submitted_to_queue_at",
+    "consumed_from_queue_at",
+    "executed_completion_at",
+    "left_cabin_at",
+    "left_steamboat_at",
+)
+_TIME_INFO_INDEXES = dict((key, index) for index, key in enumerate(TIME_INFO_KEYS))
+
+
 class AsyncResult(Future):
+    """
+    轻量的 Future：
+        使用 __slots__ 保存全部字段（包括 Future 自身的字段）。
+        Future 没有定义 __slots__，所以实例仍然可以有 __dict__、可以设置任意属性，
+        但是 CPython 只在第一次访问 __dict__ 时才分配它，只使用这些字段的实例
+        不会分配 __dict__，每个实例的内存大约减少一半；
+        使用基于普通锁（而不是可重入锁）的 Condition；
+        无锁地生成 id；
+        内部使用单调时钟，按固定字段记录时间点，并且可以关闭时间点的记录；
+        支持 continuation，使得 SteamBoat、Cabin、Executor 可以共用一个 AsyncResult
+    """
+    __slots__ = (
+        # Future 的字段
+        "_condition",
+        "_state",
+        "_result",
+        "_exception",
+        "_traceback",
+        "_waiters",
+        "_done_callbacks",
+        # AsyncResult 的字段
+        "_id",
+        "_deadline",
+        "_timeout",
+        "_record_time_info",
+        "_timestamps",
+        "_extra_time_info",
+        "_continuations",
+    )
+
+    # itertools.count 是用 C 实现的，在 GIL 的保护下生成 id 不需要额外加锁
     counter = itertools.count().next
-    lock = threading.Lock()
 
-    def __init__(self, deadline=None):
-        Future.__init__(self)
-        self._time_info = {}
-        self._id = self.generate_id()
+    def __init__(self, deadline=None, record_time_info=True):
+        # 与 Future.__init__ 相同，但是 Future 的方法都不会重入 Condition，
+        # 所以使用代价更小的普通锁
+        self._condition = threading.Condition(threading.Lock())
+        self._state = PENDING
+        self._result = None
+        self._exception = None
+        self._traceback = None
+        self._waiters = []
+        self._done_callbacks = []
+
+        self._id = self.counter()
         self._deadline = deadline
+        self._timeout = None
+        self._record_time_info = record_time_info
+        self._timestamps = None
+        self._extra_time_info = None
+        self._continuations = None
 
     @classmethod
     def generate_id(cls):
-        with cls.lock:
-            return cls.counter()
+        return cls.counter()
+
+    def set_running_or_notify_cancel(self):
+        """
+        与 Future.set_running_or_notify_cancel 相同，只是状态不对时不记录 CRITICAL 日志。
+        超时检查线程、工作线程都可能先完成 AsyncResult，另一方捕获 RuntimeError 即可
+        """
+        with self._condition:
+            if self._state == PENDING:
+                self._state = RUNNING
+                return True
+            if self._state == CANCELLED:
+                self._state = CANCELLED_AND_NOTIFIED
+                for waiter in self._waiters:
+                    waiter.add_cancelled(self)
+                return False
+        raise RuntimeError("Future in unexpected state")
+
+    def _invoke_callbacks(self):
+        # 回调只会被调用一次，调用之后就释放它们，
+        # 使得回调中引用的对象（比如降级时需要的任务参数）不再随 AsyncResult 存活
+        done_callbacks = self._done_callbacks
+        self._done_callbacks = []
+        for callback in done_callbacks:
+            try:
+                callback(self)
+            except Exception:
+                LOGGER.exception("exception calling callback for %r", self)
 
     @property
     def time_info(self):
-        return self._time_info
+        """
+        以字典形式返回各个时间点（墙上时间），仅用于展示
+        """
+        time_info = {}
+        if self._timestamps is not None:
+            for key, timestamp in zip(TIME_INFO_KEYS, self._timestamps):
+                if timestamp is not None:
+                    time_info[key] = monotonic_to_wall_time(timestamp)
+        if self._extra_time_info is not None:
+            for key, timestamp in self._extra_time_info.iteritems():
+                time_info[key] = monotonic_to_wall_time(timestamp)
+        return time_info
+
+    @property
+    def time_info_recorded(self):
+        return self._record_time_info
+
+    def get_timestamp(self, key):
+        """
+        返回时间点（单调时钟），没有记录该时间点时返回 None
+        """
+        index = _TIME_INFO_INDEXES.get(key)
+        if index is None:
+            if self._extra_time_info is None:
+                return None
+            return self._extra_time_info.get(key)
+        if self._timestamps is None:
+            return None
+        return self._timestamps[index]
 
     def set_time_info(self, key, timestamp=None):
-        self._time_info[key] = timestamp or time.time()
+        """
+        @param key string 时间点的名称
+        @param timestamp float、None 墙上时间（与 time.time() 相同），默认是当前时间。
+            内部转换为单调时钟保存，get_timestamp 返回单调时钟的时间
+        """
+        if not self._record_time_info:
+            return self
+        if timestamp is None:
+            timestamp = monotonic()
+        else:
+            timestamp = wall_time_to_monotonic(timestamp)
+        index = _TIME_INFO_INDEXES.get(key)
+        if index is None:
+            if self._extra_time_info is None:
+                self._extra_time_info = {}
+            self._extra_time_info[key] = timestamp
+            return self
+        if self._timestamps is None:
+            self._timestamps = [None] * len(TIME_INFO_KEYS)
+        self._timestamps[index] = timestamp
         return self
 
     def update_time_info(self, time_info):
-        self._time_info.update(time_info)
+        """
+        @param time_info dict 由 time_info 属性返回的字典（墙上时间）
+        """
+        if not self._record_time_info:
+            return self
+        for key, timestamp in time_info.iteritems():
+            self.set_time_info(key, timestamp)
+        return self
+
+    def merge_time_info(self, async_result):
+        """
+        将另外一个 AsyncResult 中的时间点合并到当前对象中，不需要构造中间字典
+        """
+        if not self._record_time_info:
+            return self
+        timestamps = async_result._timestamps
+        if timestamps is not None:
+            if self._timestamps is None:
+                self._timestamps = list(timestamps)
+            else:
+                for index, timestamp in enumerate(timestamps):
+                    if timestamp is not None:
+                        self._timestamps[index] = timestamp
+        if async_result._extra_time_info is not None:
+            if self._extra_time_info is None:
+                self._extra_time_info = {}
+            self._extra_time_info.update(async_result._extra_time_info)
+        return self
+
+    def add_continuation(self, continuation):
+        """
+        添加 continuation。设置了 continuation 之后，调用 set_result、set_exception
+        不会直接完成 AsyncResult，而是按照后进先出的顺序，
+        使用 (async_result, result, exception) 调用最后添加的 continuation；
+        continuation 需要再次调用 set_result 或 set_exception，将结果向外传递。
+        必须在把 AsyncResult 交给其它线程之前添加 continuation
+        """
+        if self._continuations is None:
+            self._continuations = [continuation]
+        else:
+            self._continuations.append(continuation)
+        return self
+
+    def discard_continuation(self, continuation):
+        continuations = self._continuations
+        if continuations and continuation in continuations:
+            continuations.remove(continuation)
         return self
 
+    def set_result(self, result):
+        continuations = self._continuations
+        if continuations:
+            continuations.pop()(self, result, None)
+            return
+        Future.set_result(self, result)
+
+    def set_exception_info(self, exception, traceback):
+        continuations = self._continuations
+        if continuations:
+            continuations.pop()(self, None, exception)
+            return
+        Future.set_exception_info(self, exception, traceback)
+
     @property
     def ident(self):
         return self._id
@@ -64,6 +275,17 @@ class AsyncResult(Future):
     def deadline(self, deadline):
         self._deadline = deadline
 
+    @property
+    def timeout(self):
+        """
+        Cabin 放行任务时给予它的超时时间，deadline - timeout 是任务进入 Cabin 的时间
+        """
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, timeout):
+        self._timeout = timeout
+
     def __cmp__(self, obj):
         if not isinstance(obj, self.__class__):
             return 1
@@ -85,13 +307,35 @@ class TaskItem(object):
         元组参数，
         关键字参数，
         用于保存任务执行结果的 AsyncResult 对象
+    工作线程通过 take 取出可调用对象与参数，同时释放 TaskItem 对它们的引用，
+    使得参数在任务执行完成后就可以被回收，而不是随 TaskItem 存活
     """
+    __slots__ = ("_function", "_args", "_kwargs", "_async_result")
+
     def __init__(self, func, args, kwargs, async_result):
         self._function = func
         self._args = args
         self._kwargs = kwargs
         self._async_result = async_result
 
+    def take(self):
+        """
+        @return tuple (function, args, kwargs)，之后 TaskItem 不再引用它们
+        """
+        payload = self._function, self._args, self._kwargs
+        self._function = None
+        self._args = None
+        self._kwargs = None
+        return payload
+
+    def release(self):
+        """
+        丢弃可调用对象与参数，比如任务被取消或者被淘汰时
+        """
+        self._function = None
+        self._args = None
+        self._kwargs = None
+
     @property
     def function(self):
         return self._function
@@ -109,6 +353,24 @@ class TaskItem(object):
         return self._async_result
 
 
+def _transfer_result(async_result, inner_async_result):
+    try:
+        if not async_result.set_running_or_notify_cancel():
+            return
+    except RuntimeError:
+        # async_result 已经被其它线程完成（比如超时）
+        return
+    async_result.merge_time_info(inner_async_result)
+    if inner_async_result.cancelled():
+        async_result.set_exception(RuntimeError("unreachable"))
+        return
+    exc = inner_async_result.exception()
+    if exc is None:
+        async_result.set_result(inner_async_result.result())
+    else:
+        async_result.set_exception(exc)
+
+
 class Executor(object):
     __metaclass__ = ABCMeta
 
@@ -116,6 +378,60 @@ class Executor(object):
     def submit_task(self, func, *args, **kwargs):
         pass
 
+    def submit_task_with_result(self, async_result, func, *args, **kwargs):
+        """
+        提交任务，并将结果设置到调用方提供的 async_result 上，
+        使得调用方与 Executor 可以共用一个 AsyncResult
+
+        子类应该重写该方法，直接把 async_result 放入 TaskItem；
+        默认实现通过 submit_task 提交，再把结果转交给 async_result
+        """
+        inner_async_result = self.submit_task(func, *args, **kwargs)
+        inner_async_result.add_done_callback(
+            partial(_transfer_result, async_result))
+        return async_result
+
+    def submit_many(self, tasks):
+        """
+        批量提交任务
+
+        @param tasks iterable 其中的每个元素都是 (func, args, kwargs) 三元组
+        @return list 与 tasks 一一对应的 AsyncResult 列表。
+            提交失败的任务，其 AsyncResult 会被设置为 RejectedError
+
+        子类应该重写该方法，使得整批任务只需要进行一次检查、
+        获取一次锁、唤醒一次工作线程；默认实现只是逐个提交
+        """
+        async_results = []
+        for func, args, kwargs in tasks:
+            try:
+                async_result = self.submit_task(func, *args, **(kwargs or {}))
+            except Exception as exc:
+                async_result = AsyncResult()
+                async_result.set_exception(RejectedError(exc))
+            async_results.append(async_result)
+        return async_results
+
+    def get_queue_size(self):
+        """
+        返回队列中等待执行的任务数量，不支持时返回 None
+        """
+        return None
+
+    def get_active_worker_count(self):
+        """
+        返回正在执行任务的工作线程（或协程）数量，不支持时返回 None
+        """
+        return None
+
+    def get_worker_thread_idents(self, busy_only=False):
+        """
+        返回工作线程的 ident 列表，不支持时返回 None
+
+        @param busy_only bool 是否只返回正在执行任务的工作线程
+        """
+        return None
+
     @abstractmethod
     def shutdown(self, wait_time=None):
         pass
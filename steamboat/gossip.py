@@ -0,0 +1,423 @@
+# coding: utf8
+
+"""
+在节点之间交换窗口的统计信息
+
+每个节点上的 Cabin 只能看到自己发出的请求，在后端故障时，
+每个节点都要独立地积累足够多的失败才会熔断。Gossiper 周期性地把本节点的
+窗口摘要（状态、起始位置、成功/失败/超时次数）广播给其它节点，并把收到的
+摘要合并到本地的熔断判断中：本地窗口打开时，如果全体节点的失败率与失败次数
+达到了该窗口的阈值，就调用 Window.trip 使它提前进入关闭状态。
+半开与关闭状态的窗口仍然只根据本地的统计信息恢复。
+
+传输层是可以替换的，内置进程内的 LoopbackNetwork 与基于 UDP 的 UdpTransport
+"""
+
+from abc import ABCMeta, abstractmethod
+import json
+import logging
+import socket
+import threading
+import time
+import uuid
+
+from .window import WindowStatus
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Transport(object):
+    """
+    传输层：发送的消息到达全部其它节点（尽力而为，可以丢失），
+    收到的消息通过 start 时传入的回调交给 Gossiper
+    """
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def start(self, receiver):
+        """
+        @param receiver callable 使用收到的消息（str）调用
+        """
+        pass
+
+    @abstractmethod
+    def send(self, payload):
+        pass
+
+    def close(self):
+        pass
+
+
+class LoopbackNetwork(object):
+    """
+    进程内的网络。send 同步地把消息交给同一个网络中的其它 Transport
+    """
+    def __init__(self):
+        self._transports = []
+        self._lock = threading.Lock()
+
+    def create_transport(self):
+        return _LoopbackTransport(self)
+
+    def _attach(self, transport):
+        with self._lock:
+            self._transports.append(transport)
+
+    def _detach(self, transport):
+        with self._lock:
+            if transport in self._transports:
+                self._transports.remove(transport)
+
+    def _broadcast(self, sender, payload):
+        with self._lock:
+            transports = list(self._transports)
+        for transport in transports:
+            if transport is not sender:
+                transport._deliver(payload)
+
+
+class _LoopbackTransport(Transport):
+    def __init__(self, network):
+        self._network = network
+        self._receiver = None
+
+    def start(self, receiver):
+        self._receiver = receiver
+        self._network._attach(self)
+
+    def send(self, payload):
+        self._network._broadcast(self, payload)
+
+    def _deliver(self, payload):
+        if self._receiver is not None:
+            self._receiver(payload)
+
+    def close(self):
+        self._network._detach(self)
+
+
+class UdpTransport(Transport):
+    """
+    使用 UDP 把消息发送给每个对端，后台线程接收消息
+    """
+    MAX_DATAGRAM_SIZE = 65507
+
+    def __init__(self, bind_address=("127.0.0.1", 0), peers=()):
+        """
+        @param bind_address tuple 监听的地址
+        @param peers iterable 对端的地址，也可以之后通过 add_peer 添加
+        """
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(bind_address)
+        # 定期醒来检查是否已经关闭
+        self._socket.settimeout(0.2)
+        self._peers = list(peers)
+        self._receiver = None
+        self._closed = False
+        self._thread = None
+
+    def get_address(self):
+        return self._socket.getsockname()
+
+    def add_peer(self, address):
+        if address not in self._peers:
+            self._peers.append(address)
+
+    def start(self, receiver):
+        self._receiver = receiver
+        self._thread = threading.Thread(target=self._thread_run)
+        self._thread.setName("gossip-udp-%d" % self.get_address()[1])
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _thread_run(self):
+        while not self._closed:
+            try:
+                payload, _ = self._socket.recvfrom(self.MAX_DATAGRAM_SIZE)
+            except socket.timeout:
+                continue
+            except socket.error:
+                if self._closed:
+                    break
+                LOGGER.exception("fail to receive gossip")
+                continue
+            try:
+                self._receiver(payload)
+            except Exception:
+                LOGGER.exception("fail to handle gossip")
+
+    def send(self, payload):
+        if len(payload) > self.MAX_DATAGRAM_SIZE:
+            LOGGER.error("gossip of %d bytes is too large", len(payload))
+            return
+        for peer in list(self._peers):
+            try:
+                self._socket.sendto(payload, peer)
+            except socket.error as exc:
+                LOGGER.warning("fail to send gossip to %s: %s", peer, exc)
+
+    def close(self):
+        self._closed = True
+        if self._thread is not None:
+            self._thread.join()
+        self._socket.close()
+
+
+class _RemoteSummary(object):
+    """
+    其它节点最近一次发来的摘要。
+    打开状态的摘要中的统计信息是在收到时观察到的；关闭状态的摘要携带的是熔断前
+    的统计信息，视为在熔断（即窗口的起始位置）时观察到的，所以熔断之后的
+    max_age 之内，它仍然计入全体节点。半开状态的摘要不改变已有的统计信息
+    """
+    __slots__ = ("received_at", "sequence", "status", "epoch",
+                 "success_count", "failure_count", "timeout_count",
+                 "observed_at")
+
+    def __init__(self):
+        self.success_count = 0
+        self.failure_count = 0
+        self.timeout_count = 0
+        self.observed_at = None
+
+    def update(self, now, sequence, status, epoch, success, failure, timeout):
+        self.received_at = now
+        self.sequence = sequence
+        self.status = status
+        self.epoch = epoch
+        if status == WindowStatus.OPEN:
+            observed_at = now
+        elif status == WindowStatus.CLOSED:
+            observed_at = epoch
+        else:
+            return
+        self.success_count = success
+        self.failure_count = failure
+        self.timeout_count = timeout
+        self.observed_at = observed_at
+
+    def to_dict(self):
+        return dict((key, getattr(self, key)) for key in self.__slots__)
+
+
+class Gossiper(object):
+    """
+    消息的格式（JSON）：
+        {"node": 节点, "seq": 序号, "windows": [[Cabin 名称, 状态, 起始位置,
+                                                 成功次数, 失败次数, 超时次数], ...]}
+    窗口关闭时，窗口的统计信息已经被清空，发送的是最后一次观察到的打开状态下的
+    统计信息，使得比本节点晚一步的节点也能根据它熔断
+    """
+    def __init__(self, transport, node_id=None, interval=1., max_age=None):
+        """
+        @param transport Transport
+        @param node_id string 节点的标识，默认随机生成
+        @param interval float 广播的间隔（秒）
+        @param max_age float 其它节点的摘要的有效期（秒），默认是 3 个广播间隔
+        """
+        self._transport = transport
+        self._node_id = node_id or uuid.uuid4().hex[:12]
+        self._interval = interval
+        self._max_age = 3 * interval if max_age is None else max_age
+        self._windows = {}  # Map: Cabin 名称 -> Window
+        # Map: Cabin 名称 -> {节点: _RemoteSummary}
+        self._remote_summaries = {}
+        # Map: Cabin 名称 -> 本地窗口最后一次处于打开状态时的 (成功, 失败, 超时)
+        self._last_open_counts = {}
+        self._sequence = 0
+        self._trip_count = 0
+        self._lock = threading.Lock()
+
+        self._started = False
+        self._shut_down = False
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def get_node_id(self):
+        return self._node_id
+
+    def get_trip_count(self):
+        """
+        因为合并了其它节点的摘要而熔断的次数
+        """
+        return self._trip_count
+
+    def register(self, name, window):
+        with self._lock:
+            self._windows[name] = window
+        return self
+
+    def register_cabin(self, cabin):
+        return self.register(cabin.get_name(), cabin.get_window())
+
+    def start(self):
+        """
+        开始接收消息，并在后台线程中周期性地广播
+        """
+        with self._condition:
+            if self._started:
+                return self
+            self._started = True
+        self._transport.start(self.receive)
+        self._thread = threading.Thread(target=self._thread_run)
+        self._thread.setName("gossiper-%s" % self._node_id)
+        self._thread.setDaemon(True)
+        self._thread.start()
+        return self
+
+    def _thread_run(self):
+        while True:
+            with self._condition:
+                if self._shut_down:
+                    break
+                self._condition.wait(self._interval)
+                if self._shut_down:
+                    break
+            try:
+                self.broadcast()
+                self.evaluate()
+            except Exception:
+                LOGGER.exception("fail to gossip")
+
+    def build_message(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            windows = list(self._windows.items())
+            self._sequence = self._sequence + 1
+            sequence = self._sequence
+        summaries = []
+        for name, window in windows:
+            status = window.get_status(now)
+            if status is None:
+                continue
+            if status == WindowStatus.OPEN:
+                counts = (window.get_success_count(),
+                          window.get_failure_count(),
+                          window.get_timeout_count())
+                self._last_open_counts[name] = counts
+            elif status == WindowStatus.CLOSED:
+                counts = self._last_open_counts.get(name, (0, 0, 0))
+            else:
+                counts = (window.get_success_count(),
+                          window.get_failure_count(),
+                          window.get_timeout_count())
+            summaries.append(
+                [name, status, window.get_start_position()] + list(counts))
+        return json.dumps(
+            {"node": self._node_id, "seq": sequence, "windows": summaries},
+            separators=(",", ":"))
+
+    def broadcast(self, now=None):
+        self._transport.send(self.build_message(now))
+
+    def receive(self, payload, now=None):
+        """
+        合并收到的消息，并重新判断相关的窗口是否需要熔断
+        """
+        now = time.time() if now is None else now
+        try:
+            message = json.loads(payload)
+            node_id = message["node"]
+            sequence = message["seq"]
+            summaries = message["windows"]
+        except (ValueError, KeyError, TypeError):
+            LOGGER.warning("invalid gossip %r", payload[:100])
+            return
+        if node_id == self._node_id:
+            return
+        names = []
+        with self._lock:
+            for name, status, epoch, success, failure, timeout in summaries:
+                if name not in self._windows:
+                    continue
+                remote = self._remote_summaries.setdefault(name, {})
+                summary = remote.get(node_id)
+                if summary is None:
+                    summary = remote[node_id] = _RemoteSummary()
+                # UDP 可能乱序，忽略比已有摘要更旧的消息
+                elif summary.sequence >= sequence:
+                    continue
+                summary.update(now, sequence, status, epoch,
+                               success, failure, timeout)
+                names.append(name)
+        for name in names:
+            self._evaluate_window(name, now)
+
+    def evaluate(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            names = list(self._windows)
+        for name in names:
+            self._evaluate_window(name, now)
+
+    def get_fleet_counts(self, name, now=None):
+        """
+        @return (success_count, failure_count, timeout_count, node_count)
+            本节点与其它节点在 max_age 之内处于打开状态时的统计信息之和
+        """
+        now = time.time() if now is None else now
+        window = self._windows[name]
+        success = window.get_success_count()
+        failure = window.get_failure_count()
+        timeout = window.get_timeout_count()
+        node_count = 1
+        expired_before = now - self._max_age
+        with self._lock:
+            remote = self._remote_summaries.get(name, {})
+            for node_id, summary in remote.items():
+                if summary.received_at < expired_before:
+                    del remote[node_id]
+                    continue
+                if summary.observed_at is None or \
+                        summary.observed_at < expired_before:
+                    continue
+                success = success + summary.success_count
+                failure = failure + summary.failure_count
+                timeout = timeout + summary.timeout_count
+                node_count = node_count + 1
+        return success, failure, timeout, node_count
+
+    def get_remote_summaries(self, name):
+        """
+        @return dict 节点 -> 该节点最近一次发来的摘要
+        """
+        with self._lock:
+            return dict((node_id, summary.to_dict()) for node_id, summary
+                        in self._remote_summaries.get(name, {}).iteritems())
+
+    def _evaluate_window(self, name, now):
+        """
+        与 Window.update_status 在打开状态下的判断相同，只是使用全体节点的统计信息
+        """
+        window = self._windows[name]
+        if window.get_status(now) != WindowStatus.OPEN:
+            return False
+        success, failure, timeout, node_count = self.get_fleet_counts(name, now)
+        if node_count == 1 or failure == 0:
+            return False
+        failure_ratio = failure / float(success + failure + timeout)
+        failure_count_threshold = window.get_failure_count_threshold()
+        if failure_ratio < window.get_failure_ratio_threshold():
+            return False
+        if failure_count_threshold is not None and \
+                failure < failure_count_threshold:
+            return False
+        local_counts = (window.get_success_count(),
+                        window.get_failure_count(),
+                        window.get_timeout_count())
+        if not window.trip(now):
+            return False
+        self._last_open_counts[name] = local_counts
+        self._trip_count = self._trip_count + 1
+        LOGGER.warning("window of %s is tripped by gossip: "
+                       "%d failures out of %d calls on %d nodes",
+                       name, failure, success + failure + timeout, node_count)
+        return True
+
+    def shutdown(self):
+        with self._condition:
+            self._shut_down = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        self._transport.close()
@@ -0,0 +1,266 @@
+# coding: utf8
+
+"""
+在 Cabin 内部为每次调用选择一个后端实例（endpoint）
+
+Cabin 只有一个窗口，当它面对一组副本时，一个故障的副本就会拉高整个 Cabin 的
+失败率，使全部请求被熔断。设置了 LoadBalancer 的 Cabin 在放行请求之后，
+为它选择一个 endpoint，并以 f(endpoint, *a, **kw) 的形式执行任务：
+    每个 endpoint 有自己的 Window，失败率达到阈值时窗口关闭，endpoint 被摘除，
+    关闭期过后进入半开状态，按照 half_open_probability 接收少量探测请求，
+    恢复之后重新打开；
+    选择时使用 power of two choices：随机取两个可用的 endpoint，
+    选择 (在途请求数 + 1) × 延迟的 peak EWMA 较小的一个；
+    失败的调用按照不小于 failure_penalty 的延迟记录，快速失败的 endpoint
+    不会因为延迟小而吸引更多的请求；
+    只剩半开状态的 endpoint 时，请求都发给它们；
+    全部 endpoint 都被摘除时，在全部 endpoint 中选择（panic 模式），
+    由 Cabin 自己的窗口决定是否熔断
+任务在队列中超时、被淘汰时不会计入 endpoint 的统计信息，它们与 endpoint 的健康无关
+"""
+
+import itertools
+import math
+import random
+import time
+
+from .clock import monotonic
+from .window import Window, WindowStatus
+
+
+class Endpoint(object):
+    """
+    一个后端实例的状态。在途请求数由两个 itertools.count 计数器相减得到，
+    不需要加锁；并发更新时读到的值可能暂时相差一，下一次更新时就会纠正
+    """
+    def __init__(self, address, window, decay_time, failure_penalty=1.):
+        self._address = address
+        self._window = window
+        self._decay_time = decay_time
+        self._failure_penalty = failure_penalty
+        self._next_acquired = itertools.count(1).next
+        self._next_released = itertools.count(1).next
+        self._acquired_count = 0
+        self._released_count = 0
+        self._latency = 0.
+        self._latency_updated_at = monotonic()
+
+    def get_address(self):
+        return self._address
+
+    def get_window(self):
+        return self._window
+
+    def get_outstanding(self):
+        return max(self._acquired_count - self._released_count, 0)
+
+    def get_latency(self):
+        """
+        @return float 延迟的 peak EWMA（秒）
+        """
+        return self._latency
+
+    def get_status(self, position=None):
+        return self._window.get_status(
+            time.time() if position is None else position)
+
+    def get_score(self):
+        return (self.get_outstanding() + 1) * self._latency
+
+    def acquire(self):
+        self._acquired_count = self._next_acquired()
+
+    def release(self):
+        self._released_count = self._next_released()
+
+    def complete(self, succeeded, latency):
+        """
+        记录一次在该 endpoint 上执行完成的调用，并释放在途请求
+        """
+        self.release()
+        if not succeeded:
+            latency = max(latency, self._failure_penalty)
+        # peak EWMA：变慢时立即跟上，变快时按照 decay_time 逐渐衰减
+        now = monotonic()
+        elapsed = now - self._latency_updated_at
+        self._latency_updated_at = now
+        if latency >= self._latency:
+            self._latency = latency
+        else:
+            weight = math.exp(-elapsed / self._decay_time)
+            self._latency = self._latency * weight + latency * (1 - weight)
+        if succeeded:
+            self._window.update_status(time.time(), 1, 0, 0, 0)
+        else:
+            self._window.update_status(time.time(), 0, 1, 0, 0)
+
+    def to_dict(self, position=None):
+        return {
+            "address": self._address,
+            "status": self.get_status(position),
+            "outstanding": self.get_outstanding(),
+            "latency": self._latency,
+            "success_count": self._window.get_success_count(),
+            "failure_count": self._window.get_failure_count(),
+        }
+
+
+class _EndpointTask(object):
+    """
+    Cabin 实际提交的任务：以 f(endpoint, *a, **kw) 的形式执行，
+    并把结果与耗时记录到 endpoint 上。任务没有被执行就完成了（超时、被取消、
+    被淘汰）时，on_done 释放在途请求
+    """
+    __slots__ = ("_endpoint", "_function", "_started")
+
+    def __init__(self, endpoint, function):
+        self._endpoint = endpoint
+        self._function = function
+        self._started = False
+
+    def get_endpoint(self):
+        return self._endpoint
+
+    def __call__(self, *a, **kw):
+        self._started = True
+        endpoint = self._endpoint
+        start_time = monotonic()
+        try:
+            result = self._function(endpoint.get_address(), *a, **kw)
+        except Exception:
+            endpoint.complete(False, monotonic() - start_time)
+            raise
+        endpoint.complete(True, monotonic() - start_time)
+        return result
+
+    def release(self):
+        """
+        任务没有被提交时，释放在途请求
+        """
+        if not self._started:
+            self._started = True
+            self._endpoint.release()
+
+    def on_done(self, async_result):
+        self.release()
+
+
+class LoadBalancer(object):
+    def __init__(self,
+                 endpoints,
+                 open_length=10,
+                 ejection_time=30,
+                 half_open_length=10,
+                 failure_ratio_threshold=0.5,
+                 failure_count_threshold=5,
+                 half_failure_count_threshold=1,
+                 recovery_ratio_threshold=0.8,
+                 recovery_count_threshold=3,
+                 decay_time=10.,
+                 failure_penalty=1.,
+                 half_open_probability=0.1):
+        """
+        @param endpoints iterable endpoint 的地址，任务的第一个参数
+        @param open_length float endpoint 窗口的打开期（秒）
+        @param ejection_time float endpoint 被摘除（窗口关闭）的时间（秒）
+        @param half_open_length float endpoint 窗口的半开期（秒）
+        @param failure_ratio_threshold float 失败率达到该值时摘除 endpoint
+        @param failure_count_threshold int、None 同时失败次数需要达到该值
+        @param half_failure_count_threshold int、None 半开状态下的失败次数阈值
+        @param recovery_ratio_threshold float、None 半开状态下恢复的成功率阈值
+        @param recovery_count_threshold int、None 半开状态下恢复的成功次数阈值
+        @param decay_time float 延迟的 EWMA 的时间常数（秒）
+        @param failure_penalty float 失败的调用至少按照该延迟（秒）记录
+        @param half_open_probability float 半开状态的 endpoint 参与选择的概率
+        """
+        self._endpoints = [
+            Endpoint(address,
+                     Window(0,
+                            WindowStatus.OPEN,
+                            open_length,
+                            ejection_time,
+                            half_open_length,
+                            failure_ratio_threshold,
+                            failure_count_threshold,
+                            half_failure_count_threshold,
+                            recovery_ratio_threshold,
+                            recovery_count_threshold),
+                     decay_time,
+                     failure_penalty)
+            for address in endpoints]
+        if not self._endpoints:
+            raise ValueError("endpoints is empty")
+        self._half_open_probability = half_open_probability
+        self._random = random.Random()
+
+    def get_endpoints(self):
+        return list(self._endpoints)
+
+    def get_endpoint_stats(self):
+        position = time.time()
+        return [endpoint.to_dict(position) for endpoint in self._endpoints]
+
+    def select(self):
+        """
+        @return Endpoint 使用 power of two choices 选择的 endpoint
+        """
+        endpoints = self._endpoints
+        count = len(endpoints)
+        if count == 1:
+            return endpoints[0]
+        position = time.time()
+        index_a = self._random.randrange(count)
+        index_b = self._random.randrange(count - 1)
+        if index_b >= index_a:
+            index_b = index_b + 1
+        endpoint_a = endpoints[index_a]
+        endpoint_b = endpoints[index_b]
+        available_a = self._is_available(endpoint_a, position)
+        available_b = self._is_available(endpoint_b, position)
+        if available_a and available_b:
+            return _choose(endpoint_a, endpoint_b)
+        if available_a:
+            return endpoint_a
+        if available_b:
+            return endpoint_b
+
+        # 两个都不可用，在可用的 endpoint 中重新选择；没有打开状态的 endpoint 时，
+        # 请求只能发给半开状态的 endpoint；全部被摘除时进入 panic 模式
+        available = [endpoint for endpoint in endpoints
+                     if self._is_available(endpoint, position)]
+        if not available:
+            available = [endpoint for endpoint in endpoints
+                         if endpoint.get_status(position) !=
+                         WindowStatus.CLOSED]
+        if not available:
+            available = endpoints
+        if len(available) == 1:
+            return available[0]
+        endpoint_a, endpoint_b = self._random.sample(available, 2)
+        return _choose(endpoint_a, endpoint_b)
+
+    def _is_available(self, endpoint, position):
+        """
+        打开状态的 endpoint 总是可用；半开状态的 endpoint 按照
+        half_open_probability 接收探测请求；关闭状态的 endpoint 已经被摘除
+        """
+        status = endpoint.get_status(position)
+        if status == WindowStatus.OPEN:
+            return True
+        if status == WindowStatus.HALF_OPEN:
+            return self._random.random() < self._half_open_probability
+        return False
+
+    def bind(self, function):
+        """
+        选择一个 endpoint，并返回绑定了它的任务
+        """
+        endpoint = self.select()
+        endpoint.acquire()
+        return _EndpointTask(endpoint, function)
+
+
+def _choose(endpoint_a, endpoint_b):
+    if endpoint_b.get_score() < endpoint_a.get_score():
+        return endpoint_b
+    return endpoint_a
@@ -0,0 +1,603 @@
+# coding: utf8
+
+import bisect
+import logging
+import threading
+import weakref
+from abc import ABCMeta, abstractmethod
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+LOGGER = logging.getLogger(__name__)
+
+# 延迟直方图的默认桶（秒）
+DEFAULT_LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class BaseError(StandardError):
+    """
+    异常类的基类
+    """
+    pass
+
+
+class MetricTypeError(BaseError):
+    """
+    同名的指标已经以其它类型或其它标签注册过
+    """
+    pass
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if value == float("-inf"):
+        return "-Inf"
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\") \
+        .replace("\n", "\\n") \
+        .replace("\"", "\\\"")
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = ["%s=\"%s\"" % (name, _escape_label_value(value))
+             for name, value in zip(labelnames, labelvalues)]
+    if extra is not None:
+        pairs.append("%s=\"%s\"" % extra)
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join(pairs)
+
+
+class ThreadLocalCells(object):
+    """
+    按线程分片的单元格。每个线程只修改自己的单元格，所以记录时不需要加锁；
+    只有线程第一次记录时，才需要加锁登记它的单元格。
+    读取时对所有单元格求和，结果是最终一致的。
+    已经结束的线程不会再修改它的单元格，登记新的单元格或者求和时，
+    把它们累加到基础值中并丢弃，单元格的数量不会随着线程的创建与结束而增长
+    """
+    __slots__ = ("_size", "_local", "_cells", "_base", "_lock")
+
+    def __init__(self, size):
+        self._size = size
+        self._local = threading.local()
+        self._cells = []  # 元素是 (线程的弱引用, 单元格)
+        self._base = [0] * size
+        self._lock = threading.Lock()
+
+    def get(self):
+        cell = getattr(self._local, "cell", None)
+        if cell is None:
+            cell = [0] * self._size
+            self._local.cell = cell
+            thread_ref = weakref.ref(threading.current_thread())
+            with self._lock:
+                self._fold_dead_cells()
+                self._cells.append((thread_ref, cell))
+        return cell
+
+    def get_cell_count(self):
+        return len(self._cells)
+
+    def _fold_dead_cells(self):
+        """
+        调用方需要持有 self._lock
+        """
+        live_cells = []
+        base = self._base
+        for thread_ref, cell in self._cells:
+            thread = thread_ref()
+            if thread is not None and thread.is_alive():
+                live_cells.append((thread_ref, cell))
+                continue
+            for index in range(self._size):
+                base[index] = base[index] + cell[index]
+        if len(live_cells) != len(self._cells):
+            self._cells = live_cells
+
+    def sum(self):
+        with self._lock:
+            self._fold_dead_cells()
+            cells = [cell for _, cell in self._cells]
+            total = list(self._base)
+        for cell in cells:
+            for index in range(self._size):
+                total[index] = total[index] + cell[index]
+        return total
+
+
+class _CounterChild(object):
+    __slots__ = ("_cells", )
+
+    def __init__(self):
+        self._cells = ThreadLocalCells(1)
+
+    def inc(self, amount=1):
+        if amount < 0:
+            raise ValueError("counter can only be increased")
+        self._cells.get()[0] += amount
+
+    def get_value(self):
+        return self._cells.sum()[0]
+
+
+class _GaugeChild(object):
+    __slots__ = ("_value", "_function")
+
+    def __init__(self):
+        self._value = 0
+        self._function = None
+
+    def set(self, value):
+        self._value = value
+
+    def set_function(self, function):
+        """
+        设置之后，采集时使用该函数的返回值作为仪表盘的值。
+        适用于队列长度、窗口状态等可以直接读取的值，记录时没有任何开销
+        """
+        self._function = function
+
+    def get_value(self):
+        function = self._function
+        if function is None:
+            return self._value
+        return function()
+
+
+class _HistogramChild(object):
+    __slots__ = ("_buckets", "_cells")
+
+    def __init__(self, buckets):
+        self._buckets = buckets
+        # 每个线程的单元格：各个桶的计数、+Inf 桶的计数、总和
+        self._cells = ThreadLocalCells(len(buckets) + 2)
+
+    def observe(self, value):
+        cell = self._cells.get()
+        cell[bisect.bisect_left(self._buckets, value)] += 1
+        cell[-1] += value
+
+    def get_value(self):
+        """
+        返回 (各个桶的累积计数列表（包括 +Inf 桶）, 总和, 总数)
+        """
+        total = self._cells.sum()
+        cumulative = []
+        count = 0
+        for bucket_count in total[:-1]:
+            count = count + bucket_count
+            cumulative.append(count)
+        return cumulative, total[-1], count
+
+
+class _Metric(object):
+    """
+    指标族。按照标签值的组合创建子指标；没有标签时，指标族本身可以直接记录
+    """
+    __metaclass__ = ABCMeta
+
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self._name = name
+        self._documentation = documentation
+        self._labelnames = tuple(labelnames)
+        self._children = {}
+        # 通过 acquire 获取的子指标的引用计数
+        self._references = {}
+        self._lock = threading.Lock()
+        if not self._labelnames:
+            self._children[()] = self._new_child()
+
+    def get_name(self):
+        return self._name
+
+    def get_labelnames(self):
+        return self._labelnames
+
+    @abstractmethod
+    def _new_child(self):
+        pass
+
+    def _get_key(self, labelvalues):
+        if len(labelvalues) != len(self._labelnames):
+            raise ValueError("%s expects labels %r" % (
+                self._name, self._labelnames))
+        return tuple(str(value) for value in labelvalues)
+
+    def labels(self, *labelvalues):
+        labelvalues = self._get_key(labelvalues)
+        child = self._children.get(labelvalues)
+        if child is not None:
+            return child
+        with self._lock:
+            child = self._children.get(labelvalues)
+            if child is None:
+                child = self._new_child()
+                self._children[labelvalues] = child
+            return child
+
+    def acquire(self, *labelvalues):
+        """
+        与 labels 相同，同时增加子指标的引用计数。
+        同名的 Cabin（比如被淘汰的分片与重新创建的分片）共用同一个子指标，
+        每个使用方都通过 release 释放自己的引用，最后一个引用被释放时才移除它
+        """
+        labelvalues = self._get_key(labelvalues)
+        with self._lock:
+            child = self._children.get(labelvalues)
+            if child is None:
+                child = self._new_child()
+                self._children[labelvalues] = child
+                self._references[labelvalues] = 1
+            else:
+                self._references[labelvalues] = \
+                    self._references.get(labelvalues, 0) + 1
+            return child
+
+    def release(self, child, *labelvalues):
+        """
+        释放通过 acquire 获取的 child。标签值对应的子指标已经不是 child 时
+        （比如已经被 remove 移除并重新创建），不做任何修改
+        """
+        labelvalues = self._get_key(labelvalues)
+        with self._lock:
+            if self._children.get(labelvalues) is not child:
+                return
+            count = self._references.get(labelvalues, 0) - 1
+            if count > 0:
+                self._references[labelvalues] = count
+                return
+            self._references.pop(labelvalues, None)
+            del self._children[labelvalues]
+
+    def remove(self, *labelvalues):
+        labelvalues = tuple(str(value) for value in labelvalues)
+        with self._lock:
+            self._children.pop(labelvalues, None)
+            self._references.pop(labelvalues, None)
+
+    def remove_matching(self, *labelvalues):
+        """
+        移除标签值以 labelvalues 开头的全部子指标，
+        比如 remove_matching("cabin") 移除 cabin="cabin" 的全部 reason
+        """
+        labelvalues = tuple(str(value) for value in labelvalues)
+        length = len(labelvalues)
+        with self._lock:
+            for key in [key for key in self._children
+                        if key[:length] == labelvalues]:
+                del self._children[key]
+                self._references.pop(key, None)
+
+    def _get_children(self):
+        with self._lock:
+            return sorted(self._children.items())
+
+    def expose(self):
+        lines = ["# HELP %s %s" % (self._name, self._documentation),
+                 "# TYPE %s %s" % (self._name, self.metric_type)]
+        for labelvalues, child in self._get_children():
+            try:
+                lines.extend(self._expose_child(labelvalues, child))
+            except Exception:
+                LOGGER.exception("fail to collect %s%s", self._name,
+                                 _format_labels(self._labelnames, labelvalues))
+        return lines
+
+    def _expose_child(self, labelvalues, child):
+        value = child.get_value()
+        # 无法获取的值（比如 Executor 不支持查询队列长度）不暴露
+        if value is None:
+            return []
+        return ["%s%s %s" % (
+            self._name,
+            _format_labels(self._labelnames, labelvalues),
+            _format_value(value))]
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._children[()].inc(amount)
+
+    def get_value(self):
+        return self._children[()].get_value()
+
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._children[()].set(value)
+
+    def set_function(self, function):
+        self._children[()].set_function(function)
+
+    def get_value(self):
+        return self._children[()].get_value()
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_LATENCY_BUCKETS):
+        self._buckets = tuple(sorted(buckets))
+        super(Histogram, self).__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self._buckets)
+
+    def observe(self, value):
+        self._children[()].observe(value)
+
+    def get_value(self):
+        return self._children[()].get_value()
+
+    def _expose_child(self, labelvalues, child):
+        cumulative, total, count = child.get_value()
+        lines = []
+        for bound, bucket_count in zip(
+                self._buckets + (float("inf"), ), cumulative):
+            lines.append("%s_bucket%s %d" % (
+                self._name,
+                _format_labels(self._labelnames, labelvalues,
+                               ("le", _format_value(float(bound)))),
+                bucket_count))
+        labels = _format_labels(self._labelnames, labelvalues)
+        lines.append("%s_sum%s %s" % (self._name, labels, _format_value(total)))
+        lines.append("%s_count%s %d" % (self._name, labels, count))
+        return lines
+
+
+class MetricsRegistry(object):
+    """
+    指标注册表。同名的指标只会被创建一次，多个 Cabin 可以共用同一个指标族，
+    通过标签区分
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, metric_class, name, documentation, labelnames,
+                       **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = metric_class(name, documentation, labelnames, **kwargs)
+                self._metrics[name] = metric
+                return metric
+        if metric.__class__ is not metric_class or \
+                metric.get_labelnames() != tuple(labelnames):
+            raise MetricTypeError(name)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(),
+                  buckets=DEFAULT_LATENCY_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames,
+                                   buckets=buckets)
+
+    def get_metric(self, name):
+        return self._metrics.get(name)
+
+    def expose(self):
+        """
+        返回 Prometheus 文本格式（0.0.4）的全部指标
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        lines = []
+        for _, metric in metrics:
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+class CabinMetrics(object):
+    """
+    一个 Cabin 的全部指标。计数器与直方图按线程分片，可以在每个请求上记录；
+    仪表盘在采集时才读取窗口状态、队列长度等，记录时没有开销。
+    全部子指标都通过 acquire 获取，unbind 只释放自己持有的引用，
+    同名的 Cabin 同时存在时（比如 ShardedCabin 中处于宽限期的分片与重新创建的分片），
+    先关闭的 Cabin 不会移除仍在使用的子指标
+    """
+    WINDOW_STATES = (
+        ("open", 0b1),
+        ("half_open", 0b10),
+        ("closed", 0b100),
+    )
+
+    def __init__(self, registry, cabin_name):
+        self._registry = registry
+        self._cabin_name = cabin_name
+        self._lock = threading.Lock()
+        # 元素是 (指标族, 子指标, 标签值)
+        self._acquired = []
+        self._unbound = False
+        labelnames = ("cabin", )
+
+        self.submitted = self._acquire(registry.counter(
+            "steamboat_cabin_submitted_total",
+            "Calls submitted to the cabin.",
+            labelnames), cabin_name)
+        self._rejected = registry.counter(
+            "steamboat_cabin_rejected_total",
+            "Calls rejected by the cabin, by reason.",
+            ("cabin", "reason"))
+        self._rejected_children = {}  # Map: reason -> 子指标
+        self.succeeded = self._acquire(registry.counter(
+            "steamboat_cabin_succeeded_total",
+            "Calls completed successfully.",
+            labelnames), cabin_name)
+        self.failed = self._acquire(registry.counter(
+            "steamboat_cabin_failed_total",
+            "Calls completed with an exception.",
+            labelnames), cabin_name)
+        self.timed_out = self._acquire(registry.counter(
+            "steamboat_cabin_timed_out_total",
+            "Calls that reached the cabin timeout.",
+            labelnames), cabin_name)
+        self.cancelled = self._acquire(registry.counter(
+            "steamboat_cabin_cancelled_total",
+            "Calls cancelled by the caller before they started.",
+            labelnames), cabin_name)
+        self.latency = self._acquire(registry.histogram(
+            "steamboat_cabin_latency_seconds",
+            "Latency from entering the cabin to completion.",
+            labelnames), cabin_name)
+
+        self._window_state = registry.gauge(
+            "steamboat_cabin_window_state",
+            "1 if the window of the cabin is in the given state, else 0.",
+            ("cabin", "state"))
+        self._pending_tasks = registry.gauge(
+            "steamboat_cabin_pending_tasks",
+            "Calls admitted by the cabin and not completed yet.",
+            labelnames)
+        self._queue_size = registry.gauge(
+            "steamboat_executor_queue_size",
+            "Tasks waiting in the queue of the executor of the cabin.",
+            labelnames)
+        self._active_workers = registry.gauge(
+            "steamboat_executor_active_workers",
+            "Workers of the executor of the cabin that are running a task.",
+            labelnames)
+        self._timeout = registry.gauge(
+            "steamboat_cabin_timeout_seconds",
+            "Timeout currently given to calls admitted by the cabin.",
+            labelnames)
+
+    def _acquire(self, metric, *labelvalues):
+        child = metric.acquire(*labelvalues)
+        with self._lock:
+            self._acquired.append((metric, child, labelvalues))
+        return child
+
+    def rejected(self, reason):
+        child = self._rejected_children.get(reason)
+        if child is not None:
+            return child
+        with self._lock:
+            # unbind 之后才完成的调用，记录到不被采集的子指标上
+            if self._unbound:
+                return self._rejected._new_child()
+            child = self._rejected_children.get(reason)
+            if child is None:
+                child = self._rejected.acquire(self._cabin_name, reason)
+                self._acquired.append(
+                    (self._rejected, child, (self._cabin_name, reason)))
+                self._rejected_children[reason] = child
+            return child
+
+    def bind(self,
+             get_window_status,
+             get_pending_task_count,
+             executor,
+             get_timeout=None):
+        """
+        设置在采集时读取的仪表盘。同名的 Cabin 后绑定的覆盖先绑定的
+        """
+        for state, status in self.WINDOW_STATES:
+            self._acquire(
+                self._window_state, self._cabin_name, state).set_function(
+                    lambda status=status: int(get_window_status() == status))
+        self._acquire(self._pending_tasks, self._cabin_name).set_function(
+            get_pending_task_count)
+        self._acquire(self._queue_size, self._cabin_name).set_function(
+            executor.get_queue_size)
+        self._acquire(self._active_workers, self._cabin_name).set_function(
+            executor.get_active_worker_count)
+        if get_timeout is not None:
+            self._acquire(self._timeout, self._cabin_name).set_function(
+                get_timeout)
+
+    def unbind(self):
+        """
+        释放该 Cabin 持有的全部子指标（仪表盘、计数器、直方图）。
+        没有其它同名的 Cabin 使用时，子指标被移除，已经关闭的 Cabin 不再被采集、
+        不再被引用，标签的基数也不会随着分片的创建与淘汰而增长。
+        同名的 Cabin 再次创建时，计数器从 0 开始，Prometheus 会把它当作计数器重置
+        """
+        with self._lock:
+            acquired = self._acquired
+            self._acquired = []
+            self._rejected_children = {}
+            self._unbound = True
+        for metric, child, labelvalues in acquired:
+            metric.release(child, *labelvalues)
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        try:
+            body = self.server.registry.expose()
+        except Exception:
+            LOGGER.exception("fail to expose metrics")
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        LOGGER.debug(format, *args)
+
+
+class MetricsServer(object):
+    """
+    在后台线程中运行的 HTTP 服务，Prometheus 通过 GET /metrics 拉取指标。
+    默认只监听本地地址
+    """
+    def __init__(self, registry, host="127.0.0.1", port=0):
+        """
+        @param registry MetricsRegistry 需要暴露的指标
+        @param host string 监听的地址
+        @param port int 监听的端口，为 0 时由操作系统分配
+        """
+        self._server = HTTPServer((host, port), _MetricsRequestHandler)
+        self._server.registry = registry
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.setName("metrics-server-%d" % self.get_port())
+        self._thread.setDaemon(True)
+
+    def get_port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread.start()
+        LOGGER.info("metrics server is listening on %s:%d",
+                    *self._server.server_address)
+        return self
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
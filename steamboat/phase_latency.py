@@ -0,0 +1,266 @@
+# coding: utf8
+
+import logging
+import math
+import threading
+
+from .metrics import ThreadLocalCells
+
+LOGGER = logging.getLogger(__name__)
+
+# 阶段的名称、起始时间点、结束时间点
+PHASES = (
+    # 从进入 Cabin 到放入 Executor 的队列
+    ("submit", "putted_into_cabin_at", "submitted_to_queue_at"),
+    # 在 Executor 的队列中等待
+    ("queue_wait", "submitted_to_queue_at", "consumed_from_queue_at"),
+    # 执行任务本身，即后端的耗时
+    ("execution", "consumed_from_queue_at", "executed_completion_at"),
+    # 从任务执行完成到离开 Cabin，即回调、分发的开销
+    ("dispatch", "executed_completion_at", "left_cabin_at"),
+    # 从进入 Cabin 到离开 Cabin
+    ("end_to_end", "putted_into_cabin_at", "left_cabin_at"),
+)
+PHASE_NAMES = tuple(phase for phase, _, _ in PHASES)
+
+DEFAULT_PERCENTILES = (50, 90, 99, 99.9)
+
+
+class LogHistogram(object):
+    """
+    对数分桶的直方图。桶的边界按照 growth_factor 等比增长，
+    所以在 min_value 与 max_value 之间，百分位数的相对误差不超过 growth_factor - 1。
+    按线程分片记录，记录时不需要加锁
+    """
+    def __init__(self, min_value=1e-6, max_value=100., growth_factor=1.1):
+        """
+        @param min_value float 小于该值的样本都落在第一个桶中
+        @param max_value float 大于该值的样本都落在最后一个桶中
+        @param growth_factor float 相邻的桶边界的比值
+        """
+        self._min_value = min_value
+        self._growth_factor = growth_factor
+        self._log_growth_factor = math.log(growth_factor)
+        # 第一个桶是 [0, min_value)，最后一个桶是 [max_value, +Inf)
+        self._bucket_count = int(math.ceil(
+            math.log(max_value / min_value) / self._log_growth_factor)) + 2
+        # 每个线程的单元格：各个桶的计数、总和
+        self._cells = ThreadLocalCells(self._bucket_count + 1)
+
+    def _get_index(self, value):
+        if value < self._min_value:
+            return 0
+        index = int(math.log(value / self._min_value) /
+                    self._log_growth_factor) + 1
+        return min(index, self._bucket_count - 1)
+
+    def _get_bounds(self, index):
+        if index == 0:
+            return 0., self._min_value
+        lower = self._min_value * self._growth_factor ** (index - 1)
+        return lower, lower * self._growth_factor
+
+    def observe(self, value):
+        cell = self._cells.get()
+        cell[self._get_index(value)] += 1
+        cell[-1] += value
+
+    def get_counts(self):
+        """
+        返回各个桶的计数与总和组成的列表，可以传给 summarize
+        """
+        return self._cells.sum()
+
+    def get_count(self):
+        return sum(self.get_counts()[:-1])
+
+    def percentile(self, p):
+        """
+        @param p float 0 到 100 之间的百分位
+        @return float、None 没有样本时返回 None
+        """
+        return self._get_percentiles(self.get_counts(), (p, ))[0]
+
+    def _get_percentiles(self, counts, percentiles):
+        total = sum(counts[:-1])
+        if total == 0:
+            return [None] * len(percentiles)
+        values = []
+        for p in percentiles:
+            rank = total * p / 100.
+            cumulative = 0
+            for index, count in enumerate(counts[:-1]):
+                if count == 0 or cumulative + count < rank:
+                    cumulative = cumulative + count
+                    continue
+                lower, upper = self._get_bounds(index)
+                fraction = (rank - cumulative) / float(count)
+                if index == 0:
+                    values.append(upper * fraction)
+                elif index == self._bucket_count - 1:
+                    values.append(lower)
+                else:
+                    # 在桶内按照几何插值
+                    values.append(lower * (upper / lower) ** fraction)
+                break
+            else:
+                values.append(self._get_bounds(self._bucket_count - 1)[0])
+        return values
+
+    def summarize(self, counts, percentiles=DEFAULT_PERCENTILES):
+        """
+        @param counts list get_counts 的返回值，也可以是两次返回值的差
+        @return dict 包含 count、sum、mean 以及 p50 等百分位数
+        """
+        total = sum(counts[:-1])
+        summary = {
+            "count": total,
+            "sum": counts[-1],
+            "mean": counts[-1] / float(total) if total else None,
+        }
+        for p, value in zip(percentiles,
+                            self._get_percentiles(counts, percentiles)):
+            summary["p%s" % ("%g" % p).replace(".", "")] = value
+        return summary
+
+    def snapshot(self, percentiles=DEFAULT_PERCENTILES):
+        return self.summarize(self.get_counts(), percentiles)
+
+
+class PhaseLatencyRecorder(object):
+    """
+    根据 AsyncResult 中记录的时间点，统计一个 Cabin 各个阶段的耗时：
+        submit      进入 Cabin 到放入队列
+        queue_wait  在队列中等待
+        execution   执行任务
+        dispatch    执行完成到离开 Cabin
+        end_to_end  进入 Cabin 到离开 Cabin
+    通过比较 queue_wait 与 execution，可以判断延迟来自排队还是来自后端
+    """
+    def __init__(self,
+                 cabin_name,
+                 metrics_registry=None,
+                 min_value=1e-6,
+                 max_value=100.,
+                 growth_factor=1.1):
+        """
+        @param cabin_name string Cabin 的名称
+        @param metrics_registry MetricsRegistry、None 设置之后，
+            各个阶段的百分位数会以 steamboat_cabin_phase_latency_seconds 暴露
+        """
+        self._cabin_name = cabin_name
+        self._histograms = dict(
+            (phase, LogHistogram(min_value, max_value, growth_factor))
+            for phase in PHASE_NAMES)
+
+        self._snapshot_thread = None
+        self._snapshot_condition = threading.Condition()
+        self._snapshot_stopped = False
+
+        self._phase_gauge = None
+        # 元素是 (子指标, 标签值)，关闭时释放，同名的 Cabin 仍在使用时不会被移除
+        self._gauge_children = []
+        if metrics_registry is not None:
+            self._phase_gauge = metrics_registry.gauge(
+                "steamboat_cabin_phase_latency_seconds",
+                "Latency percentiles of each phase of the calls of the cabin.",
+                ("cabin", "phase", "quantile"))
+            for phase, histogram in self._histograms.iteritems():
+                for p in DEFAULT_PERCENTILES:
+                    labelvalues = (cabin_name, phase, p / 100.)
+                    child = self._phase_gauge.acquire(*labelvalues)
+                    child.set_function(
+                        lambda histogram=histogram, p=p:
+                            histogram.percentile(p))
+                    self._gauge_children.append((child, labelvalues))
+
+    def get_cabin_name(self):
+        return self._cabin_name
+
+    def record(self, async_result):
+        """
+        记录一个已经离开 Cabin 的 AsyncResult。缺少起始或结束时间点的阶段会被跳过
+        """
+        if not async_result.time_info_recorded:
+            return
+        get_timestamp = async_result.get_timestamp
+        histograms = self._histograms
+        for phase, start_key, end_key in PHASES:
+            start = get_timestamp(start_key)
+            if start is None:
+                continue
+            end = get_timestamp(end_key)
+            if end is None:
+                continue
+            histograms[phase].observe(max(end - start, 0.))
+
+    def get_histogram(self, phase):
+        return self._histograms[phase]
+
+    def percentile(self, phase, p):
+        return self._histograms[phase].percentile(p)
+
+    def snapshot(self, percentiles=DEFAULT_PERCENTILES):
+        """
+        @return dict 阶段名称 -> 该阶段从开始记录以来的统计信息
+        """
+        return dict((phase, histogram.snapshot(percentiles))
+                    for phase, histogram in self._histograms.iteritems())
+
+    def start_periodic_snapshots(self,
+                                 interval,
+                                 callback,
+                                 percentiles=DEFAULT_PERCENTILES):
+        """
+        每隔 interval 秒，使用 (cabin_name, snapshot) 调用一次 callback。
+        snapshot 的格式与 snapshot 方法相同，但是只包含这一个周期内的样本
+        """
+        with self._snapshot_condition:
+            if self._snapshot_thread is not None:
+                raise RuntimeError("periodic snapshots already started")
+            self._snapshot_stopped = False
+            self._snapshot_thread = threading.Thread(
+                target=self._snapshot_thread_run,
+                args=(interval, callback, percentiles))
+            self._snapshot_thread.setName(
+                "phase-latency-snapshot-%s" % self._cabin_name)
+            self._snapshot_thread.setDaemon(True)
+            self._snapshot_thread.start()
+        return self
+
+    def _snapshot_thread_run(self, interval, callback, percentiles):
+        previous_counts = dict(
+            (phase, histogram.get_counts())
+            for phase, histogram in self._histograms.iteritems())
+        while True:
+            with self._snapshot_condition:
+                if self._snapshot_stopped:
+                    break
+                self._snapshot_condition.wait(interval)
+                if self._snapshot_stopped:
+                    break
+
+            snapshot = {}
+            for phase, histogram in self._histograms.iteritems():
+                counts = histogram.get_counts()
+                snapshot[phase] = histogram.summarize(
+                    [current - previous for current, previous in
+                     zip(counts, previous_counts[phase])],
+                    percentiles)
+                previous_counts[phase] = counts
+            try:
+                callback(self._cabin_name, snapshot)
+            except Exception:
+                LOGGER.exception("fail to handle phase latency snapshot of %s",
+                                 self._cabin_name)
+        LOGGER.info("phase latency snapshot thread of %s exited",
+                    self._cabin_name)
+
+    def shutdown(self):
+        with self._snapshot_condition:
+            self._snapshot_stopped = True
+            self._snapshot_thread = None
+            self._snapshot_condition.notify_all()
+        gauge_children, self._gauge_children = self._gauge_children, []
+        for child, labelvalues in gauge_children:
+            self._phase_gauge.release(child, *labelvalues)
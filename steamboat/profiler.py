@@ -0,0 +1,181 @@
+# coding: utf8
+
+import logging
+import os
+import sys
+import threading
+
+LOGGER = logging.getLogger(__name__)
+
+# 采样频率的上限（次/秒），避免采样线程占用过多的 GIL
+MAX_SAMPLE_RATE = 1000.
+TRUNCATED_STACK = "[truncated]"
+
+
+class BaseError(StandardError):
+    """
+    异常类的基类
+    """
+    pass
+
+
+class UnsupportedExecutorError(BaseError):
+    """
+    Executor 不能提供工作线程的 ident（比如协程池），无法对它进行采样
+    """
+    pass
+
+
+def _format_frame(frame):
+    code = frame.f_code
+    return "%s (%s:%d)" % (
+        code.co_name,
+        os.path.basename(code.co_filename),
+        code.co_firstlineno)
+
+
+class SamplingProfiler(object):
+    """
+    工作线程的采样分析器。后台线程周期性地通过 sys._current_frames() 获取
+    Executor 的工作线程的调用栈，按照 folded stack 的格式聚合：
+        cabin;outer (file.py:10);inner (file.py:20) 42
+    输出可以直接交给 flamegraph.pl 等工具生成火焰图。
+    可以在运行时调用 start、stop 开启或关闭采样
+    """
+    def __init__(self,
+                 name,
+                 executor,
+                 sample_rate=100.,
+                 busy_only=True,
+                 max_depth=64,
+                 max_stacks=10000):
+        """
+        @param name string 火焰图的根节点，一般是 Cabin 的名称
+        @param executor Executor 需要支持 get_worker_thread_idents
+        @param sample_rate float 每秒采样的次数，不超过 MAX_SAMPLE_RATE
+        @param busy_only bool 是否只对正在执行任务的工作线程采样，
+            空闲线程的调用栈都是在等待任务
+        @param max_depth int 每个调用栈最多保留的帧数（保留最内层的帧）
+        @param max_stacks int 最多保存的不同调用栈的数量，
+            超出之后的样本计入 [truncated]
+        """
+        if executor.get_worker_thread_idents() is None:
+            raise UnsupportedExecutorError(executor.__class__.__name__)
+        self._name = name
+        self._executor = executor
+        self._interval = 1. / min(max(sample_rate, 0.001), MAX_SAMPLE_RATE)
+        self._busy_only = busy_only
+        self._max_depth = max_depth
+        self._max_stacks = max_stacks
+
+        self._stacks = {}  # Map: folded stack -> 采样次数
+        self._sample_count = 0
+        self._lock = threading.Lock()
+
+        self._running = False
+        self._condition = threading.Condition()
+        self._thread = None
+
+    @classmethod
+    def for_cabin(cls, cabin, **kwargs):
+        return cls(cabin.get_name(), cabin.get_executor(), **kwargs)
+
+    def get_name(self):
+        return self._name
+
+    def is_running(self):
+        return self._running
+
+    def start(self):
+        with self._condition:
+            if self._running:
+                return self
+            self._running = True
+            self._thread = threading.Thread(target=self._thread_run)
+            self._thread.setName("sampling-profiler-%s" % self._name)
+            self._thread.setDaemon(True)
+            self._thread.start()
+        LOGGER.info("sampling profiler of %s is started", self._name)
+        return self
+
+    def stop(self):
+        with self._condition:
+            if not self._running:
+                return self
+            self._running = False
+            thread = self._thread
+            self._thread = None
+            self._condition.notify_all()
+        thread.join()
+        LOGGER.info("sampling profiler of %s is stopped", self._name)
+        return self
+
+    def _thread_run(self):
+        ident = threading.current_thread().ident
+        while True:
+            with self._condition:
+                if not self._running:
+                    break
+                self._condition.wait(self._interval)
+                if not self._running:
+                    break
+            try:
+                self.sample(exclude_ident=ident)
+            except Exception:
+                LOGGER.exception("fail to sample threads of %s", self._name)
+
+    def sample(self, exclude_ident=None):
+        """
+        采样一次
+        """
+        idents = self._executor.get_worker_thread_idents(self._busy_only)
+        if not idents:
+            return
+        frames = sys._current_frames()
+        folded_stacks = []
+        for ident in idents:
+            if ident == exclude_ident:
+                continue
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None and len(names) < self._max_depth:
+                names.append(_format_frame(frame))
+                frame = frame.f_back
+            names.append(self._name)
+            names.reverse()
+            folded_stacks.append(";".join(names))
+        del frames
+
+        with self._lock:
+            self._sample_count = self._sample_count + 1
+            for folded_stack in folded_stacks:
+                if folded_stack not in self._stacks and \
+                        len(self._stacks) >= self._max_stacks:
+                    folded_stack = "%s;%s" % (self._name, TRUNCATED_STACK)
+                self._stacks[folded_stack] = \
+                    self._stacks.get(folded_stack, 0) + 1
+
+    def get_sample_count(self):
+        return self._sample_count
+
+    def get_stacks(self):
+        """
+        @return dict folded stack -> 采样次数
+        """
+        with self._lock:
+            return dict(self._stacks)
+
+    def get_folded_stacks(self):
+        """
+        返回 folded stack 格式的文本，每行是“调用栈 次数”，按次数从多到少排序
+        """
+        stacks = sorted(self.get_stacks().iteritems(),
+                        key=lambda item: item[1], reverse=True)
+        return "".join("%s %d\n" % item for item in stacks)
+
+    def reset(self):
+        with self._lock:
+            self._stacks = {}
+            self._sample_count = 0
@@ -0,0 +1,226 @@
+# coding: utf8
+
+"""
+内置的拒绝策略，可以作为 ThreadPoolExecutor、TornadoCoroutineExecutor 的
+reject_handler：队列已满时，Executor 使用 (queue, task_item) 调用它。
+策略抛出的异常会被 Executor 抛给提交方（批量提交时包装成 RejectedError），
+Cabin 把它记为提交失败。
+
+    AbortPolicy          抛出 Full，与示例中的 reject_handler 相同
+    CallerRunsPolicy     在提交任务的线程中直接执行任务，使提交方自然地放慢
+    BlockPolicy          最多等待 timeout 秒，直到队列中有空位
+    DropOldestPolicy     淘汰队列中 deadline 最早的任务，使它失败，再放入新任务
+    SpillPolicy          转交给另一个（溢出）Executor
+
+传入 metrics_registry 时，每个决定都会记录到
+steamboat_reject_policy_decisions_total{policy, decision} 中
+"""
+
+from abc import ABCMeta, abstractmethod
+from Queue import Queue, PriorityQueue, Full
+
+from .executor import RejectedError
+
+
+class BaseError(StandardError):
+    """
+    异常类的基类
+    """
+    pass
+
+
+class EvictedError(BaseError):
+    """
+    任务在队列中被 DropOldestPolicy 淘汰。
+    被淘汰的任务的 AsyncResult 会被设置为 RejectedError(EvictedError())
+    """
+    pass
+
+
+class RejectPolicy(object):
+    """
+    拒绝策略的基类。子类实现 _reject，并用 _record 记录做出的决定
+    """
+    __metaclass__ = ABCMeta
+
+    POLICY = None
+    DECISIONS = ()
+
+    def __init__(self, metrics_registry=None, name=None):
+        """
+        @param metrics_registry metrics.MetricsRegistry、None
+        @param name string、None 指标中 policy 标签的值，默认是 POLICY
+        """
+        self._name = name or self.POLICY
+        self._decisions = None
+        if metrics_registry is not None:
+            counter = metrics_registry.counter(
+                "steamboat_reject_policy_decisions_total",
+                "Decisions made by reject policies when the queue is full.",
+                ("policy", "decision"))
+            self._decisions = dict(
+                (decision, counter.labels(self._name, decision))
+                for decision in self.DECISIONS)
+
+    def get_name(self):
+        return self._name
+
+    def _record(self, decision):
+        if self._decisions is not None:
+            self._decisions[decision].inc()
+
+    def __call__(self, queue, task_item):
+        self._reject(queue, task_item)
+
+    @abstractmethod
+    def _reject(self, queue, task_item):
+        pass
+
+
+def _run_task_item(task_item):
+    async_result = task_item.async_result
+    function, args, kwargs = task_item.take()
+    try:
+        if not async_result.set_running_or_notify_cancel():
+            return
+    except RuntimeError:
+        # 已经被其它线程完成（比如超时）
+        return
+    try:
+        result = function(*args, **kwargs)
+    except BaseException as exc:
+        async_result.set_time_info("executed_completion_at").set_exception(exc)
+    else:
+        async_result.set_time_info("executed_completion_at").set_result(result)
+
+
+class AbortPolicy(RejectPolicy):
+    POLICY = "abort"
+    DECISIONS = ("rejected", )
+
+    def _reject(self, queue, task_item):
+        self._record("rejected")
+        raise Full
+
+
+class CallerRunsPolicy(RejectPolicy):
+    """
+    在提交任务的线程中执行任务，提交方要等任务执行完成才能返回。
+    只适用于 ThreadPoolExecutor：在 IOLoop 中同步地执行协程函数只会得到一个 Future
+    """
+    POLICY = "caller_runs"
+    DECISIONS = ("caller_ran", )
+
+    def _reject(self, queue, task_item):
+        self._record("caller_ran")
+        _run_task_item(task_item)
+
+
+class BlockPolicy(RejectPolicy):
+    """
+    阻塞提交方，最多等待 timeout 秒，超时后抛出 Full。
+    只适用于 Queue.Queue：IOLoop 的线程被阻塞时，协程不会消费队列
+    """
+    POLICY = "block"
+    DECISIONS = ("enqueued", "timed_out")
+
+    def __init__(self, timeout, metrics_registry=None, name=None):
+        """
+        @param timeout float 最长的等待时间（秒）
+        """
+        RejectPolicy.__init__(self, metrics_registry, name)
+        self._timeout = timeout
+
+    def _reject(self, queue, task_item):
+        if not isinstance(queue, Queue):
+            raise TypeError("BlockPolicy requires Queue.Queue")
+        try:
+            queue.put(task_item, timeout=self._timeout)
+        except Full:
+            self._record("timed_out")
+            raise
+        task_item.async_result.set_time_info("submitted_to_queue_at")
+        self._record("enqueued")
+
+
+class DropOldestPolicy(RejectPolicy):
+    """
+    淘汰队列中 deadline 最早（最可能已经无法按时完成）的任务，再放入新任务；
+    没有 deadline 的任务视为 deadline 最晚，都没有 deadline 时淘汰队首的任务。
+    如果新任务的 deadline 比队列中的全部任务都早，则拒绝新任务。
+    只适用于 Queue.Queue，PriorityQueue 的顺序由堆决定，不能从中间删除
+    """
+    POLICY = "drop_oldest"
+    DECISIONS = ("evicted", "rejected")
+
+    def _reject(self, queue, task_item):
+        if not isinstance(queue, Queue) or isinstance(queue, PriorityQueue):
+            raise TypeError("DropOldestPolicy requires Queue.Queue")
+        deadline = task_item.async_result.deadline
+        with queue.mutex:
+            items = queue.queue
+            evicted_index = None
+            evicted_deadline = None
+            for index, item in enumerate(items):
+                item_deadline = item.async_result.deadline
+                if item_deadline is None:
+                    if evicted_index is None:
+                        evicted_index = index
+                    continue
+                if evicted_deadline is None or item_deadline < evicted_deadline:
+                    evicted_index = index
+                    evicted_deadline = item_deadline
+            if evicted_index is None or (
+                    deadline is not None and (evicted_deadline is None or
+                                              deadline < evicted_deadline)):
+                evicted = None
+            else:
+                # 用新任务替换被淘汰的任务，队列的长度与 unfinished_tasks 不变
+                evicted = items[evicted_index]
+                del items[evicted_index]
+                queue._put(task_item)
+                queue.not_empty.notify()
+        if evicted is None:
+            self._record("rejected")
+            raise Full
+        task_item.async_result.set_time_info("submitted_to_queue_at")
+        self._record("evicted")
+
+        # 在队列的锁之外完成被淘汰的任务，它的回调可能比较耗时
+        evicted.release()
+        async_result = evicted.async_result
+        try:
+            if not async_result.set_running_or_notify_cancel():
+                return
+        except RuntimeError:
+            return
+        async_result.set_exception(RejectedError(EvictedError()))
+
+
+class SpillPolicy(RejectPolicy):
+    """
+    把任务交给溢出 Executor，它使用同一个 AsyncResult，提交方感觉不到差别。
+    溢出 Executor 也拒绝时，异常被抛给提交方
+    """
+    POLICY = "spill"
+    DECISIONS = ("spilled", "rejected")
+
+    def __init__(self, overflow_executor, metrics_registry=None, name=None):
+        """
+        @param overflow_executor executor.Executor
+        """
+        RejectPolicy.__init__(self, metrics_registry, name)
+        self._overflow_executor = overflow_executor
+
+    def get_overflow_executor(self):
+        return self._overflow_executor
+
+    def _reject(self, queue, task_item):
+        function, args, kwargs = task_item.take()
+        try:
+            self._overflow_executor.submit_task_with_result(
+                task_item.async_result, function, *args, **kwargs)
+        except Exception:
+            self._record("rejected")
+            raise
+        self._record("spilled")
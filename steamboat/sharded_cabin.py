@@ -0,0 +1,228 @@
+# coding: utf8
+
+import copy
+import heapq
+import itertools
+import logging
+import threading
+
+from .clock import monotonic
+
+LOGGER = logging.getLogger(__name__)
+
+
+class BaseError(StandardError):
+    """
+    异常类的基类
+    """
+    pass
+
+
+class TooManyShardsError(BaseError):
+    """
+    分片数量已经达到上限，并且没有可以淘汰的分片
+    """
+    pass
+
+
+class _Shard(object):
+    __slots__ = ("key", "cabin", "executor", "last_used_at", "retired_at")
+
+    def __init__(self, key, cabin, executor):
+        self.key = key
+        self.cabin = cabin
+        self.executor = executor  # 由分片自己创建的 executor，没有时为 None
+        self.last_used_at = monotonic()
+        self.retired_at = None
+
+
+class ShardedCabin(object):
+    """
+    分片船舱。按照 key（比如租户、下游主机）将请求路由到不同的分片，
+    每个分片都是一个独立的 Cabin，拥有自己的窗口：
+        分片在第一次被使用时，根据 CabinBuilder 模板创建；
+        空闲时间超过 idle_timeout 的分片会被淘汰；
+        分片数量不会超过 max_shards，达到上限时淘汰最久未使用的空闲分片；
+        被淘汰的分片至少保留 retire_grace_period 秒之后才会被关闭
+    查找分片时只进行一次字典查找，不需要加锁
+    """
+    def __init__(self,
+                 name,
+                 cabin_builder,
+                 executor_factory=None,
+                 idle_timeout=300,
+                 max_shards=1024,
+                 retire_grace_period=None):
+        """
+        @param name string 分片船舱的名称，也是分片名称的前缀
+        @param cabin_builder CabinBuilder 用于创建分片的模板
+        @param executor_factory callable、None 使用 key 调用它，为分片创建独立的
+            executor；为 None 时，所有分片共用 cabin_builder 中的 executor
+        @param idle_timeout float 空闲超过该时间（秒）的分片会被淘汰
+        @param max_shards int 分片数量的上限
+        @param retire_grace_period float、None 被淘汰的分片在关闭之前至少保留的时间（秒），
+            使得刚刚通过 get_shard 拿到它、尚未提交任务的调用方不会遇到 ShutDownError；
+            为 None 时等于淘汰线程的检查间隔
+        """
+        self._name = name
+        self._cabin_builder = cabin_builder
+        self._executor_factory = executor_factory
+        self._idle_timeout = idle_timeout
+        self._max_shards = max_shards
+        self._evict_interval = max(idle_timeout / 2., 1.)
+        if retire_grace_period is None:
+            retire_grace_period = self._evict_interval
+        self._retire_grace_period = retire_grace_period
+
+        self._shards = {}  # Map: key -> _Shard
+        self._lock = threading.Lock()
+        # 最小堆，元素是 (last_used_at, 序号, _Shard)。get_shard 不加锁地更新
+        # last_used_at，所以堆中的时间可能是旧的，淘汰时再惰性地修正
+        self._lru_heap = []
+        self._next_sequence = itertools.count().next
+        # 已经从 _shards 中移除、但是仍然可能被使用的分片
+        self._retired_shards = []
+
+        self._shut_down = False
+        self._evict_condition = threading.Condition(self._lock)
+        self._evict_thread = threading.Thread(target=self._evict_thread_run)
+        self._evict_thread.setDaemon(True)
+        self._evict_thread.start()
+
+    def get_name(self):
+        return self._name
+
+    def get_shard(self, key):
+        shard = self._shards.get(key)
+        if shard is not None:
+            shard.last_used_at = monotonic()
+            return shard.cabin
+        return self._create_shard(key).cabin
+
+    def get_shard_count(self):
+        return len(self._shards)
+
+    def get_retired_shard_count(self):
+        return len(self._retired_shards)
+
+    def _create_shard(self, key):
+        with self._lock:
+            shard = self._shards.get(key)
+            if shard is not None:
+                shard.last_used_at = monotonic()
+                return shard
+            if self._shut_down:
+                raise RuntimeError("sharded cabin %s closed" % self._name)
+            if len(self._shards) >= self._max_shards:
+                self._evict_least_recently_used()
+
+            builder = copy.copy(self._cabin_builder)
+            builder.with_name("%s[%s]" % (self._name, key))
+            executor = None
+            if self._executor_factory is not None:
+                executor = self._executor_factory(key)
+                builder.with_executor(executor)
+            shard = _Shard(key, builder.build(), executor)
+            self._shards[key] = shard
+            heapq.heappush(self._lru_heap,
+                           (shard.last_used_at, self._next_sequence(), shard))
+            LOGGER.info("shard %s is created", shard.cabin.get_name())
+            return shard
+
+    def _evict_least_recently_used(self):
+        """
+        调用方需要持有 self._lock
+        """
+        heap = self._lru_heap
+        busy_entries = []
+        try:
+            while heap:
+                last_used_at, sequence, shard = heapq.heappop(heap)
+                if self._shards.get(shard.key) is not shard:
+                    # 已经被淘汰
+                    continue
+                if shard.last_used_at > last_used_at:
+                    heapq.heappush(heap, (shard.last_used_at, sequence, shard))
+                    continue
+                if shard.cabin.get_pending_task_count() != 0:
+                    busy_entries.append((last_used_at, sequence, shard))
+                    continue
+                self._retire(shard)
+                return
+            raise TooManyShardsError(self._name)
+        finally:
+            for entry in busy_entries:
+                heapq.heappush(heap, entry)
+
+    def _retire(self, shard):
+        """
+        调用方需要持有 self._lock。
+        分片不会被立即关闭：其它线程可能刚刚通过 get_shard 拿到它、还没有提交任务，
+        所以至少保留 retire_grace_period 秒，并且等到它没有在途任务时，
+        再由淘汰线程关闭
+        """
+        self._shards.pop(shard.key, None)
+        shard.retired_at = monotonic()
+        self._retired_shards.append(shard)
+        LOGGER.info("shard %s is retired", shard.cabin.get_name())
+
+    def evict_idle_shards(self):
+        with self._lock:
+            now = monotonic()
+            for shard in self._shards.values():
+                if now - shard.last_used_at >= self._idle_timeout and \
+                        shard.cabin.get_pending_task_count() == 0:
+                    self._retire(shard)
+            # 重建堆，丢弃已经淘汰的分片的元素，并修正 last_used_at
+            self._lru_heap = [
+                (shard.last_used_at, self._next_sequence(), shard)
+                for shard in self._shards.itervalues()]
+            heapq.heapify(self._lru_heap)
+
+            retired_shards = []
+            remaining_shards = []
+            for shard in self._retired_shards:
+                if now - shard.retired_at >= self._retire_grace_period and \
+                        shard.cabin.get_pending_task_count() == 0:
+                    retired_shards.append(shard)
+                else:
+                    remaining_shards.append(shard)
+            self._retired_shards = remaining_shards
+
+        for shard in retired_shards:
+            self._shutdown_shard(shard)
+
+    def _shutdown_shard(self, shard):
+        shard.cabin.shutdown()
+        if shard.executor is not None:
+            shard.executor.shutdown()
+        LOGGER.info("shard %s is shut down", shard.cabin.get_name())
+
+    def _evict_thread_run(self):
+        interval = self._evict_interval
+        while True:
+            with self._lock:
+                if self._shut_down:
+                    break
+                self._evict_condition.wait(interval)
+                if self._shut_down:
+                    break
+            try:
+                self.evict_idle_shards()
+            except Exception:
+                LOGGER.exception("fail to evict idle shards of %s", self._name)
+        LOGGER.info("evict thread of %s exited", self._name)
+
+    def shutdown(self):
+        with self._lock:
+            if self._shut_down:
+                return
+            self._shut_down = True
+            shards = self._shards.values() + self._retired_shards
+            self._shards = {}
+            self._lru_heap = []
+            self._retired_shards = []
+            self._evict_condition.notify_all()
+
+        for shard in shards:
+            self._shutdown_shard(shard)
@@ -0,0 +1,310 @@
+# coding: utf8
+
+"""
+进程间共享的窗口
+
+在 pre-fork 的部署方式中，同一台机器上的多个工作进程各自拥有一个 Window，
+每个进程都要单独发现后端故障。SharedWindow 把窗口的状态与统计信息保存在
+内存映射的文件（默认在 /dev/shm 中）里，读写时使用 flock 在进程之间互斥，
+所以同一台机器上的所有进程一起熔断、一起恢复。
+
+各个进程的窗口参数应该相同。无法使用共享内存时，
+shared_window_factory 退化为使用进程内的 Window
+"""
+
+import logging
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .window import Window, WindowStatus
+
+LOGGER = logging.getLogger(__name__)
+
+MAGIC = "SBW1"
+# 共享内存的布局：magic、序号、起始位置、状态、成功、失败、超时、拒绝的次数、引用计数
+_LAYOUT = struct.Struct("<4sIdqqqqqq")
+SEGMENT_SIZE = _LAYOUT.size
+_SEQUENCE_OFFSET = 4
+_REFERENCE_COUNT_OFFSET = 56
+
+
+class BaseError(StandardError):
+    """
+    异常类的基类
+    """
+    pass
+
+
+class SharedMemoryUnavailableError(BaseError):
+    pass
+
+
+class _Segment(object):
+    """
+    内存映射的文件。flock 的锁属于打开的文件描述，
+    fork 之后父子进程共用同一个文件描述，所以子进程需要重新打开文件。
+    文件中记录了使用它的窗口的数量，最后一个窗口关闭时删除文件
+    """
+    def __init__(self, path):
+        if fcntl is None:
+            raise SharedMemoryUnavailableError("fcntl is not available")
+        self._path = path
+        self._pid = None
+        self._fd = None
+        self.mmap = None
+        self._open_and_lock()
+        try:
+            self.mmap = mmap.mmap(self._fd, SEGMENT_SIZE)
+            self._add_reference(1)
+        finally:
+            self.unlock()
+
+    def _open_and_lock(self):
+        while True:
+            self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            # 其它进程可能在打开文件之后、加锁之前关闭了最后一个窗口并删除了文件
+            if self._is_linked():
+                break
+            os.close(self._fd)
+        if os.fstat(self._fd).st_size < SEGMENT_SIZE:
+            os.ftruncate(self._fd, SEGMENT_SIZE)
+
+    def _is_linked(self):
+        try:
+            stat = os.stat(self._path)
+        except OSError:
+            return False
+        return os.path.samestat(stat, os.fstat(self._fd))
+
+    def _add_reference(self, delta):
+        """
+        调用方需要持有 flock
+        """
+        count = struct.unpack_from(
+            "<q", self.mmap, _REFERENCE_COUNT_OFFSET)[0] + delta
+        struct.pack_into("<q", self.mmap, _REFERENCE_COUNT_OFFSET, count)
+        return count
+
+    def get_path(self):
+        return self._path
+
+    def lock(self):
+        if self._pid != os.getpid():
+            # fork 之后的子进程重新打开文件并映射，它也是文件的一个使用方
+            os.close(self._fd)
+            self._open_and_lock()
+            self.mmap = mmap.mmap(self._fd, SEGMENT_SIZE)
+            self._add_reference(1)
+            return
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+    def unlock(self):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def is_initialized(self):
+        return self.mmap[:len(MAGIC)] == MAGIC
+
+    def close(self):
+        """
+        @return _DetachedSegment 保存着关闭时的状态的进程内副本
+        """
+        self.lock()
+        try:
+            if self._add_reference(-1) <= 0 and self._is_linked():
+                os.unlink(self._path)
+            detached = _DetachedSegment(self._path, self.mmap[:])
+        finally:
+            self.unlock()
+        self.mmap.close()
+        os.close(self._fd)
+        return detached
+
+
+class _DetachedSegment(object):
+    """
+    关闭之后的窗口使用的进程内副本。已经关闭的 Cabin 中仍在执行的任务完成时，
+    还会更新窗口，这些更新不再影响其它进程
+    """
+    def __init__(self, path, data):
+        self._path = path
+        self.mmap = mmap.mmap(-1, len(data))
+        self.mmap[:] = data
+
+    def get_path(self):
+        return self._path
+
+    def lock(self):
+        pass
+
+    def unlock(self):
+        pass
+
+    def is_initialized(self):
+        return True
+
+    def close(self):
+        return self
+
+
+class _SharedLock(object):
+    """
+    可重入的锁：线程之间使用 RLock 互斥，最外层加锁时再使用 flock 在进程之间互斥
+    """
+    def __init__(self, window):
+        self._window = window
+        self._lock = threading.RLock()
+        self._depth = 0
+
+    def __enter__(self):
+        self._lock.acquire()
+        self._depth = self._depth + 1
+        if self._depth == 1:
+            try:
+                self._window._segment.lock()
+            except BaseException:
+                self._depth = self._depth - 1
+                self._lock.release()
+                raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._depth = self._depth - 1
+        try:
+            if self._depth == 0:
+                self._window._segment.unlock()
+        finally:
+            self._lock.release()
+
+
+def _shared_field(offset, fmt):
+    field = struct.Struct(fmt)
+
+    def _get(self):
+        return field.unpack_from(self._segment.mmap, offset)[0]
+
+    def _set(self, value):
+        field.pack_into(self._segment.mmap, offset, value)
+
+    return property(_get, _set)
+
+
+class SharedWindow(Window):
+    """
+    状态保存在共享内存中的 Window。
+    窗口的判断逻辑与 Window 完全相同，只是把字段的读写换成了对共享内存的读写。
+
+    状态转换时，写方在持有锁的情况下把序号加一（奇数），修改起始位置与状态，
+    再把序号加一（偶数）。get_status 先不加锁地读取序号、起始位置、状态，
+    序号是偶数、前后一致，并且位置在窗口内时直接返回状态；
+    只有需要转换状态或者读取期间有写入时才加锁，准入路径上通常没有系统调用
+    """
+    _sequence = _shared_field(_SEQUENCE_OFFSET, "<I")
+    _start_position = _shared_field(8, "<d")
+    _status = _shared_field(16, "<q")
+    _success_count = _shared_field(24, "<q")
+    _failure_count = _shared_field(32, "<q")
+    _timeout_count = _shared_field(40, "<q")
+    _rejection_count = _shared_field(48, "<q")
+
+    def __init__(self, path, *a, **kw):
+        """
+        @param path string 共享内存的文件路径，同一个文件中的窗口被所有进程共用
+        其余参数与 Window 相同。文件中已经有状态时，忽略 start_position 与 status
+        """
+        self._segment = _Segment(path)
+        super(SharedWindow, self).__init__(*a, **kw)
+        self._lock = _SharedLock(self)
+
+    def _initialize_state(self, start_position, status):
+        # 只有第一个打开文件的进程初始化状态
+        self._segment.lock()
+        try:
+            if self._segment.is_initialized():
+                return
+            super(SharedWindow, self)._initialize_state(start_position, status)
+            self._segment.mmap[:len(MAGIC)] = MAGIC
+        finally:
+            self._segment.unlock()
+
+    def get_status(self, position):
+        sequence = self._sequence
+        if not sequence & 1:
+            start_position = self._start_position
+            status = self._status
+            if self._sequence == sequence and position >= start_position:
+                if status == WindowStatus.OPEN:
+                    length = self._open_length
+                elif status == WindowStatus.CLOSED:
+                    length = self._closed_length
+                else:
+                    length = self._half_open_length
+                if position < start_position + length:
+                    return status
+        return super(SharedWindow, self).get_status(position)
+
+    def _transit(self, enter, position):
+        """
+        调用方需要持有锁
+        """
+        self._sequence = (self._sequence + 1) & 0xffffffff
+        try:
+            enter(self, position)
+        finally:
+            self._sequence = (self._sequence + 1) & 0xffffffff
+
+    def _enter_into_close_status(self, position):
+        self._transit(Window._enter_into_close_status, position)
+
+    def _enter_into_open_status(self, position):
+        self._transit(Window._enter_into_open_status, position)
+
+    def _enter_into_half_open_status(self, position):
+        self._transit(Window._enter_into_half_open_status, position)
+
+    def get_path(self):
+        return self._segment.get_path()
+
+    def close(self):
+        """
+        关闭共享内存，最后一个使用文件的窗口关闭时删除文件。
+        关闭之后，窗口使用进程内的副本继续工作
+        """
+        with self._lock:
+            self._segment = self._segment.close()
+
+
+def _get_default_directory():
+    if os.path.isdir("/dev/shm"):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+def shared_window_factory(directory=None, prefix="steamboat-window-"):
+    """
+    返回可以交给 CabinBuilder.with_window_factory 的工厂函数。
+    每个 Cabin 使用 directory 下名为 prefix + Cabin 名称 的文件；
+    无法创建共享内存时，记录警告，并使用进程内的 Window
+
+    @param directory string、None 默认是 /dev/shm，不存在时使用临时目录
+    """
+    def _factory(name, *a):
+        path = os.path.join(
+            directory or _get_default_directory(),
+            prefix + re.sub(r"[^\w.-]", "_", name))
+        try:
+            return SharedWindow(path, *a)
+        except (EnvironmentError, BaseError) as exc:
+            LOGGER.warning("fall back to local window for %s: %s", name, exc)
+            return Window(*a)
+    return _factory
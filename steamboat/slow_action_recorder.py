@@ -1,30 +1,172 @@
 # coding: utf8
 
-import time
 import functools
+import heapq
+import logging
+import random
+import threading
+import time
+from Queue import Queue, Full
+
+from .clock import monotonic
+from .phase_latency import LogHistogram
+
+LOGGER = logging.getLogger(__name__)
+
+
+class AsyncLogSink(object):
+    """
+    非阻塞的日志输出。调用方只把日志放入有界队列，由后台线程调用 log_func；
+    队列满了的时候直接丢弃日志并计数，不会阻塞调用方。
+    可以作为 SlowActionRecorder 的 log_func 使用
+    """
+    _STOP = object()
+
+    def __init__(self, log_func, max_pending=1000):
+        """
+        @param log_func callable 使用 (message, extra=extra) 调用，比如 logger.warning
+        @param max_pending int 队列中最多保存的日志数量
+        """
+        self._log_func = log_func
+        self._queue = Queue(max_pending)
+        self._dropped_count = 0
+        self._dropped_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._thread_run)
+        self._thread.setName("async-log-sink")
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def __call__(self, message, extra=None):
+        try:
+            self._queue.put_nowait((message, extra))
+        except Full:
+            with self._dropped_lock:
+                self._dropped_count = self._dropped_count + 1
+
+    def get_dropped_count(self):
+        return self._dropped_count
+
+    def _thread_run(self):
+        while True:
+            item = self._queue.get()
+            if item is self._STOP:
+                break
+            message, extra = item
+            try:
+                self._log_func(message, extra=extra)
+            except Exception:
+                LOGGER.exception("fail to write log %s", message)
+
+    def shutdown(self, timeout=None):
+        """
+        写完已经放入队列的日志之后，停止后台线程
+        """
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+
+
+class _RateLimiter(object):
+    """
+    令牌桶，每秒生成 rate 个令牌，最多积攒 burst 个
+    """
+    def __init__(self, rate, burst):
+        self._rate = float(rate)
+        self._burst = burst
+        self._tokens = float(burst)
+        self._updated_at = monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = monotonic()
+            self._tokens = min(
+                self._burst,
+                self._tokens + (now - self._updated_at) * self._rate)
+            self._updated_at = now
+            if self._tokens < 1:
+                return False
+            self._tokens = self._tokens - 1
+            return True
+
+
+class _Aggregation(object):
+    """
+    一个 (message, 函数) 的聚合状态。直方图在各个输出周期之间复用，
+    输出时与上一次的计数相减，得到这一个周期内的样本
+    """
+    __slots__ = ("histogram", "flushed_counts", "max_time_elapsed")
+
+    def __init__(self):
+        self.histogram = LogHistogram()
+        self.flushed_counts = None
+        # 没有加锁，在并发时可能偏小
+        self.max_time_elapsed = 0.
 
 
 class SlowActionRecorder(object):
-    def __init__(self, log_func, slow_threshold, message=None):
+    """
+    记录执行时间超过阈值的调用：
+        sample_rate 小于 1 时，只对部分调用计时，未被采样的调用没有额外开销；
+        max_logs_per_second 限制输出日志的速率，被限制的日志只计数，
+        并在下一条日志的 extra["suppressed_count"] 中报告；
+        设置 aggregate_interval 之后，不再逐条输出日志，而是按照 (message, 函数)
+        聚合数量、最大值、平均值和百分位数，每隔 aggregate_interval 秒输出一次；
+        top_n 大于 0 时，保存耗时最长的 top_n 次调用与最近的 top_n 次慢调用。
+    需要非阻塞地输出日志时，可以使用 AsyncLogSink 作为 log_func
+    """
+    def __init__(self,
+                 log_func,
+                 slow_threshold,
+                 message=None,
+                 sample_rate=1.,
+                 max_logs_per_second=None,
+                 aggregate_interval=None,
+                 top_n=0):
         self._log_func = log_func
         self._slow_threshold = slow_threshold
         self._message = message
+        self._sample_rate = sample_rate
+
+        self._rate_limiter = None
+        if max_logs_per_second is not None:
+            self._rate_limiter = _RateLimiter(
+                max_logs_per_second, max(max_logs_per_second, 1))
+        self._suppressed_count = 0
+
+        self._top_n = top_n
+        self._slowest_calls = []  # 小顶堆：(time_elapsed, id, record)
+        self._recent_slow_calls = []  # 环形缓冲区
+        self._recent_slow_call_index = 0
+        self._call_count = 0
+
+        self._lock = threading.Lock()
+        self._aggregate_interval = aggregate_interval
+        self._aggregations = {}  # Map: (message, func_name) -> _Aggregation
+        self._flush_lock = threading.Lock()
+        self._aggregate_condition = threading.Condition(self._lock)
+        self._shut_down = False
+        if aggregate_interval is not None:
+            self._aggregate_thread = threading.Thread(
+                target=self._aggregate_thread_run)
+            self._aggregate_thread.setName("slow-action-aggregator")
+            self._aggregate_thread.setDaemon(True)
+            self._aggregate_thread.start()
 
     def _wrapper(self, fn, message):
+        func_name = fn.__name__
+
         @functools.wraps(fn)
         def _inner(*a, **kw):
-            start_time = time.time()
+            sample_rate = self._sample_rate
+            if sample_rate < 1 and random.random() >= sample_rate:
+                return fn(*a, **kw)
+            start_time = monotonic()
             try:
                 return fn(*a, **kw)
             finally:
-                time_elapsed = time.time() - start_time
-                extra = {}
-                extra["time_elapsed"] = time_elapsed
-                extra["func_name"] = fn.__name__
-                extra["func_args"] = a
-                extra["func_kwargs"] = kw
+                time_elapsed = monotonic() - start_time
                 if time_elapsed >= self._slow_threshold:
-                    self._log_func(message, extra=extra)
+                    self._on_slow_action(message, func_name, time_elapsed, a, kw)
         return _inner
 
     def __call__(self, message):
@@ -34,11 +176,143 @@ class SlowActionRecorder(object):
         return functools.partial(self._wrapper, message=message)
 
     def __enter__(self):
-        self._start_time = time.time()
+        self._start_time = monotonic()
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        time_elapsed = time.time() - self._start_time
+        time_elapsed = monotonic() - self._start_time
         if time_elapsed >= self._slow_threshold:
-            self._log_func(self._message,
-                extra={"time_elapsed": time_elapsed})
+            self._on_slow_action(self._message, None, time_elapsed, None, None)
+
+    def _on_slow_action(self, message, func_name, time_elapsed, a, kw):
+        if self._top_n > 0:
+            self._record_top_n(func_name, time_elapsed)
+
+        if self._aggregate_interval is not None:
+            self._aggregate(message, func_name, time_elapsed)
+            return
+
+        if self._rate_limiter is not None and not self._rate_limiter.acquire():
+            with self._lock:
+                self._suppressed_count = self._suppressed_count + 1
+            return
+
+        extra = {"time_elapsed": time_elapsed}
+        if func_name is not None:
+            extra["func_name"] = func_name
+            extra["func_args"] = a
+            extra["func_kwargs"] = kw
+        if self._suppressed_count:
+            with self._lock:
+                extra["suppressed_count"] = self._suppressed_count
+                self._suppressed_count = 0
+        self._log_func(message, extra=extra)
+
+    def _record_top_n(self, func_name, time_elapsed):
+        record = {
+            "func_name": func_name,
+            "time_elapsed": time_elapsed,
+            "finished_at": time.time(),
+        }
+        with self._lock:
+            self._call_count = self._call_count + 1
+            item = (time_elapsed, self._call_count, record)
+            if len(self._slowest_calls) < self._top_n:
+                heapq.heappush(self._slowest_calls, item)
+            elif time_elapsed > self._slowest_calls[0][0]:
+                heapq.heapreplace(self._slowest_calls, item)
+
+            if len(self._recent_slow_calls) < self._top_n:
+                self._recent_slow_calls.append(record)
+            else:
+                self._recent_slow_calls[self._recent_slow_call_index] = record
+            self._recent_slow_call_index = \
+                (self._recent_slow_call_index + 1) % self._top_n
+
+    def get_slowest_calls(self):
+        """
+        返回耗时最长的 top_n 次调用，按耗时从长到短排序
+        """
+        with self._lock:
+            items = sorted(self._slowest_calls, reverse=True)
+        return [record for _, _, record in items]
+
+    def get_recent_slow_calls(self):
+        """
+        返回最近的 top_n 次慢调用，按发生的先后排序
+        """
+        with self._lock:
+            index = self._recent_slow_call_index
+            if len(self._recent_slow_calls) < self._top_n:
+                return list(self._recent_slow_calls)
+            return self._recent_slow_calls[index:] + \
+                self._recent_slow_calls[:index]
+
+    def _aggregate(self, message, func_name, time_elapsed):
+        key = message, func_name
+        aggregation = self._aggregations.get(key)
+        if aggregation is None:
+            # 只有第一次遇到 (message, 函数) 时才需要加锁
+            with self._lock:
+                aggregation = self._aggregations.get(key)
+                if aggregation is None:
+                    aggregation = _Aggregation()
+                    self._aggregations[key] = aggregation
+        aggregation.histogram.observe(time_elapsed)
+        if time_elapsed > aggregation.max_time_elapsed:
+            aggregation.max_time_elapsed = time_elapsed
+
+    def flush(self):
+        """
+        输出上一次输出之后聚合的统计信息。每个有新样本的 (message, 函数) 输出一条日志
+        """
+        with self._lock:
+            aggregations = self._aggregations.items()
+        with self._flush_lock:
+            for (message, func_name), aggregation in aggregations:
+                max_time_elapsed = aggregation.max_time_elapsed
+                aggregation.max_time_elapsed = 0.
+                histogram = aggregation.histogram
+                counts = histogram.get_counts()
+                flushed_counts = aggregation.flushed_counts
+                aggregation.flushed_counts = counts
+                if flushed_counts is not None:
+                    counts = [count - flushed_count for count, flushed_count
+                              in zip(counts, flushed_counts)]
+                summary = histogram.summarize(counts, (50, 90, 99))
+                if not summary["count"]:
+                    continue
+                extra = {
+                    "aggregated": True,
+                    "func_name": func_name,
+                    "count": summary["count"],
+                    "mean_time_elapsed": summary["mean"],
+                    "max_time_elapsed": max_time_elapsed,
+                }
+                for p in (50, 90, 99):
+                    extra["p%d_time_elapsed" % p] = summary["p%d" % p]
+                try:
+                    self._log_func(message, extra=extra)
+                except Exception:
+                    LOGGER.exception("fail to log aggregated slow actions")
+
+    def _aggregate_thread_run(self):
+        while True:
+            with self._aggregate_condition:
+                if self._shut_down:
+                    break
+                self._aggregate_condition.wait(self._aggregate_interval)
+                if self._shut_down:
+                    break
+            self.flush()
+        self.flush()
+
+    def shutdown(self):
+        """
+        停止聚合线程，并输出尚未输出的统计信息
+        """
+        with self._aggregate_condition:
+            self._shut_down = True
+            self._aggregate_condition.notify_all()
+        if self._aggregate_interval is not None:
+            self._aggregate_thread.join()
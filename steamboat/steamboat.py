@@ -1,18 +1,239 @@
 # coding: utf8
 
+import logging
+import threading
+import time
 from functools import partial
+from Queue import Queue, Empty
+
+from concurrent.futures import TimeoutError
 
 from .cabin import SubmitTaskError, TimeoutReachedError
-from .window import WindowHalfOpenError, WindowClosedError
+from .window import WindowHalfOpenError, WindowClosedError, WindowStatus
 from .executor import *
+from .clock import monotonic
+from .tracing import TracedTask
+from .thread_pool_executor import ThreadPoolExecutor
+from .reject_policy import AbortPolicy
 
+LOGGER = logging.getLogger(__name__)
 
-class SteamBoat(object):
+_WINDOW_STATUS_NAMES = {
+    WindowStatus.OPEN: "open",
+    WindowStatus.HALF_OPEN: "half_open",
+    WindowStatus.CLOSED: "closed",
+}
+
+
+# 默认的降级 Executor 的线程数与队列长度
+DEFAULT_FALLBACK_THREAD_COUNT = 2
+DEFAULT_FALLBACK_QUEUE_SIZE = 128
+
+
+class BaseError(StandardError):
+    """
+    异常类的基类
+    """
+    pass
+
+
+class QuorumNotReachedError(BaseError):
+    """
+    分散执行时，成功的 Cabin 数量无法达到法定数量
+    """
+    def __init__(self, exceptions, *a):
+        super(self.__class__, self).__init__(*a)
+        self._exceptions = exceptions
+
+    @property
+    def exceptions(self):
+        """
+        Map: cabin name -> exception，被跳过的 Cabin 对应 WindowClosedError
+        """
+        return self._exceptions
+
+
+def as_completed(async_results, timeout=None):
+    """
+    按照完成的顺序返回 async_results 中的 AsyncResult
+
+    @param timeout float、None 等待下一个 AsyncResult 完成的最长时间（秒），
+        超时后会引发 concurrent.futures.TimeoutError
+    """
+    done_queue = Queue()
+    count = 0
+    for async_result in async_results:
+        async_result.add_done_callback(done_queue.put)
+        count = count + 1
+    for _ in xrange(count):
+        try:
+            yield done_queue.get(timeout=timeout)
+        except Empty:
+            raise TimeoutError()
+
+
+class FallbackStats(object):
+    """
+    降级处理的统计信息：
+        在回调线程中直接执行的次数
+        提交给降级 Executor 的次数
+        提交给降级 Executor 失败的次数
+        降级方法执行成功、失败的次数
+        降级方法的累计耗时、最大耗时
+    """
     def __init__(self):
+        self._lock = threading.Lock()
+        self._inline_count = 0
+        self._submitted_count = 0
+        self._rejected_count = 0
+        self._success_count = 0
+        self._failure_count = 0
+        self._total_latency = 0.
+        self._max_latency = 0.
+
+    def record_inline(self):
+        with self._lock:
+            self._inline_count = self._inline_count + 1
+
+    def record_submitted(self):
+        with self._lock:
+            self._submitted_count = self._submitted_count + 1
+
+    def record_rejected(self):
+        with self._lock:
+            self._rejected_count = self._rejected_count + 1
+
+    def record_completion(self, succeeded, latency):
+        with self._lock:
+            if succeeded:
+                self._success_count = self._success_count + 1
+            else:
+                self._failure_count = self._failure_count + 1
+            self._total_latency = self._total_latency + latency
+            if latency > self._max_latency:
+                self._max_latency = latency
+
+    def snapshot(self):
+        with self._lock:
+            completed_count = self._success_count + self._failure_count
+            return {
+                "inline_count": self._inline_count,
+                "submitted_count": self._submitted_count,
+                "rejected_count": self._rejected_count,
+                "success_count": self._success_count,
+                "failure_count": self._failure_count,
+                "average_latency": self._total_latency / completed_count
+                                   if completed_count else 0.,
+                "max_latency": self._max_latency,
+            }
+
+
+class _ScatterGather(object):
+    """
+    分散执行的状态：当 quorum 个 Cabin 执行成功，或者不可能再达到 quorum 时结束，
+    结束时取消尚未完成的任务
+    """
+    def __init__(self, async_result, quorum, candidate_count, exceptions):
+        self._async_result = async_result
+        self._quorum = quorum
+        self._candidate_count = candidate_count
+        self._exceptions = exceptions
+        self._lock = threading.Lock()
+        self._results = []
+        self._replica_async_results = []
+        self._finished = False
+
+    def add_replica(self, cabin, replica_async_result):
+        with self._lock:
+            if self._finished:
+                cabin.cancel(replica_async_result)
+                return
+            self._replica_async_results.append((cabin, replica_async_result))
+        replica_async_result.add_done_callback(
+            partial(self._replica_done_callback, cabin.get_name()))
+
+    def _replica_done_callback(self, cabin_name, replica_async_result):
+        if replica_async_result.cancelled():
+            return
+        exc = replica_async_result.exception()
+        with self._lock:
+            if self._finished:
+                return
+            if exc is None:
+                self._results.append(replica_async_result.result())
+                if len(self._results) < self._quorum:
+                    return
+            else:
+                self._exceptions[cabin_name] = exc
+                if self._candidate_count - len(self._exceptions) >= self._quorum:
+                    return
+            self._finished = True
+            replica_async_results = self._replica_async_results
+            self._replica_async_results = []
+
+        # 通过 Cabin 取消其它尚未完成的任务，使它们立即从 Pending Tasks 中移除；
+        # 正在执行的任务无法被取消
+        for cabin, ar in replica_async_results:
+            if ar is not replica_async_result:
+                cabin.cancel(ar)
+        self._finish(exc is None)
+
+    def _finish(self, succeeded):
+        async_result = self._async_result
+        try:
+            if not async_result.set_running_or_notify_cancel():
+                return
+        except RuntimeError:
+            return
+        async_result.set_time_info("left_steamboat_at")
+        if succeeded:
+            async_result.set_result(self._results)
+        else:
+            async_result.set_exception(QuorumNotReachedError(self._exceptions))
+
+    def cancel(self, async_result):
+        if not async_result.cancelled():
+            return
+        with self._lock:
+            self._finished = True
+            replica_async_results = self._replica_async_results
+            self._replica_async_results = []
+        for cabin, ar in replica_async_results:
+            cabin.cancel(ar)
+
+
+class SteamBoat(object):
+    def __init__(self,
+                 fallback_executor=None,
+                 metrics_registry=None,
+                 tracer=None):
+        """
+        @param fallback_executor Executor、None 用于执行降级方法的 Executor。
+            为 None 时，在第一次需要时创建一个有界的默认 Executor
+            （DEFAULT_FALLBACK_THREAD_COUNT 个线程，
+            长度为 DEFAULT_FALLBACK_QUEUE_SIZE 的队列，队列满时拒绝），
+            降级方法不会被提交回原来的 Cabin（它可能已经饱和或处于熔断状态）
+        @param metrics_registry MetricsRegistry、None 用于记录降级次数
+        @param tracer Tracer、None 用于追踪通过 push_into_cabin、submit_task、
+            push_into_shard、submit_task_by_key 提交的请求
+        """
         self._cabins = {}
         self._degradation_strategies = {}
         self._default_cabin = None
         self._default_degradation_strategy = None
+        self._sharded_cabins = {}
+        self._fallback_executor = fallback_executor
+        # 默认的降级 Executor 由 SteamBoat 创建，也由它关闭
+        self._default_fallback_executor = None
+        self._fallback_executor_lock = threading.Lock()
+        self._fallback_stats = FallbackStats()
+        self._tracer = tracer
+        self._degraded = None
+        if metrics_registry is not None:
+            self._degraded = metrics_registry.counter(
+                "steamboat_degraded_total",
+                "Calls handed to a degradation strategy, by where it ran.",
+                ("cabin", "mode"))
 
     def add_cabin(self, cabin, degradation_strategy=None, ignore_if_exists=False):
         cabin_name = cabin.get_name()
@@ -24,11 +245,66 @@ class SteamBoat(object):
         self._degradation_strategies[cabin_name] = degradation_strategy
         return self
 
+    def get_cabin(self, cabin_name):
+        """
+        返回通过 add_cabin 添加的 Cabin，不存在时返回 None
+        """
+        return self._cabins.get(cabin_name)
+
     def set_default_cabin(self, cabin, degradation_strategy=None):
         self._default_cabin = cabin
         self._default_degradation_strategy = degradation_strategy
         return self
 
+    def set_fallback_executor(self, fallback_executor):
+        self._fallback_executor = fallback_executor
+        return self
+
+    def get_fallback_executor(self):
+        """
+        返回降级 Executor，没有设置时创建默认的降级 Executor
+        """
+        fallback_executor = self._fallback_executor
+        if fallback_executor is not None:
+            return fallback_executor
+        with self._fallback_executor_lock:
+            if self._default_fallback_executor is None:
+                self._default_fallback_executor = ThreadPoolExecutor(
+                    DEFAULT_FALLBACK_THREAD_COUNT,
+                    Queue(DEFAULT_FALLBACK_QUEUE_SIZE),
+                    AbortPolicy(),
+                    thread_pool_name="steamboat-fallback")
+            return self._default_fallback_executor
+
+    def shutdown(self, wait_time=None):
+        """
+        关闭默认的降级 Executor。Cabin 与通过参数设置的降级 Executor 由调用方关闭
+        """
+        with self._fallback_executor_lock:
+            default_fallback_executor = self._default_fallback_executor
+            self._default_fallback_executor = None
+        if default_fallback_executor is not None:
+            default_fallback_executor.shutdown(wait_time)
+
+    def set_tracer(self, tracer):
+        self._tracer = tracer
+        return self
+
+    def get_fallback_stats(self):
+        return self._fallback_stats.snapshot()
+
+    def add_sharded_cabin(self, sharded_cabin, degradation_strategy=None):
+        """
+        添加分片船舱。通过 push_into_shard、submit_task_by_key 提交的请求，
+        会按照 key 被路由到相应的分片；所有分片共用 degradation_strategy
+        """
+        cabin_name = sharded_cabin.get_name()
+        if cabin_name in self._sharded_cabins or cabin_name in self._cabins:
+            raise RuntimeError("cabin %s already exists" % cabin_name)
+        self._sharded_cabins[cabin_name] = sharded_cabin
+        self._degradation_strategies[cabin_name] = degradation_strategy
+        return self
+
     def push_into_cabin(self, cabin_name):
         cabin = self._cabins.get(cabin_name, self._default_cabin)
         if cabin is None:
@@ -36,43 +312,305 @@ class SteamBoat(object):
 
         def _inner(f):
             def _real_logic(*a, **kw):
-                steamboat_async_result = AsyncResult()
-                steamboat_async_result.set_time_info("putted_into_steamboat_at")
-                cabin_async_result = cabin.submit_task(f, *a, **kw)
-                cabin_async_result.add_done_callback(partial(
-                    self._done_callback,
-                    steamboat_async_result,
-                    cabin_name,
-                    f,
-                    a,
-                    kw,
-                    True,
-                    True))
-                return steamboat_async_result
+                return self._dispatch(cabin_name, cabin, f, a, kw)
+            return _real_logic
+        return _inner
+
+    def push_into_shard(self, cabin_name, key_func):
+        """
+        @param key_func callable 使用被装饰函数的参数调用它，得到分片的 key
+        """
+        sharded_cabin = self._sharded_cabins.get(cabin_name)
+        if sharded_cabin is None:
+            raise RuntimeError("sharded cabin %s not exists" % cabin_name)
+
+        def _inner(f):
+            def _real_logic(*a, **kw):
+                cabin = sharded_cabin.get_shard(key_func(*a, **kw))
+                return self._dispatch(cabin_name, cabin, f, a, kw)
             return _real_logic
         return _inner
 
+    def submit_task_by_key(self, cabin_name, key, f, *a, **kw):
+        sharded_cabin = self._sharded_cabins.get(cabin_name)
+        if sharded_cabin is None:
+            raise RuntimeError("sharded cabin %s not exists" % cabin_name)
+        return self._dispatch(
+            cabin_name, sharded_cabin.get_shard(key), f, a, kw)
+
+    def _dispatch(self, cabin_name, cabin, f, a, kw):
+        """
+        @param cabin_name string 用于查找 DegradationStrategy 的名称
+        @param cabin Cabin 实际执行任务的 Cabin
+        """
+        tracer = self._tracer
+        # Tornado 协程函数不能被包装，所以不追踪
+        if tracer is not None and not getattr(f, "__tornado_coroutine__", False):
+            span = tracer.start_span(
+                "steamboat.dispatch", {"cabin": cabin.get_name()})
+            if span is not None:
+                return self._dispatch_traced(span, cabin_name, cabin, f, a, kw)
+
+        if cabin.is_async_result_shared():
+            return self._dispatch_with_shared_result(
+                cabin_name, cabin, f, a, kw)
+        return self._dispatch_with_layered_result(cabin_name, cabin, f, a, kw)
+
+    def _dispatch_with_layered_result(self, cabin_name, cabin, f, a, kw):
+        """
+        SteamBoat、Cabin、Executor 各自使用一个 AsyncResult，通过回调传递结果
+        """
+        steamboat_async_result = AsyncResult(
+            record_time_info=cabin.is_time_info_recorded())
+        steamboat_async_result.set_time_info("putted_into_steamboat_at")
+        cabin_async_result = cabin.submit_task(f, *a, **kw)
+        cabin_async_result.add_done_callback(partial(
+            self._done_callback,
+            steamboat_async_result,
+            cabin_name,
+            cabin,
+            f,
+            a,
+            kw))
+        return steamboat_async_result
+
+    def _dispatch_traced(self, span, cabin_name, cabin, f, a, kw):
+        """
+        使用 TracedTask 包装任务函数，再按照通常的方式提交。
+        降级时，DegradationStrategy 拿到的仍然是原来的任务函数
+        """
+        window_status = cabin.get_window().get_status(time.time())
+        traced_task = TracedTask(
+            span, f, _WINDOW_STATUS_NAMES.get(window_status))
+        traced_task.on_submitting()
+        if cabin.is_async_result_shared():
+            async_result = self._dispatch_with_shared_result(
+                cabin_name, cabin, traced_task, a, kw)
+        else:
+            async_result = self._dispatch_with_layered_result(
+                cabin_name, cabin, traced_task, a, kw)
+        traced_task.on_submitted()
+        async_result.add_done_callback(traced_task.finish)
+        return async_result
+
+    def _dispatch_with_shared_result(self, cabin_name, cabin, f, a, kw):
+        """
+        SteamBoat、Cabin、Executor 共用一个 AsyncResult，
+        降级处理由 continuation 完成
+        """
+        async_result = AsyncResult(record_time_info=cabin.is_time_info_recorded())
+        async_result.set_time_info("putted_into_steamboat_at")
+        async_result.add_continuation(partial(
+            self._continuation, cabin_name, cabin, f, a, kw))
+        return cabin.execute_with_result(async_result, f, *a, **kw)
+
+    def _continuation(self,
+                      cabin_name,
+                      cabin,
+                      f,
+                      a,
+                      kw,
+                      async_result,
+                      result,
+                      exception):
+        async_result.set_time_info("left_steamboat_at")
+        if exception is None:
+            async_result.set_result(result)
+            return
+
+        ds = self._degradation_strategies.get(
+            cabin_name,
+            self._default_degradation_strategy)
+        if ds is None:
+            async_result.set_exception(exception)
+            return
+
+        # 在 Cabin 中被拒绝的任务，其 AsyncResult 仍然处于 PENDING 状态
+        if not async_result.running():
+            try:
+                if not async_result.set_running_or_notify_cancel():
+                    return
+            except RuntimeError:
+                return
+
+        self._degrade(async_result, cabin, ds, exception, f, a, kw)
+
     def submit_task(self, cabin_name, f, *a, **kw):
         return self.push_into_cabin(cabin_name)(f)(*a, **kw)
 
+    def call(self, cabin_name, f, *a, **kw):
+        """
+        同步地在 Cabin 中调用 f，返回它的结果；调用失败时，在当前线程中执行
+        DegradationStrategy 的相应方法，返回降级方法的结果或者抛出它的异常。
+        没有 DegradationStrategy 时，抛出 Cabin.call 的异常。
+        与使用 InlineExecutor 的 Cabin 搭配时，整个调用都不创建 AsyncResult；
+        直接调用不会被追踪
+        """
+        cabin = self._cabins.get(cabin_name, self._default_cabin)
+        if cabin is None:
+            raise RuntimeError("cabin %s not exists" % cabin_name)
+        try:
+            return cabin.call(f, *a, **kw)
+        except Exception as exception:
+            ds = self._degradation_strategies.get(
+                cabin_name,
+                self._default_degradation_strategy)
+            if ds is None:
+                raise
+            method, args = self._get_degradation_method(
+                ds, exception, f, a, kw)
+
+        self._record_degradation(cabin, "inline", None, method)
+        self._fallback_stats.record_inline()
+        start_time = monotonic()
+        try:
+            result = method(*args)
+        except Exception:
+            self._fallback_stats.record_completion(
+                False, monotonic() - start_time)
+            raise
+        self._fallback_stats.record_completion(True, monotonic() - start_time)
+        return result
+
+    def map(self, cabin_name, fn, iterable, max_in_flight=64, timeout=None):
+        """
+        对 iterable 中的每个元素，在 Cabin 中执行 fn(item)，
+        按照完成的顺序返回 (index, async_result)，index 是元素在 iterable 中的位置。
+        降级后的结果同样会被返回。
+        在途的任务数量不会超过 max_in_flight，只有当调用方取走一个结果之后，
+        才会提交下一个任务，所以处理大量数据时占用的内存是恒定的。
+        为了避免任务在突发提交时被 Executor 拒绝，max_in_flight 不应该超过 Executor 队列的容量
+
+        @param timeout float、None 等待下一个任务完成的最长时间（秒），
+            超时后会引发 concurrent.futures.TimeoutError
+        """
+        cabin = self._cabins.get(cabin_name, self._default_cabin)
+        if cabin is None:
+            raise RuntimeError("cabin %s not exists" % cabin_name)
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be positive")
+
+        done_queue = Queue()
+        items = enumerate(iterable)
+        in_flight = 0
+
+        def _submit_next():
+            try:
+                index, item = next(items)
+            except StopIteration:
+                return False
+            async_result = self._dispatch(cabin_name, cabin, fn, (item, ), {})
+            async_result.add_done_callback(
+                lambda ar: done_queue.put((index, ar)))
+            return True
+
+        while in_flight < max_in_flight and _submit_next():
+            in_flight = in_flight + 1
+        while in_flight:
+            try:
+                index, async_result = done_queue.get(timeout=timeout)
+            except Empty:
+                raise TimeoutError()
+            in_flight = in_flight - 1
+            if _submit_next():
+                in_flight = in_flight + 1
+            yield index, async_result
+
+    as_completed = staticmethod(as_completed)
+
+    def scatter_gather(self, cabin_names, f, a=(), kw=None, quorum=1):
+        """
+        将同一个调用分散到多个 Cabin（比如每个 Cabin 隔离一个副本）中执行，
+        当 quorum 个 Cabin 执行成功时结束，结果是按完成顺序排列的 quorum 个返回值；
+        结束时，尚未开始执行的任务会被取消。
+        窗口处于关闭状态（熔断）的 Cabin 会被直接跳过；
+        当执行成功的 Cabin 不可能达到 quorum 时，引发 QuorumNotReachedError。
+        分散执行的任务不会进行降级处理
+        """
+        if quorum < 1:
+            raise ValueError("quorum must be positive")
+        cabins = []
+        for cabin_name in cabin_names:
+            cabin = self._cabins.get(cabin_name)
+            if cabin is None:
+                raise RuntimeError("cabin %s not exists" % cabin_name)
+            cabins.append(cabin)
+        kw = kw or {}
+
+        async_result = AsyncResult()
+        async_result.set_time_info("putted_into_steamboat_at")
+        current_timestamp = time.time()
+        candidates = []
+        exceptions = {}
+        for cabin in cabins:
+            window_status = cabin.get_window().get_status(current_timestamp)
+            if window_status == WindowStatus.CLOSED:
+                exceptions[cabin.get_name()] = WindowClosedError(cabin.get_name())
+            else:
+                candidates.append(cabin)
+
+        scatter_gather = _ScatterGather(
+            async_result, quorum, len(cabins), exceptions)
+        if len(candidates) < quorum:
+            scatter_gather._finish(False)
+            return async_result
+
+        async_result.add_done_callback(scatter_gather.cancel)
+        for cabin in candidates:
+            # 使用共享 AsyncResult 的方式执行，使得取消操作可以传递给 Executor
+            replica_async_result = cabin.execute_with_result(
+                AsyncResult(record_time_info=False), f, *a, **kw)
+            scatter_gather.add_replica(cabin, replica_async_result)
+        return async_result
+
+    def submit_many(self, cabin_name, tasks):
+        """
+        向 Cabin 中批量提交任务
+
+        @param tasks iterable 其中的每个元素都是 (func, args, kwargs) 三元组
+        @return list 与 tasks 一一对应的 AsyncResult 列表
+        """
+        cabin = self._cabins.get(cabin_name, self._default_cabin)
+        if cabin is None:
+            raise RuntimeError("cabin %s not exists" % cabin_name)
+
+        tasks = [(f, a, kw or {}) for f, a, kw in tasks]
+        steamboat_async_results = []
+        for _ in tasks:
+            steamboat_async_result = AsyncResult(
+                record_time_info=cabin.is_time_info_recorded())
+            steamboat_async_result.set_time_info("putted_into_steamboat_at")
+            steamboat_async_results.append(steamboat_async_result)
+
+        cabin_async_results = cabin.submit_many(tasks)
+        for (f, a, kw), steamboat_async_result, cabin_async_result in zip(
+                tasks, steamboat_async_results, cabin_async_results):
+            cabin_async_result.add_done_callback(partial(
+                self._done_callback,
+                steamboat_async_result,
+                cabin_name,
+                cabin,
+                f,
+                a,
+                kw))
+        return steamboat_async_results
+
     def _done_callback(self,
                        steamboat_async_result,
                        cabin_name,
+                       cabin,
                        f,
                        a,
                        kw,
-                       set_running_mask,
-                       execute_degradation,
                        cabin_async_result):
-        if set_running_mask:
-            try:
-                if not steamboat_async_result.set_running_or_notify_cancel():
-                    return
-            except RuntimeError:
+        try:
+            if not steamboat_async_result.set_running_or_notify_cancel():
                 return
+        except RuntimeError:
+            return
 
         steamboat_async_result.set_time_info("left_steamboat_at")
-        steamboat_async_result.update_time_info(cabin_async_result.time_info)
+        steamboat_async_result.merge_time_info(cabin_async_result)
 
         if cabin_async_result.cancelled():
             steamboat_async_result.set_exception(RuntimeError("unreachable"))
@@ -83,10 +621,6 @@ class SteamBoat(object):
             steamboat_async_result.set_result(cabin_async_result.result())
             return
 
-        if not execute_degradation:
-            steamboat_async_result.set_exception(exception)
-            return
-
         ds = self._degradation_strategies.get(
             cabin_name,
             self._default_degradation_strategy)
@@ -94,6 +628,98 @@ class SteamBoat(object):
             steamboat_async_result.set_exception(exception)
             return
 
+        self._degrade(steamboat_async_result, cabin, ds, exception, f, a, kw)
+
+    def _degrade(self, async_result, cabin, ds, exception, f, a, kw):
+        """
+        执行降级方法，并将其结果设置到 async_result 上：
+            被标记为 cheap 的 DegradationStrategy，直接在当前线程中执行；
+            否则，提交给降级 Executor（没有设置时使用默认的降级 Executor）。
+            降级 Executor 拒绝任务或者已经关闭时，保留原来的异常
+        """
+        traced_task = None
+        if isinstance(f, TracedTask):
+            traced_task = f
+            traced_task.on_cabin_exception(exception)
+            f = traced_task.function
+
+        method, args = self._get_degradation_method(ds, exception, f, a, kw)
+        if getattr(ds, "cheap", False):
+            self._record_degradation(cabin, "inline", traced_task, method)
+            self._fallback_stats.record_inline()
+            start_time = monotonic()
+            try:
+                result = method(*args)
+            except Exception as exc:
+                self._fallback_stats.record_completion(
+                    False, monotonic() - start_time)
+                async_result.set_exception(exc)
+            else:
+                self._fallback_stats.record_completion(
+                    True, monotonic() - start_time)
+                async_result.set_result(result)
+            return
+
+        self._record_degradation(
+            cabin, "fallback_executor", traced_task, method)
+        start_time = monotonic()
+        try:
+            fallback_async_result = self.get_fallback_executor().submit_task(
+                method, *args)
+        except Exception as exc:
+            self._reject_fallback(async_result, cabin, exception, exc)
+            return
+        self._fallback_stats.record_submitted()
+        fallback_async_result.add_done_callback(partial(
+            self._fallback_done_callback,
+            async_result,
+            cabin,
+            exception,
+            start_time))
+
+    def _reject_fallback(self, async_result, cabin, exception, exc):
+        """
+        降级 Executor 没有执行降级方法：保留调用方原来的异常
+        """
+        LOGGER.error("fail to submit fallback of cabin %s: %s(%s)",
+                     cabin.get_name(), exc.__class__.__name__, exc)
+        self._fallback_stats.record_rejected()
+        async_result.set_exception(exception)
+
+    def _record_degradation(self, cabin, mode, traced_task, method):
+        if self._degraded is not None:
+            self._degraded.labels(cabin.get_name(), mode).inc()
+        if traced_task is not None:
+            traced_task.on_fallback(mode, method)
+
+    def _fallback_done_callback(self,
+                                async_result,
+                                cabin,
+                                exception,
+                                start_time,
+                                fallback_async_result):
+        latency = monotonic() - start_time
+        if fallback_async_result.cancelled():
+            self._fallback_stats.record_completion(False, latency)
+            async_result.set_exception(RuntimeError("unreachable"))
+            return
+        exc = fallback_async_result.exception()
+        # 已经关闭的 Executor 不抛出异常，而是返回设置了 ShutDownError 的 AsyncResult；
+        # 批量提交或者拒绝策略会设置 RejectedError。两者都表示降级方法没有执行
+        if isinstance(exc, (ShutDownError, RejectedError)):
+            self._reject_fallback(async_result, cabin, exception, exc)
+            return
+        self._fallback_stats.record_completion(exc is None, latency)
+        if exc is None:
+            async_result.set_result(fallback_async_result.result())
+        else:
+            async_result.set_exception(exc)
+
+    @staticmethod
+    def _get_degradation_method(ds, exception, f, a, kw):
+        """
+        根据异常的类型，选择 DegradationStrategy 的相应方法，返回 (method, args)
+        """
         args = f, a, kw
         if isinstance(exception, SubmitTaskError):
             method = ds.on_submit_task_error
@@ -107,19 +733,4 @@ class SteamBoat(object):
         else:
             method = ds.on_exception
             args = (exception, ) + args
-
-        cabin = self._cabins.get(cabin_name, self._default_cabin)
-        if cabin is None:
-            steamboat_async_result.set_exception(RuntimeError("unreachable"))
-            return
-        degradation_async_result = cabin.submit_task(method, *args)
-        degradation_async_result.add_done_callback(partial(
-            self._done_callback,
-            steamboat_async_result,
-            cabin_name,
-            method,
-            args,
-            {},
-            False,
-            False
-        ))
+        return method, args
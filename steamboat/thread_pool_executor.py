@@ -1,14 +1,18 @@
 # coding: utf8
 
 import logging
+import sys
 import uuid
 import threading
-from Queue import Full, Empty
+from Queue import Queue, LifoQueue, PriorityQueue, Full, Empty
 
 from .executor import *
 
 LOGGER = logging.getLogger(__name__)
 
+# 只有这些类型的队列可以绕过 put，直接操作队列的内部状态
+_BATCHED_QUEUE_TYPES = (Queue, LifoQueue, PriorityQueue)
+
 
 class ThreadPoolExecutor(Executor):
     def __init__(
@@ -16,7 +20,8 @@ class ThreadPoolExecutor(Executor):
             core_pool_size,
             queue,
             reject_handler,
-            thread_pool_name=None):
+            thread_pool_name=None,
+            record_time_info=True):
         """
         @param core_pool_size int 核心线程数
         @param queue Queue 提交任务时，会将 TaskItem 放到该队列，
@@ -24,14 +29,18 @@ class ThreadPoolExecutor(Executor):
         @param reject_handler callable 当 queue 满了的时候，
             再向线程池提交任务，就线程池会使用 (queue，task_item) 调用该回调函数
         @param thread_pool_name string、None 线程池的名称，也是核心线程的名字的前缀
+        @param record_time_info bool 是否在 AsyncResult 中记录时间点
         """
         self._core_pool_size = core_pool_size
         self._queue = queue
         self._reject_handler = reject_handler
         self._thread_pool_name = thread_pool_name or "thread-pool-%s" % uuid.uuid1().hex
+        self._record_time_info = record_time_info
 
         self._core_thread_condition = threading.Condition()
         self._core_threads = {} # Map: id -> thread
+        # 每个核心线程只修改自己的标记，1 表示正在执行任务
+        self._busy_flags = [0] * core_pool_size
         self._core_thread_wait_condition = threading.Condition()
 
         self._shutdown_lock = threading.Lock()
@@ -65,6 +74,9 @@ class ThreadPoolExecutor(Executor):
                 with self._core_thread_wait_condition:
                     if self._shutting_down or self._shut_down:
                         break
+                    # 在持有锁的情况下再检查一次队列，避免错过提交任务时的唤醒
+                    if not self._queue.empty():
+                        continue
                     LOGGER.debug("thread %s will enter into waiting pool", thread_name)
                     self._core_thread_wait_condition.wait()
                 LOGGER.debug("thread %s  woken up", thread_name)
@@ -72,20 +84,32 @@ class ThreadPoolExecutor(Executor):
 
             async_result = task_item.async_result
             async_result.set_time_info("consumed_from_queue_at")
+            # 取出可调用对象与参数之后，TaskItem 不再使它们存活；
+            # 已经被取消或者超时的任务，直接丢弃它们
+            function, args, kwargs = task_item.take()
+            task_item = None
             try:
-                if not async_result.set_running_or_notify_cancel():
-                    continue
+                started = async_result.set_running_or_notify_cancel()
             except RuntimeError:
+                started = False
+            if not started:
+                function = args = kwargs = async_result = None
                 continue
             time_info_key = "executed_completion_at"
+            self._busy_flags[core_thread_id] = 1
             try:
-                result = task_item.function(
-                    *task_item.args,
-                    **task_item.kwargs)
+                result = function(*args, **kwargs)
             except BaseException as exc:
+                self._busy_flags[core_thread_id] = 0
                 async_result.set_time_info(time_info_key).set_exception(exc)
+                # traceback 引用着任务的栈帧，不要让它存活到下一个异常
+                exc = None
+                sys.exc_clear()
             else:
+                self._busy_flags[core_thread_id] = 0
                 async_result.set_time_info(time_info_key).set_result(result)
+            # 在等待下一个任务之前，释放这个任务的参数与结果
+            function = args = kwargs = result = async_result = None
 
         LOGGER.info("thread %s is stopped", thread_name)
         with self._core_thread_condition:
@@ -95,8 +119,27 @@ class ThreadPoolExecutor(Executor):
                             self._thread_pool_name)
                 self._core_thread_condition.notify_all()
 
+    def get_queue_size(self):
+        return self._queue.qsize()
+
+    def get_active_worker_count(self):
+        return sum(self._busy_flags)
+
+    def get_worker_thread_idents(self, busy_only=False):
+        with self._core_thread_condition:
+            core_threads = self._core_threads.items()
+        return [core_thread.ident
+                for core_thread_id, core_thread in core_threads
+                if not busy_only or self._busy_flags[core_thread_id]]
+
     def submit_task(self, func, *args, **kwargs):
-        async_result = AsyncResult()
+        return self.submit_task_with_result(
+            AsyncResult(record_time_info=self._record_time_info),
+            func,
+            *args,
+            **kwargs)
+
+    def submit_task_with_result(self, async_result, func, *args, **kwargs):
         if self._shutting_down or self._shut_down:
             async_result.set_exception(ShutDownError(self._thread_pool_name))
             return async_result
@@ -120,6 +163,66 @@ class ThreadPoolExecutor(Executor):
             self._core_thread_wait_condition.notify_all()
         return async_result
 
+    def submit_many(self, tasks):
+        task_items = [
+            TaskItem(func, args, kwargs or {},
+                     AsyncResult(record_time_info=self._record_time_info))
+            for func, args, kwargs in tasks]
+        async_results = [task_item.async_result for task_item in task_items]
+        if self._shutting_down or self._shut_down:
+            for async_result in async_results:
+                async_result.set_exception(ShutDownError(self._thread_pool_name))
+            return async_results
+
+        with self._shutdown_lock:
+            if self._shutting_down or self._shut_down:
+                for async_result in async_results:
+                    async_result.set_exception(
+                        ShutDownError(self._thread_pool_name))
+                return async_results
+            rejected_task_items = self._put_many_nowait(task_items)
+
+        for task_item in rejected_task_items:
+            try:
+                self._reject_handler(self._queue, task_item)
+            except Exception as exc:
+                task_item.async_result.set_exception(RejectedError(exc))
+
+        # 整批任务只唤醒一次工作线程
+        with self._core_thread_wait_condition:
+            self._core_thread_wait_condition.notify_all()
+        return async_results
+
+    def _put_many_nowait(self, task_items):
+        """
+        将 task_items 放入队列，返回因为队列已满而未能放入的 TaskItem 列表。
+        对于标准库中的 Queue、LifoQueue、PriorityQueue，整批任务只获取一次队列的锁；
+        其它队列（包括重写了 put 的子类）逐个调用 put_nowait
+        """
+        queue = self._queue
+        if type(queue) not in _BATCHED_QUEUE_TYPES:
+            rejected_task_items = []
+            for task_item in task_items:
+                try:
+                    queue.put_nowait(task_item)
+                    task_item.async_result.set_time_info("submitted_to_queue_at")
+                except Full:
+                    rejected_task_items.append(task_item)
+            return rejected_task_items
+
+        put_count = 0
+        with queue.mutex:
+            for task_item in task_items:
+                if 0 < queue.maxsize <= queue._qsize():
+                    break
+                queue._put(task_item)
+                task_item.async_result.set_time_info("submitted_to_queue_at")
+                put_count = put_count + 1
+            if put_count:
+                queue.unfinished_tasks = queue.unfinished_tasks + put_count
+                queue.not_empty.notify(put_count)
+        return task_items[put_count:]
+
     def shutdown(self, wait_time=None):
         if self._shutting_down or self._shut_down:
             return
@@ -1,9 +1,13 @@
 # coding: utf8
 
 import logging
+import sys
 import uuid
+import threading
+from collections import deque
 
 import tornado.gen as gen
+from tornado.ioloop import IOLoop
 from tornado.queues import QueueEmpty, QueueFull
 from tornado.locks import Condition
 
@@ -18,7 +22,20 @@ class TornadoCoroutineExecutor(Executor):
             core_pool_size,
             queue,
             reject_handler,
-            coroutine_pool_name=None):
+            coroutine_pool_name=None,
+            io_loop=None,
+            record_time_info=True):
+        """
+        @param core_pool_size int 核心协程数
+        @param queue tornado.queues.Queue 提交任务时，会将 TaskItem 放到该队列，
+            核心协程会从该队列中消费 TaskItem
+        @param reject_handler callable 当 queue 满了的时候，
+            再向协程池提交任务，协程池会使用 (queue，task_item) 调用该回调函数
+        @param coroutine_pool_name string、None 协程池的名称
+        @param io_loop IOLoop、None 核心协程所在的 IOLoop，默认是当前线程的 IOLoop。
+            从其它线程提交的任务，会通过 add_callback 转交给该 IOLoop
+        @param record_time_info bool 是否在 AsyncResult 中记录时间点
+        """
         self._core_pool_size = core_pool_size
         self._queue = queue
         self._reject_handler = reject_handler
@@ -27,8 +44,18 @@ class TornadoCoroutineExecutor(Executor):
         self._core_coroutine_condition = Condition()
         self._core_coroutines = {}
         self._core_coroutine_wait_condition = Condition()
+        # 只在 IOLoop 所在的线程中修改
+        self._active_coroutine_count = 0
         self._shutting_down = False
         self._shut_down = False
+        self._io_loop = io_loop or IOLoop.current()
+        self._record_time_info = record_time_info
+
+        # 其它线程提交的、尚未转交给 IOLoop 的 TaskItem
+        self._cross_thread_task_items = deque()
+        self._cross_thread_lock = threading.Lock()
+        self._drain_scheduled = False
+
         self._initialize_core_coroutines()
 
     def _initialize_core_coroutines(self):
@@ -58,19 +85,32 @@ class TornadoCoroutineExecutor(Executor):
 
             async_result = task_item.async_result
             async_result.set_time_info("consumed_from_queue_at")
+            # 取出可调用对象与参数之后，TaskItem 不再使它们存活；
+            # 已经被取消或者超时的任务，直接丢弃它们
+            function, args, kwargs = task_item.take()
+            task_item = None
             try:
-                if not async_result.set_running_or_notify_cancel():
-                    continue
+                started = async_result.set_running_or_notify_cancel()
             except RuntimeError:
+                started = False
+            if not started:
+                function = args = kwargs = async_result = None
                 continue
             time_info_key = "executed_completion_at"
+            self._active_coroutine_count = self._active_coroutine_count + 1
             try:
-                result = yield task_item.function(
-                    *task_item.args,
-                    **task_item.kwargs)
-                async_result.set_time_info(time_info_key).set_result(result)
+                result = yield function(*args, **kwargs)
             except Exception as ex:
+                self._active_coroutine_count = self._active_coroutine_count - 1
                 async_result.set_time_info(time_info_key).set_exception(ex)
+                # traceback 引用着任务的栈帧，不要让它存活到下一个异常
+                ex = None
+                sys.exc_clear()
+            else:
+                self._active_coroutine_count = self._active_coroutine_count - 1
+                async_result.set_time_info(time_info_key).set_result(result)
+            # 在等待下一个任务之前，释放这个任务的参数与结果
+            function = args = kwargs = result = async_result = None
 
         LOGGER.info("coroutine %s is stopped",
                     coroutine_name)
@@ -80,8 +120,31 @@ class TornadoCoroutineExecutor(Executor):
                         self._coroutine_pool_name)
             self._core_coroutine_condition.notify_all()
 
+    def get_queue_size(self):
+        return self._queue.qsize()
+
+    def get_active_worker_count(self):
+        return self._active_coroutine_count
+
+    def _in_io_loop_thread(self):
+        return IOLoop.current(instance=False) is self._io_loop
+
     def submit_task(self, func, *args, **kwargs):
-        async_result = AsyncResult()
+        """
+        提交任务。在 IOLoop 所在的线程中调用时，直接放入队列；
+        在其它线程中调用时，等价于 submit_task_threadsafe
+        """
+        return self.submit_task_with_result(
+            AsyncResult(record_time_info=self._record_time_info),
+            func,
+            *args,
+            **kwargs)
+
+    def submit_task_with_result(self, async_result, func, *args, **kwargs):
+        if not self._in_io_loop_thread():
+            return self._submit_threadsafe(
+                [(func, args, kwargs, async_result)])[0]
+
         if self._shutting_down or self._shut_down:
             async_result.set_exception(ShutDownError(self._coroutine_pool_name))
             return async_result
@@ -104,6 +167,128 @@ class TornadoCoroutineExecutor(Executor):
         self._core_coroutine_wait_condition.notify()
         return async_result
 
+    def submit_task_threadsafe(self, func, *args, **kwargs):
+        """
+        可以在任意线程中调用的提交方法。任务先被放到缓冲区中，
+        再通过 IOLoop.add_callback 转交给 IOLoop；同一轮事件循环内，
+        来自其它线程的多次提交只会调度一次 add_callback、唤醒一次协程。
+        任务的执行结果通过 AsyncResult（concurrent.futures.Future）返回，
+        调用方可以在自己的线程中等待，不会阻塞 IOLoop
+        """
+        return self._submit_threadsafe([(
+            func,
+            args,
+            kwargs,
+            AsyncResult(record_time_info=self._record_time_info))])[0]
+
+    def _submit_threadsafe(self, tasks):
+        """
+        @param tasks list 其中的每个元素都是 (func, args, kwargs, async_result) 四元组
+        """
+        async_results = []
+        task_items = []
+        for func, args, kwargs, async_result in tasks:
+            async_results.append(async_result)
+            if self._shutting_down or self._shut_down:
+                async_result.set_exception(
+                    ShutDownError(self._coroutine_pool_name))
+                continue
+            if not gen.is_coroutine_function(func):
+                async_result.set_exception(RuntimeError(
+                    "function must be tornado coroutine function"))
+                continue
+            task_items.append(TaskItem(func, args, kwargs or {}, async_result))
+        if not task_items:
+            return async_results
+
+        with self._cross_thread_lock:
+            self._cross_thread_task_items.extend(task_items)
+            need_schedule = not self._drain_scheduled
+            self._drain_scheduled = True
+        if need_schedule:
+            self._io_loop.add_callback(self._drain_cross_thread_task_items)
+        return async_results
+
+    def _drain_cross_thread_task_items(self):
+        """
+        在 IOLoop 所在的线程中执行：将缓冲区中的 TaskItem 一次性放入队列
+        """
+        with self._cross_thread_lock:
+            task_items = self._cross_thread_task_items
+            self._cross_thread_task_items = deque()
+            self._drain_scheduled = False
+
+        if self._shutting_down or self._shut_down:
+            for task_item in task_items:
+                task_item.async_result.set_exception(
+                    ShutDownError(self._coroutine_pool_name))
+            return
+
+        put_count = 0
+        for task_item in task_items:
+            try:
+                self._queue.put_nowait(task_item)
+                task_item.async_result.set_time_info("submitted_to_queue_at")
+                put_count = put_count + 1
+                continue
+            except QueueFull:
+                pass
+            try:
+                self._reject_handler(self._queue, task_item)
+            except Exception as exc:
+                task_item.async_result.set_exception(RejectedError(exc))
+            else:
+                put_count = put_count + 1
+
+        if put_count:
+            self._core_coroutine_wait_condition.notify(put_count)
+
+    def submit_many(self, tasks):
+        if not self._in_io_loop_thread():
+            return self._submit_threadsafe([
+                (func, args, kwargs,
+                 AsyncResult(record_time_info=self._record_time_info))
+                for func, args, kwargs in tasks])
+
+        async_results = []
+        if self._shutting_down or self._shut_down:
+            for _ in tasks:
+                async_result = AsyncResult(record_time_info=self._record_time_info)
+                async_result.set_exception(
+                    ShutDownError(self._coroutine_pool_name))
+                async_results.append(async_result)
+            return async_results
+
+        put_count = 0
+        rejected_task_items = []
+        for func, args, kwargs in tasks:
+            async_result = AsyncResult(record_time_info=self._record_time_info)
+            async_results.append(async_result)
+            if not gen.is_coroutine_function(func):
+                async_result.set_exception(RuntimeError(
+                    "function must be tornado coroutine function"))
+                continue
+            task_item = TaskItem(func, args, kwargs or {}, async_result)
+            try:
+                self._queue.put_nowait(task_item)
+                async_result.set_time_info("submitted_to_queue_at")
+                put_count = put_count + 1
+            except QueueFull:
+                rejected_task_items.append(task_item)
+
+        for task_item in rejected_task_items:
+            try:
+                self._reject_handler(self._queue, task_item)
+            except Exception as exc:
+                task_item.async_result.set_exception(RejectedError(exc))
+            else:
+                put_count = put_count + 1
+
+        # 整批任务只唤醒一次，最多唤醒 put_count 个协程
+        if put_count:
+            self._core_coroutine_wait_condition.notify(put_count)
+        return async_results
+
     @gen.coroutine
     def shutdown(self, wait_time=None):
         if self._shutting_down or self._shut_down:
@@ -124,6 +309,7 @@ class TornadoCoroutineExecutor(Executor):
             else:
                 task_item.async_result.set_exception(
                     ShutDownError(self._coroutine_pool_name))
+        # 尚未转交给 IOLoop 的任务，会在 _drain_cross_thread_task_items 中被置为失败
 
         self._shutting_down = False
         self._shut_down = True
@@ -0,0 +1,361 @@
+# coding: utf8
+
+from abc import ABCMeta, abstractmethod
+from collections import deque
+import itertools
+import logging
+import random
+import threading
+
+from .clock import monotonic, monotonic_to_wall_time
+from .cabin import SubmitTaskError, TimeoutReachedError
+from .window import WindowHalfOpenError, WindowClosedError
+
+LOGGER = logging.getLogger(__name__)
+
+# 当前线程正在执行的 Span
+_context = threading.local()
+# itertools.count 是用 C 实现的，在 GIL 的保护下生成 id 不需要额外加锁
+_next_id = itertools.count(1).next
+
+
+def get_current_span():
+    """
+    返回当前线程中正在执行的 Span，没有时返回 None。
+    在被追踪的任务函数中调用时，返回该任务的 executor.execute Span
+    """
+    return getattr(_context, "span", None)
+
+
+def start_span(name, attributes=None):
+    """
+    在当前 Span 下创建子 Span。当前线程没有 Span（请求未被采样）时返回 None，
+    所以任务函数可以这样记录自己的子步骤：
+        span = start_span("query")
+        ...
+        if span is not None:
+            span.end()
+    """
+    current_span = get_current_span()
+    if current_span is None:
+        return None
+    return current_span.start_child(name, attributes)
+
+
+class use_span(object):
+    """
+    在 with 语句中，把 span 设置为当前线程的 Span
+    """
+    def __init__(self, span):
+        self._span = span
+        self._previous_span = None
+
+    def __enter__(self):
+        self._previous_span = get_current_span()
+        _context.span = self._span
+        return self._span
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _context.span = self._previous_span
+
+
+class Span(object):
+    """
+    一次请求中的一个步骤。时间使用单调时钟，导出时转换为墙上时间
+    """
+    __slots__ = ("_trace", "_span_id", "_parent_id", "_name",
+                 "_start_time", "_end_time", "_attributes")
+
+    def __init__(self, trace, parent_id, name, attributes=None, start_time=None):
+        self._trace = trace
+        self._span_id = _next_id()
+        self._parent_id = parent_id
+        self._name = name
+        self._start_time = monotonic() if start_time is None else start_time
+        self._end_time = None
+        self._attributes = dict(attributes) if attributes else {}
+        trace.add_span(self)
+
+    @property
+    def trace_id(self):
+        return self._trace.trace_id
+
+    @property
+    def span_id(self):
+        return self._span_id
+
+    @property
+    def parent_id(self):
+        return self._parent_id
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def start_time(self):
+        return self._start_time
+
+    @property
+    def end_time(self):
+        return self._end_time
+
+    @property
+    def attributes(self):
+        return self._attributes
+
+    def is_ended(self):
+        return self._end_time is not None
+
+    def set_attribute(self, key, value):
+        self._attributes[key] = value
+        return self
+
+    def record_exception(self, exception):
+        self._attributes["error"] = exception.__class__.__name__
+        self._attributes["error.message"] = str(exception)
+        return self
+
+    def start_child(self, name, attributes=None, start_time=None):
+        return Span(self._trace, self._span_id, name, attributes, start_time)
+
+    def end(self, end_time=None):
+        """
+        结束 Span。根 Span 结束时，整个 Trace 会被交给 Exporter
+        """
+        if self._end_time is not None:
+            return
+        self._end_time = monotonic() if end_time is None else end_time
+        if self._parent_id is None:
+            self._trace.finish()
+
+    def to_dict(self):
+        span = {
+            "trace_id": self.trace_id,
+            "span_id": self._span_id,
+            "parent_id": self._parent_id,
+            "name": self._name,
+            "start_time": monotonic_to_wall_time(self._start_time),
+            "end_time": None,
+            "duration": None,
+            "attributes": dict(self._attributes),
+        }
+        if self._end_time is not None:
+            span["end_time"] = monotonic_to_wall_time(self._end_time)
+            span["duration"] = self._end_time - self._start_time
+        return span
+
+    def __repr__(self):
+        return "<Span %s trace=%d id=%d parent=%s>" % (
+            self._name, self.trace_id, self._span_id, self._parent_id)
+
+
+class _Trace(object):
+    """
+    一次请求的全部 Span
+    """
+    __slots__ = ("trace_id", "_tracer", "_spans", "_finished")
+
+    def __init__(self, tracer):
+        self.trace_id = _next_id()
+        self._tracer = tracer
+        self._spans = []
+        self._finished = False
+
+    def add_span(self, span):
+        # list.append 在 GIL 的保护下是原子的
+        self._spans.append(span)
+
+    def finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        end_time = monotonic()
+        spans = list(self._spans)
+        # 尚未结束的 Span（比如在队列中超时的任务）随根 Span 一起结束
+        for span in spans:
+            if not span.is_ended():
+                span.set_attribute("unfinished", True)
+                span.end(end_time)
+        self._tracer.export(spans)
+
+
+class SpanExporter(object):
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def export(self, spans):
+        """
+        @param spans list 同一个 Trace 的全部 Span，根 Span 结束时被调用一次
+        """
+        pass
+
+    def shutdown(self):
+        pass
+
+
+class RingBufferExporter(SpanExporter):
+    """
+    在内存中保存最近的 capacity 个 Trace
+    """
+    def __init__(self, capacity=1024):
+        self._traces = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        with self._lock:
+            self._traces.append(spans)
+
+    def get_traces(self):
+        """
+        @return list 其中的每个元素是一个 Trace 的 Span 列表（dict 格式），
+            按照 Trace 结束的先后排序
+        """
+        with self._lock:
+            traces = list(self._traces)
+        return [[span.to_dict() for span in spans] for spans in traces]
+
+    def clear(self):
+        with self._lock:
+            self._traces.clear()
+
+
+class Tracer(object):
+    """
+    基于头部采样的追踪器：只在请求开始时决定是否追踪，
+    未被采样的请求只需要一次随机数的开销
+    """
+    def __init__(self, exporter, sample_rate=1.):
+        """
+        @param exporter SpanExporter 接收已经结束的 Trace
+        @param sample_rate float 0 到 1 之间，被追踪的请求的比例
+        """
+        self._exporter = exporter
+        self._sample_rate = sample_rate
+
+    def get_exporter(self):
+        return self._exporter
+
+    def start_span(self, name, attributes=None):
+        """
+        当前线程已经有 Span 时（比如在被追踪的任务中再次提交任务），创建它的子 Span；
+        否则按照采样率决定是否开始一个新的 Trace，不采样时返回 None
+        """
+        current_span = get_current_span()
+        if current_span is not None:
+            return current_span.start_child(name, attributes)
+        sample_rate = self._sample_rate
+        if sample_rate < 1 and random.random() >= sample_rate:
+            return None
+        return Span(_Trace(self), None, name, attributes)
+
+    def export(self, spans):
+        try:
+            self._exporter.export(spans)
+        except Exception:
+            LOGGER.exception("fail to export trace")
+
+
+class TracedTask(object):
+    """
+    SteamBoat 用来包装被追踪的任务函数，它记录以下子 Span：
+        cabin.admission     Cabin 是否放行请求，以及放行时的窗口状态
+        executor.queue_wait 从提交到开始执行
+        executor.execute    执行任务函数。执行期间，它是工作线程的当前 Span，
+                            任务函数可以通过 get_current_span、start_span 记录自己的子步骤
+        cabin.timeout       任务超时
+        steamboat.fallback  执行降级方法
+    """
+    __slots__ = ("span", "function", "_admission_span", "_submitted_at",
+                 "_executed", "_fallback_span", "_exception_recorded")
+
+    def __init__(self, span, function, window_status=None):
+        self.span = span
+        self.function = function
+        self._admission_span = span.start_child(
+            "cabin.admission", {"window_status": window_status})
+        self._submitted_at = None
+        self._executed = False
+        self._fallback_span = None
+        self._exception_recorded = False
+
+    def __call__(self, *a, **kw):
+        start_time = monotonic()
+        self._executed = True
+        if self._submitted_at is not None:
+            self.span.start_child(
+                "executor.queue_wait", start_time=self._submitted_at) \
+                .end(start_time)
+        execute_span = self.span.start_child(
+            "executor.execute", start_time=start_time)
+        try:
+            with use_span(execute_span):
+                return self.function(*a, **kw)
+        except BaseException as exc:
+            execute_span.record_exception(exc)
+            raise
+        finally:
+            execute_span.end()
+
+    def on_submitting(self):
+        """
+        在提交给 Cabin 之前调用
+        """
+        self._submitted_at = monotonic()
+
+    def on_submitted(self):
+        """
+        在 Cabin 做出是否放行的决定之后调用
+        """
+        self._admission_span.end()
+
+    def on_cabin_exception(self, exception):
+        """
+        记录 Cabin 返回的异常：被拒绝时，标记 cabin.admission；超时时，记录 cabin.timeout
+        """
+        if self._exception_recorded:
+            return
+        self._exception_recorded = True
+        if isinstance(exception, (WindowClosedError,
+                                  WindowHalfOpenError,
+                                  SubmitTaskError)):
+            self._admission_span.set_attribute("admitted", False)
+            self._admission_span.set_attribute(
+                "reason", exception.__class__.__name__)
+        elif isinstance(exception, TimeoutReachedError):
+            # 在队列中超时的任务不会被执行
+            if not self._executed and self._submitted_at is not None:
+                self.span.start_child(
+                    "executor.queue_wait",
+                    {"timed_out": True},
+                    self._submitted_at).end()
+            self.span.start_child(
+                "cabin.timeout", {"timeout": exception.timeout}).end()
+        self.span.record_exception(exception)
+
+    def on_fallback(self, mode, method):
+        """
+        开始执行降级方法
+        """
+        self._fallback_span = self.span.start_child(
+            "steamboat.fallback",
+            {"mode": mode, "method": getattr(method, "__name__", None)})
+
+    def finish(self, async_result):
+        """
+        作为 SteamBoat 返回的 AsyncResult 的回调，结束整个 Trace
+        """
+        if "admitted" not in self._admission_span.attributes:
+            self._admission_span.set_attribute("admitted", True)
+        if async_result.cancelled():
+            self.span.set_attribute("cancelled", True)
+        else:
+            exception = async_result.exception()
+            if exception is not None:
+                if self._fallback_span is None:
+                    self.on_cabin_exception(exception)
+                else:
+                    self._fallback_span.record_exception(exception)
+        if self._fallback_span is not None:
+            self._fallback_span.end()
+        self.span.end()
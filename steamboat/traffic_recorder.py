@@ -0,0 +1,378 @@
+# coding: utf8
+
+"""
+Cabin 调用的二进制流量记录
+
+每次调用被记录为一条定长的记录：
+    timestamp       float64 调用进入 Cabin 的时间（墙上时间）
+    cabin_id        uint16  Cabin 的编号，名称保存在记录区之后
+    outcome         uint8   结果，取值见 OUTCOME_NAMES
+    window_status   uint8   记录时的窗口状态（WindowStatus）
+    queue_wait      float32 在 Executor 的队列中等待的时间，没有时是 NaN
+    execution_time  float32 执行任务的时间，没有时是 NaN
+
+热路径上只把一个元组追加到 deque（在 GIL 的保护下是原子的，不需要加锁），
+后台线程周期性地把它们打包写入内存映射的文件。文件写满之后，
+像 logging.handlers.RotatingFileHandler 一样轮转为 path.1、path.2……
+
+文件的布局是：定长的文件头、max_records 条记录、Cabin 的名称。
+名称每行一个 JSON 字符串，注册新的 Cabin 时只追加一行，空间不足时扩大文件，
+所以 Cabin 的数量只受 cabin_id 的取值范围（MAX_CABINS）限制
+
+读取时使用 numpy 的结构化数组，numpy 只在读取时需要
+"""
+
+from collections import deque
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+LOGGER = logging.getLogger(__name__)
+
+# 与 window_simulator 中的取值一致，可以直接用于回放
+SUCCESS = 0
+FAILURE = 1
+TIMEOUT = 2
+REJECTED_CLOSED = 3
+REJECTED_HALF_OPEN = 4
+SUBMIT_ERROR = 5
+OUTCOME_NAMES = ("success", "failure", "timeout",
+                 "rejected_closed", "rejected_half_open", "submit_error")
+
+MAGIC = "SBTR"
+VERSION = 2
+HEADER_SIZE = 4096
+# magic、版本、记录的长度、记录的数量、Cabin 名称的长度、记录的最大数量
+_HEADER = struct.Struct("<4sHHQIQ")
+_COUNT_OFFSET = 8
+_NAMES_LENGTH_OFFSET = 16
+# 为 Cabin 的名称预留的初始空间，不足时成倍扩大
+NAMES_INITIAL_SIZE = 4096
+# cabin_id 是 uint16
+MAX_CABINS = 1 << 16
+_RECORD = struct.Struct("<dHBBff")
+RECORD_SIZE = _RECORD.size
+if np is not None:
+    RECORD_DTYPE = np.dtype([
+        ("timestamp", "<f8"),
+        ("cabin_id", "<u2"),
+        ("outcome", "u1"),
+        ("window_status", "u1"),
+        ("queue_wait", "<f4"),
+        ("execution_time", "<f4"),
+    ])
+
+NAN = float("nan")
+
+
+class BaseError(StandardError):
+    """
+    异常类的基类
+    """
+    pass
+
+
+class InvalidFileError(BaseError):
+    pass
+
+
+class TooManyCabinsError(BaseError):
+    """
+    Cabin 的数量超过了 MAX_CABINS
+    """
+    pass
+
+
+class _MappedFile(object):
+    """
+    预先分配好空间的记录文件
+    """
+    def __init__(self, path, max_records, cabin_names):
+        self._path = path
+        self._max_records = max_records
+        self._count = 0
+        self._names_offset = HEADER_SIZE + max_records * RECORD_SIZE
+        self._names_length = 0
+        self._size = self._names_offset + NAMES_INITIAL_SIZE
+        with open(path, "w+b") as f:
+            f.truncate(self._size)
+            self._mmap = mmap.mmap(f.fileno(), self._size)
+        _HEADER.pack_into(self._mmap, 0, MAGIC, VERSION, RECORD_SIZE,
+                          self._count, self._names_length, max_records)
+        for name in cabin_names:
+            self.add_cabin_name(name)
+
+    def is_full(self):
+        return self._count >= self._max_records
+
+    def add_cabin_name(self, name):
+        """
+        追加一个 Cabin 的名称。先写名称，再更新文件头中的长度，
+        失败时（比如无法扩大文件）文件中的名称保持不变
+        """
+        line = json.dumps(name) + "\n"
+        start = self._names_offset + self._names_length
+        end = start + len(line)
+        if end > self._size:
+            size = max(end, self._names_offset +
+                       2 * (self._size - self._names_offset))
+            self._mmap.resize(size)
+            self._size = size
+        self._mmap[start:end] = line
+        self._names_length = self._names_length + len(line)
+        struct.pack_into("<I", self._mmap, _NAMES_LENGTH_OFFSET,
+                         self._names_length)
+
+    def write(self, records):
+        """
+        写入尽可能多的记录，返回写入的数量。
+        先写记录，再更新文件头中的数量，读取方不会读到写了一半的记录
+        """
+        count = min(len(records), self._max_records - self._count)
+        mapped = self._mmap
+        pack_into = _RECORD.pack_into
+        offset = HEADER_SIZE + self._count * RECORD_SIZE
+        for index in xrange(count):
+            pack_into(mapped, offset, *records[index])
+            offset = offset + RECORD_SIZE
+        self._count = self._count + count
+        struct.pack_into("<Q", mapped, _COUNT_OFFSET, self._count)
+        return count
+
+    def close(self):
+        self._mmap.flush()
+        self._mmap.close()
+
+
+class TrafficRecorder(object):
+    """
+    可以被多个 Cabin 共用。Cabin 不负责关闭它，使用者需要调用 shutdown
+    """
+    def __init__(self,
+                 path,
+                 max_records=1 << 20,
+                 max_files=4,
+                 flush_interval=0.1,
+                 max_pending=1 << 16):
+        """
+        @param path string 文件路径
+        @param max_records int 每个文件最多保存的记录数量
+        @param max_files int 最多保留的文件数量（包括正在写入的文件）
+        @param flush_interval float 后台线程写入文件的间隔（秒）
+        @param max_pending int 尚未写入文件的记录的最大数量，超出时丢弃新的记录并计数
+        """
+        self._path = path
+        self._max_records = max_records
+        self._max_files = max_files
+        self._flush_interval = flush_interval
+        self._max_pending = max_pending
+
+        self._buffer = deque()
+        self._dropped_count = 0
+        self._written_count = 0
+        self._cabin_names = []
+        self._cabin_ids = {}  # Map: name -> cabin_id
+        self._file_lock = threading.Lock()
+        self._file = _MappedFile(path, max_records, self._cabin_names)
+
+        self._shut_down = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._thread_run)
+        self._thread.setName("traffic-recorder")
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def get_path(self):
+        return self._path
+
+    def register_cabin(self, name):
+        """
+        @return int Cabin 的编号，同名的 Cabin 共用一个编号
+        """
+        with self._file_lock:
+            cabin_id = self._cabin_ids.get(name)
+            if cabin_id is not None:
+                return cabin_id
+            cabin_id = len(self._cabin_names)
+            if cabin_id >= MAX_CABINS:
+                raise TooManyCabinsError(name)
+            # 写入文件成功之后才分配编号，失败时可以重试
+            self._file.add_cabin_name(name)
+            self._cabin_names.append(name)
+            self._cabin_ids[name] = cabin_id
+            return cabin_id
+
+    def record(self,
+               timestamp,
+               cabin_id,
+               outcome,
+               window_status,
+               queue_wait=NAN,
+               execution_time=NAN):
+        """
+        追加一条记录。只有一次长度检查和一次 deque.append
+        """
+        if len(self._buffer) >= self._max_pending:
+            self._dropped_count = self._dropped_count + 1
+            return
+        self._buffer.append((timestamp, cabin_id, outcome, window_status,
+                             queue_wait, execution_time))
+
+    def get_dropped_count(self):
+        """
+        因为缓冲区已满而丢弃的记录数量。计数没有加锁，在并发时可能偏小
+        """
+        return self._dropped_count
+
+    def get_written_count(self):
+        return self._written_count
+
+    def _thread_run(self):
+        while True:
+            with self._condition:
+                if self._shut_down:
+                    break
+                self._condition.wait(self._flush_interval)
+                if self._shut_down:
+                    break
+            try:
+                self.flush()
+            except Exception:
+                LOGGER.exception("fail to write traffic records to %s",
+                                 self._path)
+
+    def flush(self):
+        """
+        把缓冲区中的记录写入文件
+        """
+        buffer_ = self._buffer
+        popleft = buffer_.popleft
+        records = []
+        try:
+            for _ in xrange(len(buffer_)):
+                records.append(popleft())
+        except IndexError:
+            pass
+        if not records:
+            return
+        with self._file_lock:
+            while records:
+                count = self._file.write(records)
+                self._written_count = self._written_count + count
+                records = records[count:]
+                if self._file.is_full():
+                    self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        for index in range(self._max_files - 1, 0, -1):
+            source = self._path if index == 1 else "%s.%d" % (self._path, index - 1)
+            if os.path.exists(source):
+                os.rename(source, "%s.%d" % (self._path, index))
+        if self._max_files <= 1:
+            os.remove(self._path)
+        self._file = _MappedFile(self._path, self._max_records, self._cabin_names)
+
+    def shutdown(self):
+        """
+        停止后台线程，写入剩余的记录，并关闭文件
+        """
+        with self._condition:
+            if self._shut_down:
+                return
+            self._shut_down = True
+            self._condition.notify_all()
+        self._thread.join()
+        self.flush()
+        with self._file_lock:
+            self._file.close()
+
+
+def _check_numpy():
+    if np is None:
+        raise ImportError("numpy is required to read traffic records")
+
+
+def read_header(path):
+    """
+    @return (record_count, cabin_names)
+    """
+    with open(path, "rb") as f:
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise InvalidFileError(path)
+        magic, version, record_size, count, names_length, max_records = \
+            _HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION or record_size != RECORD_SIZE:
+            raise InvalidFileError(path)
+        f.seek(HEADER_SIZE + max_records * RECORD_SIZE)
+        names = f.read(names_length)
+    if len(names) < names_length:
+        raise InvalidFileError(path)
+    return count, [json.loads(line) for line in names.splitlines()]
+
+
+def read_records(path):
+    """
+    读取一个文件中已经写入的记录
+
+    @return numpy.ndarray dtype 是 RECORD_DTYPE
+    """
+    _check_numpy()
+    count, _ = read_header(path)
+    with open(path, "rb") as f:
+        f.seek(HEADER_SIZE)
+        return np.fromfile(f, dtype=RECORD_DTYPE, count=count)
+
+
+def list_files(path):
+    """
+    按照从旧到新的顺序返回存在的记录文件
+    """
+    paths = []
+    index = 1
+    while os.path.exists("%s.%d" % (path, index)):
+        paths.append("%s.%d" % (path, index))
+        index = index + 1
+    paths.reverse()
+    if os.path.exists(path):
+        paths.append(path)
+    return paths
+
+
+def read_all(path):
+    """
+    按照从旧到新的顺序读取全部文件
+
+    @return (records, cabin_names)
+    """
+    _check_numpy()
+    paths = list_files(path)
+    if not paths:
+        return np.zeros(0, dtype=RECORD_DTYPE), []
+    _, cabin_names = read_header(paths[-1])
+    records = np.concatenate([read_records(p) for p in paths])
+    return records, cabin_names
+
+
+def to_trace(records, timeout):
+    """
+    把已经完成的调用转换为 window_simulator.simulate 的输入。
+    超时的调用的耗时是 timeout，其余调用的耗时是排队与执行的时间之和
+
+    @return (timestamps, outcomes, durations)
+    """
+    _check_numpy()
+    records = records[records["outcome"] <= TIMEOUT]
+    durations = np.nan_to_num(records["queue_wait"].astype(np.float64)) + \
+        np.nan_to_num(records["execution_time"].astype(np.float64))
+    durations[records["outcome"] == TIMEOUT] = timeout
+    return records["timestamp"], records["outcome"], durations
@@ -49,8 +49,6 @@ class Window(object):
                  half_failure_count_threshold,
                  recovery_ratio_threshold,
                  recovery_count_threshold):
-        self._start_position = start_position
-        self._status = status
         self._open_length = open_length
         self._closed_length = closed_length
         self._half_open_length = half_open_length
@@ -61,6 +59,11 @@ class Window(object):
         self._recovery_count_threshold = recovery_count_threshold
 
         self._lock = threading.RLock()
+        self._initialize_state(start_position, status)
+
+    def _initialize_state(self, start_position, status):
+        self._start_position = start_position
+        self._status = status
         self._initialize_statistics()
 
     def _initialize_statistics(self):
@@ -156,6 +159,19 @@ class Window(object):
                     self._enter_into_open_status(position)
                     return
 
+    def trip(self, position):
+        """
+        强制窗口进入关闭状态，比如根据其它节点的统计信息判断后端已经故障
+
+        @return bool 窗口是否由此进入关闭状态
+        """
+        with self._lock:
+            status = self._fetch(position)
+            if status is None or status == WindowStatus.CLOSED:
+                return False
+            self._enter_into_close_status(position)
+            return True
+
     def _enter_into_close_status(self, position):
         self._start_position = position
         self._status = WindowStatus.CLOSED
@@ -171,6 +187,22 @@ class Window(object):
         self._status = WindowStatus.HALF_OPEN
         self._initialize_statistics()
 
+    def close(self):
+        """
+        释放窗口占用的资源（比如共享内存），由 Cabin.shutdown 调用。
+        进程内的窗口没有需要释放的资源
+        """
+        pass
+
+    def get_start_position(self):
+        return self._start_position
+
+    def get_failure_ratio_threshold(self):
+        return self._failure_ratio_threshold
+
+    def get_failure_count_threshold(self):
+        return self._failure_count_threshold
+
     def get_success_count(self):
         return self._success_count
 
@@ -0,0 +1,391 @@
+# coding: utf8
+
+"""
+离线的熔断模拟器：用记录下来的调用（时间戳、结果、耗时）回放 Window，
+一次评估成千上万组窗口参数，用来选择阈值。
+
+回放的语义与 Cabin 一致：
+    请求到达时调用 Window.get_status，窗口关闭时拒绝请求，
+    半开时以 half_open_probability 的概率放行；
+    被放行的请求在 时间戳 + 耗时 完成，并调用 Window.update_status 更新统计信息；
+    被拒绝的请求不会到达后端，也不会更新窗口。
+回放假设后端的表现与熔断无关，即被拒绝的请求如果被放行，结果与记录中的一致。
+超时的请求，耗时应该记录为 Cabin 的超时时间（检查线程在 deadline 更新窗口）。
+
+所有参数组合共享同一个事件序列，每个事件只在 Python 中循环一次，
+各个参数组合的窗口状态保存在 numpy 数组中，通过向量运算同时更新
+"""
+
+import itertools
+
+import numpy as np
+
+from .window import Window, WindowStatus
+
+__all__ = ["SUCCESS", "FAILURE", "TIMEOUT", "PARAMETERS",
+           "parameter_grid", "simulate", "simulate_scalar"]
+
+# 调用的结果
+SUCCESS = 0
+FAILURE = 1
+TIMEOUT = 2
+
+# 窗口参数，与 CabinBuilder 的 with_* 方法一一对应
+PARAMETERS = (
+    "open_length",
+    "closed_length",
+    "half_open_length",
+    "failure_ratio_threshold",
+    "failure_count_threshold",
+    "half_failure_count_threshold",
+    "recovery_ratio_threshold",
+    "recovery_count_threshold",
+    "half_open_probability",
+)
+
+
+class BaseError(StandardError):
+    """
+    异常类的基类
+    """
+    pass
+
+
+class InvalidTraceError(BaseError):
+    pass
+
+
+def parameter_grid(**values):
+    """
+    生成参数取值的笛卡尔积
+
+        parameter_grid(closed_length=[1, 2], failure_ratio_threshold=[0.3, 0.5])
+
+    @return dict 参数名称 -> 列表，列表的第 i 个元素是第 i 组参数的取值
+    """
+    keys = sorted(values)
+    combinations = list(itertools.product(*[values[key] for key in keys]))
+    return dict((key, [combination[index] for combination in combinations])
+                for index, key in enumerate(keys))
+
+
+def _to_array(values, size, none_value):
+    if np.isscalar(values) or values is None:
+        values = [values] * size
+    if len(values) != size:
+        raise ValueError("parameters have different lengths")
+    return np.array([none_value if value is None else value
+                     for value in values], dtype=np.float64)
+
+
+def _normalize_parameters(params):
+    """
+    把参数转换为等长的 float64 数组。取值为 None 的阈值转换为与 Window 等价的数值：
+    次数阈值为 None 等价于 0（总是满足），恢复比例阈值为 None 等价于无穷大（永不满足）
+    """
+    missing = [name for name in PARAMETERS if name not in params]
+    if missing:
+        raise ValueError("missing parameters %s" % ", ".join(missing))
+    sizes = [len(params[name]) for name in PARAMETERS
+             if not np.isscalar(params[name]) and params[name] is not None]
+    size = max(sizes) if sizes else 1
+    normalized = {}
+    for name in PARAMETERS:
+        if name == "recovery_ratio_threshold":
+            none_value = np.inf
+        elif name.endswith("count_threshold"):
+            none_value = 0
+        else:
+            none_value = None
+        normalized[name] = _to_array(params[name], size, none_value)
+    return size, normalized
+
+
+def _build_events(timestamps, outcomes, durations):
+    """
+    把请求的到达与完成合并为一个按时间排序的事件序列。
+    时间相同时，保持“先到达、后完成”以及记录中的先后顺序
+
+    @return (events, times) events 中小于 N 的元素 i 表示第 i 个请求到达，
+        其余的元素 N + i 表示第 i 个请求完成
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    outcomes = np.asarray(outcomes)
+    durations = np.asarray(durations, dtype=np.float64)
+    if not (timestamps.shape == outcomes.shape == durations.shape) or \
+            timestamps.ndim != 1:
+        raise InvalidTraceError("timestamps, outcomes and durations "
+                                "must be 1-D arrays of the same length")
+    if np.any(durations < 0):
+        raise InvalidTraceError("negative duration")
+    times = np.concatenate([timestamps, timestamps + durations])
+    events = np.argsort(times, kind="mergesort")
+    return events, times
+
+
+def _draw_uniforms(size, uniforms, seed):
+    if uniforms is None:
+        return np.random.RandomState(seed).random_sample(size)
+    uniforms = np.asarray(uniforms, dtype=np.float64)
+    if uniforms.shape != (size, ):
+        raise InvalidTraceError("uniforms must have one value per request")
+    return uniforms
+
+
+def _summarize(outcomes, rejected_success_count, rejected_failure_count,
+               admitted_count, trip_count):
+    failure_total = int(np.count_nonzero(np.asarray(outcomes) != SUCCESS))
+    rejected_count = rejected_success_count + rejected_failure_count
+    return {
+        "admitted_count": admitted_count,
+        "rejected_count": rejected_count,
+        "rejected_success_count": rejected_success_count,
+        "rejected_failure_count": rejected_failure_count,
+        "trip_count": trip_count,
+        # 被熔断挡住的失败请求占全部失败请求的比例
+        "protection_coverage":
+            rejected_failure_count / float(max(failure_total, 1)),
+    }
+
+
+class _VectorizedWindows(object):
+    """
+    K 个 Window 的状态，与 Window._fetch、update_status 的逻辑逐行对应
+    """
+    def __init__(self, size, params):
+        self.status = np.full(size, WindowStatus.OPEN, dtype=np.int8)
+        # 与 Cabin 一致，窗口的起始位置是 0
+        self.start_position = np.zeros(size, dtype=np.float64)
+        self.success_count = np.zeros(size, dtype=np.int64)
+        self.failure_count = np.zeros(size, dtype=np.int64)
+        self.timeout_count = np.zeros(size, dtype=np.int64)
+        self.trip_count = np.zeros(size, dtype=np.int64)
+
+        self._open_length = params["open_length"]
+        self._closed_length = params["closed_length"]
+        self._half_open_length = params["half_open_length"]
+        self._failure_ratio_threshold = params["failure_ratio_threshold"]
+        self._failure_count_threshold = params["failure_count_threshold"]
+        self._half_failure_count_threshold = \
+            params["half_failure_count_threshold"]
+        self._recovery_ratio_threshold = params["recovery_ratio_threshold"]
+        self._recovery_count_threshold = params["recovery_count_threshold"]
+
+    def _reset(self, mask, status, position):
+        self.status[mask] = status
+        self.start_position[mask] = position
+        self.success_count[mask] = 0
+        self.failure_count[mask] = 0
+        self.timeout_count[mask] = 0
+
+    def fetch(self, position, mask=None):
+        """
+        对 mask 选中的窗口执行 Window._fetch(position)。
+        事件按时间排序，所以不会出现位置在窗口左侧的情况
+        """
+        status = self.status
+        end_position = self.start_position + np.where(
+            status == WindowStatus.OPEN,
+            self._open_length,
+            np.where(status == WindowStatus.CLOSED,
+                     self._closed_length,
+                     self._half_open_length))
+        expired = position >= end_position
+        if mask is not None:
+            expired &= mask
+        if not expired.any():
+            return
+        # 关闭的窗口先在关闭期结束的位置进入半开状态，然后再次检查
+        closed = expired & (status == WindowStatus.CLOSED)
+        if closed.any():
+            self._reset(closed, WindowStatus.HALF_OPEN, end_position[closed])
+            half_open_expired = closed & (
+                position >= self.start_position + self._half_open_length)
+            expired = (expired & ~closed) | half_open_expired
+        # 半开或打开的窗口直接右移
+        self._reset(expired, WindowStatus.OPEN, position)
+
+    def update(self, position, mask, outcome):
+        """
+        对 mask 选中的窗口执行 Window.update_status(position, ...)，
+        outcome 决定增加成功、失败还是超时的次数
+        """
+        self.fetch(position, mask)
+        active = mask & (self.status != WindowStatus.CLOSED)
+        if not active.any():
+            return
+
+        if outcome == SUCCESS:
+            self.success_count += active
+        elif outcome == FAILURE:
+            self.failure_count += active
+        else:
+            self.timeout_count += active
+
+        success_count = self.success_count
+        failure_count = self.failure_count
+        no_failure = failure_count == 0
+        total_count = np.maximum(
+            success_count + failure_count + self.timeout_count, 1) \
+            .astype(np.float64)
+        failure_ratio = np.where(no_failure, 0., failure_count / total_count)
+        success_ratio = np.where(no_failure, 1., success_count / total_count)
+
+        status = self.status
+        is_open = active & (status == WindowStatus.OPEN)
+        is_half_open = active & (status == WindowStatus.HALF_OPEN)
+        failure_ratio_reached = \
+            failure_ratio >= self._failure_ratio_threshold
+        close = failure_ratio_reached & (
+            (is_open &
+             (failure_count >= self._failure_count_threshold)) |
+            (is_half_open &
+             (failure_count >= self._half_failure_count_threshold)))
+        recover = is_half_open & ~close & \
+            ~(success_ratio < self._recovery_ratio_threshold) & \
+            (success_count >= self._recovery_count_threshold)
+
+        if close.any():
+            self.trip_count += close
+            self._reset(close, WindowStatus.CLOSED, position)
+        if recover.any():
+            self._reset(recover, WindowStatus.OPEN, position)
+
+
+def simulate(timestamps, outcomes, durations, params,
+             uniforms=None, seed=None):
+    """
+    用同一份调用记录回放多组窗口参数
+
+    @param timestamps array 请求到达的时间戳
+    @param outcomes array SUCCESS、FAILURE 或 TIMEOUT
+    @param durations array 请求的耗时
+    @param params dict 参数名称（PARAMETERS）-> 标量或长度为 K 的序列，
+        可以使用 parameter_grid 生成
+    @param uniforms array 每个请求一个 [0, 1) 之间的随机数，
+        决定半开状态下是否放行，所有参数组合共用；默认使用 seed 生成
+    @return dict 统计信息 -> 长度为 K 的数组：
+        admitted_count          被放行的请求数量
+        rejected_count          被拒绝的请求数量
+        rejected_success_count  被拒绝、但记录中成功的请求数量
+        rejected_failure_count  被拒绝、且记录中失败或超时的请求数量
+        trip_count              窗口进入关闭状态的次数
+        protection_coverage     被拒绝的失败请求占全部失败请求的比例
+    """
+    size, normalized = _normalize_parameters(params)
+    events, times = _build_events(timestamps, outcomes, durations)
+    outcomes = np.asarray(outcomes)
+    request_count = len(outcomes)
+    uniforms = _draw_uniforms(request_count, uniforms, seed)
+
+    half_open_probability = normalized["half_open_probability"]
+    always_reject = half_open_probability == 0
+    sometimes_reject = half_open_probability < 1
+
+    windows = _VectorizedWindows(size, normalized)
+    rejected_success_count = np.zeros(size, dtype=np.int64)
+    rejected_failure_count = np.zeros(size, dtype=np.int64)
+    # 尚未完成的请求 -> 放行了它的参数组合
+    in_flight = {}
+
+    outcome_list = outcomes.tolist()
+    time_list = times.tolist()
+    uniform_list = uniforms.tolist()
+    for event in events.tolist():
+        position = time_list[event]
+        if event < request_count:
+            windows.fetch(position)
+            status = windows.status
+            rejected = (status == WindowStatus.CLOSED) | (
+                (status == WindowStatus.HALF_OPEN) &
+                (always_reject |
+                 (sometimes_reject &
+                  (uniform_list[event] > half_open_probability))))
+            if outcome_list[event] == SUCCESS:
+                rejected_success_count += rejected
+            else:
+                rejected_failure_count += rejected
+            if not rejected.all():
+                in_flight[event] = ~rejected
+        else:
+            index = event - request_count
+            admitted = in_flight.pop(index, None)
+            if admitted is not None:
+                windows.update(position, admitted, outcome_list[index])
+
+    admitted_count = request_count - rejected_success_count - \
+        rejected_failure_count
+    return _summarize(outcomes, rejected_success_count, rejected_failure_count,
+                      admitted_count, windows.trip_count)
+
+
+def simulate_scalar(timestamps, outcomes, durations, params,
+                    uniforms=None, seed=None):
+    """
+    使用 Window 回放一组参数，作为 simulate 的参考实现
+
+    @param params dict 参数名称（PARAMETERS）-> 标量
+    @return dict 与 simulate 相同的统计信息，取值为标量
+    """
+    events, times = _build_events(timestamps, outcomes, durations)
+    outcomes = np.asarray(outcomes)
+    request_count = len(outcomes)
+    uniforms = _draw_uniforms(request_count, uniforms, seed)
+
+    window = Window(
+        0,
+        WindowStatus.OPEN,
+        params["open_length"],
+        params["closed_length"],
+        params["half_open_length"],
+        params["failure_ratio_threshold"],
+        params["failure_count_threshold"],
+        params["half_failure_count_threshold"],
+        params["recovery_ratio_threshold"],
+        params["recovery_count_threshold"])
+    half_open_probability = params["half_open_probability"]
+    rejected_success_count = 0
+    rejected_failure_count = 0
+    trip_count = 0
+    in_flight = set()
+
+    outcome_list = outcomes.tolist()
+    time_list = times.tolist()
+    uniform_list = uniforms.tolist()
+    for event in events.tolist():
+        position = time_list[event]
+        if event < request_count:
+            # 与 Cabin._get_rejection 相同
+            status = window.get_status(position)
+            rejected = status == WindowStatus.CLOSED or (
+                status == WindowStatus.HALF_OPEN and (
+                    half_open_probability == 0 or (
+                        half_open_probability != 1 and
+                        uniform_list[event] > half_open_probability)))
+            if not rejected:
+                in_flight.add(event)
+            elif outcome_list[event] == SUCCESS:
+                rejected_success_count = rejected_success_count + 1
+            else:
+                rejected_failure_count = rejected_failure_count + 1
+        else:
+            index = event - request_count
+            if index not in in_flight:
+                continue
+            in_flight.remove(index)
+            outcome = outcome_list[index]
+            # 在同一个位置重复 _fetch 不会改变窗口
+            status = window.get_status(position)
+            window.update_status(position,
+                                 int(outcome == SUCCESS),
+                                 int(outcome == FAILURE),
+                                 int(outcome == TIMEOUT),
+                                 0)
+            if status != WindowStatus.CLOSED and \
+                    window.get_status(position) == WindowStatus.CLOSED:
+                trip_count = trip_count + 1
+
+    admitted_count = request_count - rejected_success_count - \
+        rejected_failure_count
+    return _summarize(outcomes, rejected_success_count, rejected_failure_count,
+                      admitted_count, trip_count)
@@ -0,0 +1,79 @@
+import logging
+import time
+from unittest import TestCase, main
+from Queue import Queue, Full
+
+from steamboat.adaptive_timeout import AdaptiveTimeout
+from steamboat.cabin import CabinBuilder, TimeoutReachedError
+from steamboat.metrics import MetricsRegistry
+from steamboat.thread_pool_executor import ThreadPoolExecutor
+
+LOGGER = logging.getLogger(__name__)
+
+
+class AdaptiveTimeoutTest(TestCase):
+    def testQuantileAndClamp(self):
+        adaptive_timeout = AdaptiveTimeout(
+            0.05, 1, percentile=90, multiplier=2,
+            window_size=100, min_samples=50, update_every=10)
+        for _ in range(40):
+            adaptive_timeout.observe(0.1)
+        self.assertIsNone(adaptive_timeout.get_timeout())
+        for index in range(100):
+            adaptive_timeout.observe((index + 1) / 1000.)
+        # only the latest 100 samples are kept: 0.001 ... 0.1
+        self.assertAlmostEqual(adaptive_timeout.get_quantile(), 0.09)
+        self.assertAlmostEqual(adaptive_timeout.get_timeout(), 0.18)
+
+        for _ in range(100):
+            adaptive_timeout.observe(5)
+        self.assertEqual(adaptive_timeout.get_timeout(), 1)
+        for _ in range(100):
+            adaptive_timeout.observe(0.001)
+        self.assertEqual(adaptive_timeout.get_timeout(), 0.05)
+
+    def testCabin(self):
+        def reject_handler(queue, task_item):
+            raise Full
+
+        registry = MetricsRegistry()
+        executor = ThreadPoolExecutor(1, Queue(100), reject_handler)
+        cabin = CabinBuilder() \
+            .with_name("cabin") \
+            .with_executor(executor) \
+            .with_timeout(2) \
+            .with_open_length(10) \
+            .with_closed_length(2) \
+            .with_half_open_length(3) \
+            .with_failure_ratio_threshold(0.8) \
+            .with_failure_count_threshold(50) \
+            .with_half_failure_count_threshold(2) \
+            .with_adaptive_timeout(0.05, 1, multiplier=2,
+                                   min_samples=20, update_every=1) \
+            .with_metrics_registry(registry) \
+            .build()
+        try:
+            self.assertEqual(cabin.get_timeout(), 2)
+            for _ in range(30):
+                cabin.execute(time.sleep, 0.01).result()
+            time.sleep(0.05)
+            timeout = cabin.get_timeout()
+            LOGGER.info("adaptive timeout %s", timeout)
+            self.assertGreaterEqual(timeout, 0.05)
+            self.assertLess(timeout, 0.5)
+            self.assertIn("steamboat_cabin_timeout_seconds{cabin=\"cabin\"} %r"
+                          % timeout, registry.expose())
+
+            # the single worker is busy, so the second call times out
+            # in the queue after the adaptive timeout
+            cabin.execute(time.sleep, 0.5)
+            exception = cabin.execute(time.sleep, 0).exception()
+            self.assertIsInstance(exception, TimeoutReachedError)
+            self.assertEqual(exception.timeout, timeout)
+        finally:
+            cabin.shutdown()
+            executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
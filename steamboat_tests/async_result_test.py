@@ -0,0 +1,127 @@
+import gc
+import logging
+import time
+from unittest import TestCase, main
+from Queue import Queue, Full
+
+from steamboat import clock
+from steamboat.cabin import CabinBuilder
+from steamboat.executor import AsyncResult, TIME_INFO_KEYS
+from steamboat.steamboat import SteamBoat
+from steamboat.thread_pool_executor import ThreadPoolExecutor
+
+LOGGER = logging.getLogger(__name__)
+
+
+def has_instance_dict(obj):
+    # reading obj.__dict__ would allocate it, so look at the gc referents
+    return any(referent is not None and type(referent) is dict
+               for referent in gc.get_referents(obj))
+
+
+class AsyncResultTest(TestCase):
+    def testNoInstanceDictUntilUsed(self):
+        async_result = AsyncResult(deadline=1)
+        async_result.set_time_info("putted_into_cabin_at")
+        async_result.timeout = 2
+        async_result.set_result(3)
+        self.assertFalse(has_instance_dict(async_result))
+
+        # Future has no __slots__, so arbitrary attributes still work
+        async_result.extra = 4
+        self.assertTrue(has_instance_dict(async_result))
+
+    def testClockIsMonotonic(self):
+        # python 2 has no time.monotonic, setup.py depends on the package
+        self.assertTrue(clock.is_monotonic())
+        self.assertIsNot(clock.monotonic, time.time)
+
+    def testSetTimeInfoTakesWallClockTime(self):
+        async_result = AsyncResult()
+        now = time.time()
+        async_result.set_time_info("putted_into_cabin_at", now - 5)
+        async_result.set_time_info("custom_at", now - 3)
+        async_result.set_time_info("left_cabin_at")
+        time_info = async_result.time_info
+        self.assertAlmostEqual(time_info["putted_into_cabin_at"], now - 5, 3)
+        self.assertAlmostEqual(time_info["custom_at"], now - 3, 3)
+        self.assertAlmostEqual(time_info["left_cabin_at"], now, 1)
+        # get_timestamp returns monotonic values, so intervals are exact
+        self.assertAlmostEqual(
+            async_result.get_timestamp("custom_at") -
+            async_result.get_timestamp("putted_into_cabin_at"), 2, 3)
+        self.assertIsNone(async_result.get_timestamp("consumed_from_queue_at"))
+
+        copy = AsyncResult().update_time_info(time_info)
+        self.assertEqual(set(copy.time_info), set(time_info))
+        for key, timestamp in time_info.iteritems():
+            self.assertAlmostEqual(copy.time_info[key], timestamp, 3)
+
+    def testMergeTimeInfo(self):
+        source = AsyncResult()
+        source.set_time_info("submitted_to_queue_at", 100)
+        source.set_time_info("custom_at", 101)
+        target = AsyncResult()
+        target.set_time_info("putted_into_cabin_at", 99)
+        target.set_time_info("submitted_to_queue_at", 50)
+        target.merge_time_info(source)
+        self.assertEqual(
+            set(target.time_info),
+            set(["putted_into_cabin_at", "submitted_to_queue_at",
+                 "custom_at"]))
+        self.assertAlmostEqual(
+            target.time_info["submitted_to_queue_at"], 100, 3)
+        self.assertAlmostEqual(target.time_info["putted_into_cabin_at"], 99, 3)
+
+        # merging into an empty result copies the fixed slots
+        empty = AsyncResult().merge_time_info(source)
+        self.assertAlmostEqual(empty.time_info["custom_at"], 101, 3)
+        empty.set_time_info("left_cabin_at")
+        self.assertNotIn("left_cabin_at", source.time_info)
+
+    def testRecordTimeInfoDisabled(self):
+        async_result = AsyncResult(record_time_info=False)
+        async_result.set_time_info("putted_into_cabin_at")
+        async_result.update_time_info({"custom_at": 1})
+        async_result.merge_time_info(
+            AsyncResult().set_time_info("left_cabin_at"))
+        self.assertFalse(async_result.time_info_recorded)
+        self.assertEqual(async_result.time_info, {})
+        self.assertIsNone(async_result.get_timestamp("putted_into_cabin_at"))
+
+    def testCabinWithoutTimeInfo(self):
+        def reject_handler(queue, task_item):
+            raise Full
+
+        for record_time_info in (True, False):
+            executor = ThreadPoolExecutor(
+                1, Queue(), reject_handler,
+                record_time_info=record_time_info)
+            cabin = CabinBuilder() \
+                .with_name("cabin") \
+                .with_executor(executor) \
+                .with_timeout(1) \
+                .with_open_length(10) \
+                .with_closed_length(2) \
+                .with_half_open_length(3) \
+                .with_failure_ratio_threshold(0.5) \
+                .with_failure_count_threshold(3) \
+                .with_half_failure_count_threshold(2) \
+                .with_record_time_info(record_time_info) \
+                .build()
+            try:
+                steamboat = SteamBoat().add_cabin(cabin)
+                async_result = steamboat.submit_task("cabin", lambda: 1)
+                self.assertEqual(async_result.result(1), 1)
+                if record_time_info:
+                    self.assertEqual(set(async_result.time_info),
+                                     set(TIME_INFO_KEYS))
+                else:
+                    self.assertEqual(async_result.time_info, {})
+            finally:
+                cabin.shutdown()
+                executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
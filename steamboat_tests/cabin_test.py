@@ -1,11 +1,15 @@
+import gc
 import logging
 import datetime
+import threading
 import time
+import weakref
 from unittest import TestCase, main
 from Queue import Queue, Full
 
 from steamboat.thread_pool_executor import ThreadPoolExecutor
-from steamboat.cabin import CabinBuilder
+from steamboat.cabin import CabinBuilder, SubmitTaskError, TimeoutReachedError
+from steamboat.executor import AsyncResult
 
 LOGGER = logging.getLogger(__name__)
 
@@ -76,6 +80,84 @@ class CabinTest(TestCase):
             except:
                 LOGGER.error(future.exception())
 
+    def testExecuteMany(self):
+        def func(count):
+            return "this is %d" % count
+
+        futures = self._cabin.execute_many(
+            [(func, (ind, ), {}) for ind in range(12)])
+        self.assertEqual(12, len(futures))
+        for future in futures:
+            exc = future.exception()
+            if exc is None:
+                LOGGER.info(future.result())
+            else:
+                self.assertIsInstance(exc, SubmitTaskError)
+                LOGGER.error("%s(%s)" % (exc.__class__, exc.exc))
+        self.assertEqual(
+            12,
+            self._cabin.get_window().get_success_count() +
+            self._cabin.get_window().get_rejection_count())
+
+    def testPayloadReleased(self):
+        class Payload(object):
+            pass
+
+        event = threading.Event()
+        blocker = self._cabin.execute(event.wait)
+        payload = Payload()
+        reference = weakref.ref(payload)
+        future = self._cabin.execute(lambda payload: 1, payload)
+        del payload
+        self.assertEqual(future.result(1), 1)
+        time.sleep(0.05)
+        gc.collect()
+        # released while other tasks are still pending
+        self.assertIsNone(reference())
+        self.assertEqual(self._cabin.get_pending_task_count(), 1)
+        event.set()
+        blocker.result(1)
+        time.sleep(0.05)
+        self.assertEqual(self._cabin.get_pending_task_count(), 0)
+
+    def testQueuedTaskTimeout(self):
+        event = threading.Event()
+        blockers = [self._cabin.execute(event.wait) for _ in range(3)]
+        start = time.time()
+        exc = self._cabin.execute(lambda: 1).exception(2)
+        self.assertIsInstance(exc, TimeoutReachedError)
+        self.assertLess(time.time() - start, 1)
+        event.set()
+        for blocker in blockers:
+            blocker.result(1)
+
+    def testCancelQueuedTask(self):
+        event = threading.Event()
+        blockers = [self._cabin.execute(event.wait, 5) for _ in range(3)]
+        ran = []
+        queued = self._cabin.execute_with_result(
+            AsyncResult(), lambda: ran.append(1))
+        abandoned = self._cabin.execute(lambda: ran.append(2))
+        self.assertEqual(self._cabin.get_pending_task_count(), 5)
+
+        self.assertTrue(self._cabin.cancel(queued))
+        self.assertTrue(queued.cancelled())
+        # the shared result leaves the pending tasks at once
+        self.assertEqual(self._cabin.get_pending_task_count(), 4)
+        self.assertTrue(self._cabin.cancel(abandoned))
+        # cancelling twice is not counted twice
+        self.assertTrue(self._cabin.cancel(queued))
+        self.assertEqual(self._cabin.get_pending_task_count(), 4)
+
+        event.set()
+        for blocker in blockers:
+            blocker.result(1)
+        time.sleep(0.05)
+        # the executor task of the other result is dropped once it completes
+        self.assertEqual(self._cabin.get_pending_task_count(), 0)
+        self.assertEqual(ran, [2])
+        self.assertEqual(self._cabin.get_window().get_success_count(), 4)
+
     def tearDown(self):
         self._thread_pool_executor.shutdown()
         self._cabin.shutdown()
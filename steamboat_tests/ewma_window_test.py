@@ -0,0 +1,105 @@
+import logging
+import time
+from unittest import TestCase, main
+from Queue import Queue, Full
+
+from steamboat.cabin import CabinBuilder
+from steamboat.ewma_window import EwmaWindow, ewma_window_factory
+from steamboat.thread_pool_executor import ThreadPoolExecutor
+from steamboat.window import WindowStatus
+
+LOGGER = logging.getLogger(__name__)
+
+
+def create_window(failure_count_threshold=3):
+    return EwmaWindow(10, 0, WindowStatus.OPEN, 10, 5, 5, 0.5,
+                      failure_count_threshold, 2, 0.8, 3)
+
+
+class EwmaWindowTest(TestCase):
+    def testDecay(self):
+        window = create_window()
+        window.update_status(100, 4, 0, 0, 0)
+        self.assertEqual(window.get_success_count(), 4)
+        window.update_status(110, 0, 0, 0, 0)
+        self.assertAlmostEqual(window.get_success_count(), 2)
+        # an update slightly in the past does not decay
+        window.update_status(109, 1, 0, 0, 0)
+        self.assertAlmostEqual(window.get_success_count(), 3)
+        window.update_status(130, 0, 0, 0, 0)
+        self.assertAlmostEqual(window.get_success_count(), 0.75)
+        # the open state has no period boundary
+        self.assertEqual(window.get_status(1000), WindowStatus.OPEN)
+        self.assertEqual(window.get_start_position(), 0)
+
+    def testLowTraffic(self):
+        window = create_window()
+        # one failure every 20 seconds never accumulates 3 decayed failures
+        for position in range(0, 200, 20):
+            window.update_status(position, 0, 1, 0, 0)
+            self.assertEqual(window.get_status(position), WindowStatus.OPEN)
+        self.assertLess(window.get_failure_count(), 1.5)
+        # a burst does
+        for _ in range(3):
+            window.update_status(201, 0, 1, 0, 0)
+        self.assertEqual(window.get_status(201), WindowStatus.CLOSED)
+
+    def testHighTraffic(self):
+        window = create_window(failure_count_threshold=100)
+        position = 0.
+        for _ in range(5000):
+            position = position + 0.01
+            window.update_status(position, 1, 0, 0, 0)
+        self.assertEqual(window.get_status(position), WindowStatus.OPEN)
+        # the ratio is judged on every event, not at the end of a period
+        for _ in range(5000):
+            position = position + 0.01
+            window.update_status(position, 0, 1, 0, 0)
+            if window.get_status(position) == WindowStatus.CLOSED:
+                break
+        self.assertEqual(window.get_status(position), WindowStatus.CLOSED)
+        self.assertLess(position, 60)
+
+        # closed -> half open -> open as with Window
+        self.assertEqual(window.get_status(position + 5),
+                         WindowStatus.HALF_OPEN)
+        for _ in range(3):
+            window.update_status(position + 5, 1, 0, 0, 0)
+        self.assertEqual(window.get_status(position + 5), WindowStatus.OPEN)
+        self.assertEqual(window.get_success_count(), 0)
+
+    def testCabin(self):
+        def reject_handler(queue, task_item):
+            raise Full
+
+        def fail():
+            raise ValueError
+
+        executor = ThreadPoolExecutor(1, Queue(10), reject_handler)
+        cabin = CabinBuilder() \
+            .with_name("cabin") \
+            .with_executor(executor) \
+            .with_timeout(1) \
+            .with_open_length(10) \
+            .with_closed_length(2) \
+            .with_half_open_length(3) \
+            .with_failure_ratio_threshold(0.8) \
+            .with_failure_count_threshold(3) \
+            .with_half_failure_count_threshold(2) \
+            .with_window_factory(ewma_window_factory(60)) \
+            .build()
+        try:
+            self.assertIsInstance(cabin.get_window(), EwmaWindow)
+            self.assertEqual(cabin.get_window().get_half_life(), 60)
+            for _ in range(4):
+                cabin.execute(fail).exception()
+            time.sleep(0.05)
+            self.assertEqual(cabin.get_window().get_status(time.time()),
+                             WindowStatus.CLOSED)
+        finally:
+            cabin.shutdown()
+            executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
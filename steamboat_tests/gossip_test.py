@@ -0,0 +1,97 @@
+import logging
+import time
+from unittest import TestCase, main
+
+from steamboat.gossip import Gossiper, LoopbackNetwork, UdpTransport
+from steamboat.window import Window, WindowStatus
+
+LOGGER = logging.getLogger(__name__)
+
+
+def get_status(window):
+    return window.get_status(time.time())
+
+
+def create_window():
+    return Window(0, WindowStatus.OPEN, 10, 10, 10, 0.5, 10, 2, None, None)
+
+
+class GossipTest(TestCase):
+    def testTrip(self):
+        window = create_window()
+        now = time.time()
+        self.assertTrue(window.trip(now))
+        self.assertEqual(window.get_status(now), WindowStatus.CLOSED)
+        self.assertFalse(window.trip(now))
+
+    def testFleetWideFailureRatio(self):
+        network = LoopbackNetwork()
+        windows = [create_window() for _ in range(3)]
+        gossipers = [
+            Gossiper(network.create_transport(), "node-%d" % index, 60, 10)
+            .register("backend", window).start()
+            for index, window in enumerate(windows)]
+        try:
+            now = time.time()
+            # 4 failures are below the local threshold of 10 on every node
+            for window in windows:
+                window.update_status(now, 1, 0, 0, 0)
+                for _ in range(4):
+                    window.update_status(now, 0, 1, 0, 0)
+                self.assertEqual(window.get_status(now), WindowStatus.OPEN)
+
+            gossipers[0].broadcast()
+            # node-1 and node-2 see 8 failures, still below the threshold
+            self.assertEqual(get_status(windows[1]), WindowStatus.OPEN)
+            gossipers[1].broadcast()
+            # node-2 has heard from both peers: 12 failures out of 15 calls
+            self.assertEqual(get_status(windows[2]), WindowStatus.CLOSED)
+            self.assertEqual(gossipers[2].get_trip_count(), 1)
+            self.assertEqual(
+                gossipers[2].get_remote_summaries("backend")["node-1"]
+                ["failure_count"], 4)
+            self.assertEqual(get_status(windows[0]), WindowStatus.OPEN)
+
+            # summaries older than max_age are not counted
+            for _ in range(2):
+                windows[0].update_status(now, 0, 1, 0, 0)
+            gossipers[0].receive(gossipers[1].build_message(), now - 100)
+            gossipers[0].evaluate(now)
+            self.assertEqual(windows[0].get_status(now), WindowStatus.OPEN)
+            gossipers[0].receive(gossipers[1].build_message(), now)
+            self.assertEqual(windows[0].get_status(now), WindowStatus.CLOSED)
+        finally:
+            for gossiper in gossipers:
+                gossiper.shutdown()
+
+    def testUdpTransport(self):
+        transports = [UdpTransport(), UdpTransport()]
+        transports[0].add_peer(transports[1].get_address())
+        transports[1].add_peer(transports[0].get_address())
+        windows = [create_window(), create_window()]
+        gossipers = [
+            Gossiper(transport, interval=0.02).register("backend", window)
+            for transport, window in zip(transports, windows)]
+        now = time.time()
+        for window in windows:
+            for _ in range(6):
+                window.update_status(now, 0, 1, 0, 0)
+        for gossiper in gossipers:
+            gossiper.start()
+        try:
+            # whichever node trips first still reports its 6 failures
+            for _ in range(100):
+                if all(window.get_status(time.time()) == WindowStatus.CLOSED
+                       for window in windows):
+                    break
+                time.sleep(0.01)
+            for window in windows:
+                self.assertEqual(window.get_status(time.time()),
+                                 WindowStatus.CLOSED)
+        finally:
+            for gossiper in gossipers:
+                gossiper.shutdown()
+
+
+if __name__ == "__main__":
+    main()
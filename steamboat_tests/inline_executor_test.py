@@ -0,0 +1,110 @@
+import logging
+import threading
+import time
+from unittest import TestCase, main
+
+from steamboat.cabin import CabinBuilder, SubmitTaskError
+from steamboat.degradation_strategy import DegradationStrategy
+from steamboat.inline_executor import InlineExecutor, BulkheadFullError
+from steamboat.metrics import MetricsRegistry
+from steamboat.steamboat import SteamBoat
+from steamboat.window import WindowClosedError, WindowStatus
+
+LOGGER = logging.getLogger(__name__)
+
+
+class DefaultValueStrategy(DegradationStrategy):
+    def on_submit_task_error(self, exc, f, a, kw):
+        return "bulkhead full"
+
+    def on_window_half_open(self, f, a, kw):
+        return "half open"
+
+    def on_window_closed(self, f, a, kw):
+        return "closed"
+
+    def on_timeout_reached(self, f, a, kw):
+        return "timeout"
+
+    def on_exception(self, exc, f, a, kw):
+        return "exception %s" % exc
+
+
+def fail():
+    raise ValueError("boom")
+
+
+class InlineExecutorTest(TestCase):
+    def setUp(self):
+        self._registry = MetricsRegistry()
+        self._executor = InlineExecutor(1)
+        self._cabin = CabinBuilder() \
+            .with_name("inline") \
+            .with_executor(self._executor) \
+            .with_timeout(1) \
+            .with_open_length(10) \
+            .with_closed_length(2) \
+            .with_half_open_length(3) \
+            .with_failure_ratio_threshold(0.5) \
+            .with_failure_count_threshold(3) \
+            .with_half_failure_count_threshold(2) \
+            .with_metrics_registry(self._registry) \
+            .build()
+
+    def tearDown(self):
+        self._cabin.shutdown()
+        self._executor.shutdown()
+
+    def testExecuteReturnsCompletedResult(self):
+        async_result = self._cabin.execute(threading.current_thread)
+        self.assertTrue(async_result.done())
+        self.assertIs(async_result.result(), threading.current_thread())
+        time.sleep(0.01)
+        self.assertEqual(self._cabin.get_window().get_success_count(), 1)
+        self.assertEqual(self._cabin.get_pending_task_count(), 0)
+
+    def testCall(self):
+        self.assertEqual(self._cabin.call(lambda x: x + 1, 1), 2)
+        self.assertRaises(ValueError, self._cabin.call, fail)
+        window = self._cabin.get_window()
+        self.assertEqual(window.get_success_count(), 1)
+        self.assertEqual(window.get_failure_count(), 1)
+        self.assertIn('steamboat_cabin_succeeded_total{cabin="inline"} 1',
+                      self._registry.expose())
+
+        # the bulkhead admits one call at a time
+        def nested():
+            return self._cabin.call(lambda: 1)
+        try:
+            self._cabin.call(nested)
+        except SubmitTaskError as exc:
+            self.assertIsInstance(exc.exc, BulkheadFullError)
+        else:
+            self.fail("bulkhead admitted a second call")
+        self.assertEqual(window.get_rejection_count(), 1)
+        self.assertEqual(self._executor.get_active_worker_count(), 0)
+
+        # the outer call failed with the SubmitTaskError of the inner one
+        self.assertEqual(window.get_failure_count(), 2)
+        self.assertRaises(ValueError, self._cabin.call, fail)
+        self.assertEqual(window.get_status(time.time()), WindowStatus.CLOSED)
+        self.assertRaises(WindowClosedError, self._cabin.call, lambda: 1)
+
+    def testSteamBoatCall(self):
+        steamboat = SteamBoat().add_cabin(self._cabin, DefaultValueStrategy())
+        self.assertEqual(steamboat.call("inline", lambda: "ok"), "ok")
+        self.assertEqual(steamboat.call("inline", fail), "exception boom")
+        self.assertEqual(
+            steamboat.call("inline", steamboat.call, "inline", lambda: 1),
+            "bulkhead full")
+        for _ in range(2):
+            steamboat.call("inline", fail)
+        self.assertEqual(steamboat.call("inline", lambda: 1), "closed")
+        self.assertEqual(steamboat.get_fallback_stats()["inline_count"], 5)
+
+        plain = SteamBoat().add_cabin(self._cabin)
+        self.assertRaises(WindowClosedError, plain.call, "inline", lambda: 1)
+
+
+if __name__ == "__main__":
+    main()
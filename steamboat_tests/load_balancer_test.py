@@ -0,0 +1,217 @@
+import logging
+import threading
+import time
+from unittest import TestCase, main
+from Queue import Queue, Full
+
+from steamboat.cabin import CabinBuilder, TimeoutReachedError
+from steamboat.degradation_strategy import DegradationStrategy
+from steamboat.inline_executor import InlineExecutor
+from steamboat.load_balancer import LoadBalancer
+from steamboat.steamboat import SteamBoat
+from steamboat.thread_pool_executor import ThreadPoolExecutor
+from steamboat.window import WindowStatus
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ExceptionStrategy(DegradationStrategy):
+    def on_submit_task_error(self, exc, f, a, kw):
+        return "submit task error"
+
+    def on_window_half_open(self, f, a, kw):
+        return "half open"
+
+    def on_window_closed(self, f, a, kw):
+        return "closed"
+
+    def on_timeout_reached(self, f, a, kw):
+        return "timeout"
+
+    def on_exception(self, exc, f, a, kw):
+        return "degraded %s" % exc
+
+
+def request(endpoint):
+    if endpoint == "bad":
+        raise ValueError(endpoint)
+    time.sleep(0.001)
+    return endpoint
+
+
+def reject_handler(queue, task_item):
+    raise Full
+
+
+class LoadBalancerTest(TestCase):
+    def setUp(self):
+        self._executors = []
+
+    def tearDown(self):
+        for executor in self._executors:
+            executor.shutdown()
+
+    def _create_cabin(self, load_balancer, executor=None, timeout=1,
+                      shared_async_result=False):
+        if executor is None:
+            executor = ThreadPoolExecutor(3, Queue(10), reject_handler)
+            self._executors.append(executor)
+        return CabinBuilder() \
+            .with_name("replicas") \
+            .with_executor(executor) \
+            .with_timeout(timeout) \
+            .with_open_length(10) \
+            .with_closed_length(2) \
+            .with_half_open_length(3) \
+            .with_failure_ratio_threshold(0.5) \
+            .with_failure_count_threshold(5) \
+            .with_half_failure_count_threshold(2) \
+            .with_shared_async_result(shared_async_result) \
+            .with_load_balancer(load_balancer) \
+            .build()
+
+    def testPowerOfTwoChoices(self):
+        load_balancer = LoadBalancer(["a", "b"])
+        a, b = load_balancer.get_endpoints()
+        for endpoint, latency in ((a, 0.01), (b, 0.02)):
+            endpoint.acquire()
+            endpoint.complete(True, latency)
+        for _ in range(10):
+            self.assertIs(load_balancer.select(), a)
+
+        # outstanding requests make the faster endpoint more expensive
+        for _ in range(2):
+            a.acquire()
+        for _ in range(10):
+            self.assertIs(load_balancer.select(), b)
+        a.release()
+        self.assertEqual(a.get_outstanding(), 1)
+
+        # peak EWMA follows a slowdown immediately
+        a.complete(True, 0.5)
+        self.assertEqual(a.get_outstanding(), 0)
+        self.assertEqual(a.get_latency(), 0.5)
+        self.assertIs(load_balancer.select(), b)
+
+    def testFailurePenalty(self):
+        load_balancer = LoadBalancer(["a", "b"], failure_penalty=0.5)
+        a, b = load_balancer.get_endpoints()
+        a.acquire()
+        a.complete(True, 0.01)
+        # a fast failure must not make the endpoint look cheap
+        b.acquire()
+        b.complete(False, 0.0001)
+        self.assertEqual(b.get_latency(), 0.5)
+        for _ in range(10):
+            self.assertIs(load_balancer.select(), a)
+
+        cabin = self._create_cabin(
+            LoadBalancer(["good", "bad", "fine"], failure_count_threshold=3))
+        try:
+            results = [cabin.execute(request).exception(1)
+                       for _ in range(30)]
+            # after its first failure the bad replica loses every comparison
+            self.assertEqual(
+                sum(1 for exc in results if exc is not None), 1)
+        finally:
+            cabin.shutdown()
+
+    def testHalfOpenProbes(self):
+        for probability, expected in ((0, 0), (1, 50)):
+            load_balancer = LoadBalancer(
+                ["a", "b"], ejection_time=0.05,
+                half_open_probability=probability)
+            a, b = load_balancer.get_endpoints()
+            a.acquire()
+            a.complete(True, 0.01)
+            b.get_window().trip(time.time())
+            self.assertEqual(b.get_status(), WindowStatus.CLOSED)
+            time.sleep(0.06)
+            self.assertEqual(b.get_status(), WindowStatus.HALF_OPEN)
+            # b has never been measured, so it wins every comparison it enters
+            selected = [load_balancer.select() for _ in range(50)]
+            self.assertEqual(selected.count(b), expected)
+
+            # with no open endpoint left, requests go to the half-open one
+            a.get_window().trip(time.time())
+            self.assertIs(load_balancer.select(), b)
+
+    def testEjectFailingEndpoint(self):
+        for shared_async_result in (False, True):
+            # without the failure penalty the bad replica fails fast and
+            # attracts traffic until it is ejected
+            cabin = self._create_cabin(
+                LoadBalancer(["good", "bad", "fine"],
+                             failure_count_threshold=3, failure_penalty=0),
+                shared_async_result=shared_async_result)
+            load_balancer = cabin.get_load_balancer()
+            try:
+                results = [cabin.execute(request).exception(1)
+                           for _ in range(60)]
+                self.assertEqual(
+                    sum(1 for exc in results if exc is not None), 3)
+                bad = load_balancer.get_endpoints()[1]
+                self.assertEqual(bad.get_status(), WindowStatus.CLOSED)
+                self.assertEqual(results[-30:], [None] * 30)
+                self.assertEqual(
+                    cabin.get_window().get_status(time.time()),
+                    WindowStatus.OPEN)
+                time.sleep(0.05)
+                for stats in load_balancer.get_endpoint_stats():
+                    self.assertEqual(stats["outstanding"], 0)
+            finally:
+                cabin.shutdown()
+
+    def testPanicWhenAllEjected(self):
+        load_balancer = LoadBalancer(["bad"], failure_count_threshold=1)
+        cabin = self._create_cabin(load_balancer, executor=InlineExecutor(2))
+        try:
+            self.assertRaises(ValueError, cabin.call, request)
+            self.assertEqual(load_balancer.get_endpoints()[0].get_status(),
+                             WindowStatus.CLOSED)
+            # the cabin window, not the balancer, decides whether to reject
+            self.assertRaises(ValueError, cabin.call, request)
+            self.assertEqual(cabin.get_window().get_failure_count(), 2)
+        finally:
+            cabin.shutdown()
+
+    def testQueueTimeoutReleasesEndpoint(self):
+        executor = ThreadPoolExecutor(1, Queue(10), reject_handler)
+        self._executors.append(executor)
+        load_balancer = LoadBalancer(["a"])
+        cabin = self._create_cabin(load_balancer, executor=executor,
+                                   timeout=0.1)
+        event = threading.Event()
+        try:
+            cabin.execute(lambda endpoint: event.wait())
+            queued = cabin.execute(request)
+            self.assertIsInstance(queued.exception(1), TimeoutReachedError)
+            endpoint = load_balancer.get_endpoints()[0]
+            time.sleep(0.05)
+            self.assertEqual(endpoint.get_outstanding(), 1)
+            event.set()
+            time.sleep(0.05)
+            self.assertEqual(endpoint.get_outstanding(), 0)
+            # the queue timeout is not counted against the endpoint
+            self.assertEqual(endpoint.get_window().get_failure_count(), 0)
+        finally:
+            event.set()
+            cabin.shutdown()
+
+    def testSteamBoatDegrades(self):
+        cabin = self._create_cabin(LoadBalancer(["bad"]))
+        steamboat = SteamBoat().add_cabin(cabin, ExceptionStrategy())
+        try:
+            # the fallback executor runs the method without an endpoint
+            self.assertEqual(
+                steamboat.submit_task("replicas", request).result(1),
+                "degraded bad")
+            self.assertEqual(steamboat.call("replicas", request),
+                             "degraded bad")
+        finally:
+            steamboat.shutdown()
+            cabin.shutdown()
+
+
+if __name__ == "__main__":
+    main()
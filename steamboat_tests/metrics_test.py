@@ -0,0 +1,219 @@
+import logging
+import threading
+import time
+import urllib2
+from unittest import TestCase, main
+from Queue import Queue, Full
+
+from steamboat.thread_pool_executor import ThreadPoolExecutor
+from steamboat.cabin import CabinBuilder
+from steamboat.sharded_cabin import ShardedCabin
+from steamboat.metrics import MetricsRegistry, MetricsServer, \
+    MetricTypeError, ThreadLocalCells
+
+LOGGER = logging.getLogger(__name__)
+
+
+class MetricsTest(TestCase):
+    def testCounterFromManyThreads(self):
+        registry = MetricsRegistry()
+        counter = registry.counter("calls_total", "Calls.", ("cabin", ))
+
+        def worker():
+            for _ in range(1000):
+                counter.labels("a").inc()
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter.labels("a").get_value(), 8000)
+        self.assertIs(registry.counter("calls_total", "Calls.", ("cabin", )),
+                      counter)
+        self.assertRaises(MetricTypeError, registry.gauge, "calls_total", "")
+
+    def testHistogramExposition(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram("latency_seconds", "Latency.",
+                                       buckets=(0.1, 1.))
+        for value in (0.05, 0.1, 0.5, 3.):
+            histogram.observe(value)
+        text = registry.expose()
+        LOGGER.info(text)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 2', text)
+        self.assertIn('latency_seconds_bucket{le="1.0"} 3', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 4', text)
+        self.assertIn("latency_seconds_count 4", text)
+
+    def testCabinMetrics(self):
+        def reject_handler(queue, task_item):
+            raise Full
+
+        registry = MetricsRegistry()
+        executor = ThreadPoolExecutor(2, Queue(10), reject_handler)
+        cabin = CabinBuilder() \
+            .with_name("cabin") \
+            .with_executor(executor) \
+            .with_timeout(0.2) \
+            .with_open_length(10) \
+            .with_closed_length(2) \
+            .with_half_open_length(3) \
+            .with_failure_ratio_threshold(0.8) \
+            .with_failure_count_threshold(50) \
+            .with_half_failure_count_threshold(2) \
+            .with_metrics_registry(registry) \
+            .build()
+
+        def func(seconds, fail):
+            time.sleep(seconds)
+            if fail:
+                raise RuntimeError("fail")
+            return seconds
+
+        # both workers are busy, so the third call times out in the queue
+        ars = [cabin.execute(func, 0.4, False) for _ in range(3)]
+        for ar in ars:
+            ar.exception()
+        ars = [cabin.execute(func, 0, False), cabin.execute(func, 0, True)]
+        for ar in ars:
+            ar.exception()
+        time.sleep(0.1)
+
+        server = MetricsServer(registry).start()
+        try:
+            text = urllib2.urlopen(
+                "http://127.0.0.1:%d/metrics" % server.get_port()).read()
+        finally:
+            server.shutdown()
+            cabin.shutdown()
+            executor.shutdown()
+        LOGGER.info(text)
+        self.assertIn('steamboat_cabin_submitted_total{cabin="cabin"} 5', text)
+        self.assertIn('steamboat_cabin_succeeded_total{cabin="cabin"} 3', text)
+        self.assertIn('steamboat_cabin_failed_total{cabin="cabin"} 1', text)
+        self.assertIn('steamboat_cabin_timed_out_total{cabin="cabin"} 1', text)
+        self.assertIn('steamboat_cabin_latency_seconds_count{cabin="cabin"} 5',
+                      text)
+        self.assertIn(
+            'steamboat_cabin_window_state{cabin="cabin",state="open"} 1', text)
+        self.assertIn('steamboat_executor_queue_size{cabin="cabin"} 0', text)
+
+        # every child of the cabin is dropped once it is shut down
+        text = registry.expose()
+        self.assertNotIn('cabin="cabin"', text)
+        self.assertIn("# TYPE steamboat_cabin_submitted_total counter", text)
+
+    def testCellsOfDeadThreadsAreFolded(self):
+        registry = MetricsRegistry()
+        counter = registry.counter("calls_total", "Calls.")
+        histogram = registry.histogram("latency_seconds", "Latency.",
+                                       buckets=(1., ))
+
+        def worker():
+            counter.inc()
+            histogram.observe(0.5)
+
+        for _ in range(20):
+            thread = threading.Thread(target=worker)
+            thread.start()
+            thread.join()
+        counter.inc()
+        self.assertEqual(counter.get_value(), 21)
+        self.assertEqual(histogram.get_value(), ([20, 20], 10., 20))
+
+        cells = ThreadLocalCells(1)
+
+        def add():
+            cells.get()[0] += 1
+
+        for _ in range(20):
+            thread = threading.Thread(target=add)
+            thread.start()
+            thread.join()
+        add()
+        self.assertEqual(cells.sum(), [21])
+        # only the cell of the current thread is left
+        self.assertEqual(cells.get_cell_count(), 1)
+
+    def testRemoveMatching(self):
+        registry = MetricsRegistry()
+        counter = registry.counter("rejected_total", "Rejected.",
+                                   ("cabin", "reason"))
+        counter.labels("a", "closed").inc()
+        counter.labels("a", "half_open").inc()
+        counter.labels("ab", "closed").inc()
+        counter.remove_matching("a")
+        text = registry.expose()
+        self.assertNotIn('cabin="a",', text)
+        self.assertIn('rejected_total{cabin="ab",reason="closed"} 1', text)
+
+    def testReleaseKeepsChildrenOfLiveCabin(self):
+        registry = MetricsRegistry()
+        counter = registry.counter("calls_total", "Calls.", ("cabin", ))
+        first = counter.acquire("a")
+        second = counter.acquire("a")
+        self.assertIs(first, second)
+        counter.release(first, "a")
+        self.assertIs(counter.labels("a"), first)
+        counter.release(first, "a")
+        self.assertNotIn('cabin="a"', registry.expose())
+
+        # a stale child never removes the one that replaced it
+        counter.labels("a").inc()
+        counter.remove("a")
+        fresh = counter.acquire("a")
+        counter.release(first, "a")
+        self.assertIs(counter.labels("a"), fresh)
+
+    def testRetiredShardKeepsMetricsOfReplacement(self):
+        def reject_handler(queue, task_item):
+            raise Full
+
+        registry = MetricsRegistry()
+        executor = ThreadPoolExecutor(2, Queue(10), reject_handler)
+        builder = CabinBuilder() \
+            .with_name("template") \
+            .with_executor(executor) \
+            .with_timeout(1) \
+            .with_open_length(10) \
+            .with_closed_length(2) \
+            .with_half_open_length(3) \
+            .with_failure_ratio_threshold(0.5) \
+            .with_failure_count_threshold(3) \
+            .with_half_failure_count_threshold(2) \
+            .with_metrics_registry(registry) \
+            .with_record_phase_latency(True)
+        sharded_cabin = ShardedCabin(
+            "t", builder, idle_timeout=60, max_shards=1,
+            retire_grace_period=0)
+        try:
+            sharded_cabin.get_shard("a")
+            sharded_cabin.get_shard("b")
+            # the retired shard "a" and its replacement share the label
+            cabin = sharded_cabin.get_shard("a")
+            self.assertEqual(2, sharded_cabin.get_retired_shard_count())
+            sharded_cabin.evict_idle_shards()
+            self.assertEqual(0, sharded_cabin.get_retired_shard_count())
+
+            self.assertEqual(cabin.execute(lambda: 1).result(1), 1)
+            text = registry.expose()
+            LOGGER.info(text)
+            self.assertNotIn('cabin="t[b]"', text)
+            self.assertIn('steamboat_cabin_succeeded_total{cabin="t[a]"} 1',
+                          text)
+            self.assertIn('steamboat_cabin_pending_tasks{cabin="t[a]"} 0',
+                          text)
+            self.assertIn(
+                'steamboat_cabin_window_state{cabin="t[a]",state="open"} 1',
+                text)
+            self.assertIn('steamboat_cabin_phase_latency_seconds{cabin="t[a]"',
+                          text)
+        finally:
+            sharded_cabin.shutdown()
+            executor.shutdown()
+        self.assertNotIn('cabin="t[a]"', registry.expose())
+
+
+if __name__ == "__main__":
+    main()
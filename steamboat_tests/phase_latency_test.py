@@ -0,0 +1,79 @@
+import logging
+import threading
+import time
+from unittest import TestCase, main
+from Queue import Queue, Full
+
+from steamboat.thread_pool_executor import ThreadPoolExecutor
+from steamboat.cabin import CabinBuilder
+from steamboat.phase_latency import LogHistogram
+
+LOGGER = logging.getLogger(__name__)
+
+
+class PhaseLatencyTest(TestCase):
+    def testLogHistogramPercentile(self):
+        histogram = LogHistogram(growth_factor=1.05)
+        self.assertIsNone(histogram.percentile(50))
+        for value in range(1, 1001):
+            histogram.observe(value / 1000.)
+        self.assertEqual(histogram.get_count(), 1000)
+        for p in (50, 90, 99):
+            self.assertAlmostEqual(histogram.percentile(p), p / 100.,
+                                   delta=p / 100. * 0.05)
+        snapshot = histogram.snapshot()
+        LOGGER.info(snapshot)
+        self.assertAlmostEqual(snapshot["mean"], 0.5005)
+        self.assertIn("p999", snapshot)
+
+    def testCabinPhases(self):
+        def reject_handler(queue, task_item):
+            raise Full
+
+        executor = ThreadPoolExecutor(1, Queue(10), reject_handler)
+        cabin = CabinBuilder() \
+            .with_name("cabin") \
+            .with_executor(executor) \
+            .with_timeout(2) \
+            .with_open_length(10) \
+            .with_closed_length(2) \
+            .with_half_open_length(3) \
+            .with_failure_ratio_threshold(0.8) \
+            .with_failure_count_threshold(5) \
+            .with_half_failure_count_threshold(2) \
+            .with_record_phase_latency(True) \
+            .build()
+        recorder = cabin.get_phase_latency_recorder()
+
+        snapshots = []
+        snapshot_event = threading.Event()
+
+        def on_snapshot(cabin_name, snapshot):
+            snapshots.append(snapshot)
+            snapshot_event.set()
+
+        recorder.start_periodic_snapshots(0.05, on_snapshot)
+        try:
+            # one worker, so every call but the first waits in the queue
+            ars = [cabin.execute(time.sleep, 0.02) for _ in range(5)]
+            for ar in ars:
+                ar.result()
+            time.sleep(0.05)
+            snapshot = recorder.snapshot()
+            LOGGER.info(snapshot)
+            self.assertEqual(snapshot["end_to_end"]["count"], 5)
+            self.assertGreaterEqual(recorder.percentile("execution", 50), 0.015)
+            self.assertGreater(recorder.percentile("queue_wait", 90),
+                               recorder.percentile("execution", 50))
+            # periodic snapshots only hold the samples of their own interval
+            self.assertTrue(snapshot_event.wait(1))
+            time.sleep(0.1)
+            self.assertEqual(
+                sum(s["end_to_end"]["count"] for s in list(snapshots)), 5)
+        finally:
+            cabin.shutdown()
+            executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
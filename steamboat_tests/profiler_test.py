@@ -0,0 +1,66 @@
+import logging
+import time
+from unittest import TestCase, main
+from Queue import Queue, Full
+
+from steamboat.thread_pool_executor import ThreadPoolExecutor
+from steamboat.cabin import CabinBuilder
+from steamboat.profiler import SamplingProfiler
+
+LOGGER = logging.getLogger(__name__)
+
+
+def hot_loop(seconds):
+    deadline = time.time() + seconds
+    count = 0
+    while time.time() < deadline:
+        count = count + 1
+    return count
+
+
+class SamplingProfilerTest(TestCase):
+    def testProfileCabin(self):
+        def reject_handler(queue, task_item):
+            raise Full
+
+        executor = ThreadPoolExecutor(2, Queue(10), reject_handler)
+        cabin = CabinBuilder() \
+            .with_name("cabin") \
+            .with_executor(executor) \
+            .with_timeout(2) \
+            .with_open_length(10) \
+            .with_closed_length(2) \
+            .with_half_open_length(3) \
+            .with_failure_ratio_threshold(0.8) \
+            .with_failure_count_threshold(5) \
+            .with_half_failure_count_threshold(2) \
+            .build()
+        profiler = SamplingProfiler.for_cabin(cabin, sample_rate=200)
+        try:
+            profiler.start()
+            self.assertTrue(profiler.is_running())
+            ars = [cabin.execute(hot_loop, 0.3) for _ in range(2)]
+            for ar in ars:
+                ar.result()
+            profiler.stop()
+            self.assertFalse(profiler.is_running())
+
+            folded_stacks = profiler.get_folded_stacks()
+            LOGGER.info(folded_stacks)
+            self.assertGreater(profiler.get_sample_count(), 10)
+            first_line = folded_stacks.splitlines()[0]
+            self.assertTrue(first_line.startswith("cabin;"))
+            self.assertIn("hot_loop (profiler_test.py:", first_line)
+
+            # idle workers are not sampled
+            sample_count = sum(profiler.get_stacks().values())
+            profiler.sample()
+            self.assertEqual(sum(profiler.get_stacks().values()), sample_count)
+        finally:
+            profiler.stop()
+            cabin.shutdown()
+            executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
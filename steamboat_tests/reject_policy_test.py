@@ -0,0 +1,176 @@
+import logging
+import threading
+import time
+from unittest import TestCase, main
+from Queue import Queue, Full
+
+from steamboat.cabin import CabinBuilder, SubmitTaskError
+from steamboat.executor import AsyncResult, RejectedError
+from steamboat.metrics import MetricsRegistry
+from steamboat.reject_policy import AbortPolicy, CallerRunsPolicy, \
+    BlockPolicy, DropOldestPolicy, SpillPolicy, EvictedError
+from steamboat.thread_pool_executor import ThreadPoolExecutor
+from steamboat.window import WindowStatus
+
+LOGGER = logging.getLogger(__name__)
+
+
+def get_decision_count(registry, policy, decision):
+    metric = registry.get_metric("steamboat_reject_policy_decisions_total")
+    return metric.labels(policy, decision).get_value()
+
+
+class RejectPolicyTest(TestCase):
+    def setUp(self):
+        self._registry = MetricsRegistry()
+        self._event = threading.Event()
+        self._executors = []
+
+    def tearDown(self):
+        self._event.set()
+        for executor in self._executors:
+            executor.shutdown()
+
+    def _create_busy_executor(self, reject_handler, queue_size=1):
+        """
+        the only worker is blocked and the queue is full
+        """
+        executor = ThreadPoolExecutor(1, Queue(queue_size), reject_handler)
+        self._executors.append(executor)
+        started = threading.Event()
+
+        def block():
+            started.set()
+            self._event.wait()
+
+        executor.submit_task(block)
+        started.wait()
+        for _ in range(queue_size):
+            executor.submit_task(lambda: None)
+        return executor
+
+    def testAbort(self):
+        policy = AbortPolicy(self._registry)
+        executor = self._create_busy_executor(policy)
+        self.assertRaises(Full, executor.submit_task, lambda: 1)
+        self.assertEqual(
+            get_decision_count(self._registry, "abort", "rejected"), 1)
+
+    def testCallerRuns(self):
+        policy = CallerRunsPolicy(self._registry)
+        executor = self._create_busy_executor(policy)
+        async_result = executor.submit_task(threading.current_thread)
+        self.assertTrue(async_result.done())
+        self.assertIs(async_result.result(), threading.current_thread())
+        self.assertEqual(
+            get_decision_count(self._registry, "caller_runs", "caller_ran"), 1)
+
+    def testBlock(self):
+        policy = BlockPolicy(0.05, self._registry)
+        executor = self._create_busy_executor(policy)
+        start = time.time()
+        self.assertRaises(Full, executor.submit_task, lambda: 1)
+        self.assertGreaterEqual(time.time() - start, 0.05)
+
+        threading.Timer(0.05, self._event.set).start()
+        policy = BlockPolicy(5, self._registry)
+        executor._reject_handler = policy
+        self.assertEqual(executor.submit_task(lambda: 1).result(1), 1)
+        self.assertEqual(
+            get_decision_count(self._registry, "block", "timed_out"), 1)
+        self.assertEqual(
+            get_decision_count(self._registry, "block", "enqueued"), 1)
+
+    def testDropOldest(self):
+        policy = DropOldestPolicy(self._registry)
+        executor = ThreadPoolExecutor(1, Queue(3), policy)
+        self._executors.append(executor)
+        started = threading.Event()
+
+        def block():
+            started.set()
+            self._event.wait()
+
+        executor.submit_task(block)
+        started.wait()
+        queued = [executor.submit_task(lambda index=index: index)
+                  for index in range(3)]
+        for async_result, deadline in zip(queued, [30, 10, 20]):
+            async_result.deadline = deadline
+
+        # the task with the earliest deadline is evicted
+        new = executor.submit_task(lambda: "new")
+        new.deadline = 40
+        exception = queued[1].exception(0)
+        self.assertIsInstance(exception, RejectedError)
+        self.assertIsInstance(exception.exc, EvictedError)
+
+        # a task whose deadline is earlier than every queued task is rejected
+        self.assertRaises(Full, executor.submit_task_with_result,
+                          AsyncResult(deadline=5), lambda: None)
+        self.assertEqual(executor.get_queue_size(), 3)
+
+        self._event.set()
+        self.assertEqual(queued[0].result(1), 0)
+        self.assertEqual(queued[2].result(1), 2)
+        self.assertEqual(new.result(1), "new")
+        self.assertEqual(
+            get_decision_count(self._registry, "drop_oldest", "evicted"), 1)
+        self.assertEqual(
+            get_decision_count(self._registry, "drop_oldest", "rejected"), 1)
+
+    def testSpill(self):
+        overflow_executor = ThreadPoolExecutor(
+            1, Queue(1), AbortPolicy(self._registry))
+        self._executors.append(overflow_executor)
+        policy = SpillPolicy(overflow_executor, self._registry)
+        executor = self._create_busy_executor(policy)
+        self.assertEqual(executor.submit_task(lambda: 1).result(1), 1)
+        self.assertEqual(
+            get_decision_count(self._registry, "spill", "spilled"), 1)
+
+    def testCabinCountsEvictionAsRejection(self):
+        policy = DropOldestPolicy(self._registry)
+        executor = ThreadPoolExecutor(1, Queue(2), policy)
+        self._executors.append(executor)
+        for shared_async_result in (False, True):
+            cabin = CabinBuilder() \
+                .with_name("cabin") \
+                .with_executor(executor) \
+                .with_timeout(10) \
+                .with_open_length(10) \
+                .with_closed_length(2) \
+                .with_half_open_length(3) \
+                .with_failure_ratio_threshold(0.5) \
+                .with_failure_count_threshold(1) \
+                .with_half_failure_count_threshold(2) \
+                .with_shared_async_result(shared_async_result) \
+                .build()
+            try:
+                event = threading.Event()
+                started = threading.Event()
+
+                def block():
+                    started.set()
+                    event.wait()
+
+                cabin.execute(block)
+                started.wait()
+                async_results = [cabin.execute(lambda: 1) for _ in range(3)]
+                exception = async_results[0].exception(1)
+                self.assertIsInstance(exception, SubmitTaskError)
+                self.assertIsInstance(exception.exc, EvictedError)
+                event.set()
+                for async_result in async_results[1:]:
+                    self.assertEqual(async_result.result(1), 1)
+                window = cabin.get_window()
+                self.assertEqual(window.get_failure_count(), 0)
+                self.assertEqual(window.get_rejection_count(), 1)
+                self.assertEqual(window.get_status(time.time()),
+                                 WindowStatus.OPEN)
+            finally:
+                cabin.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import logging
+import threading
+import time
+from unittest import TestCase, main
+from Queue import Queue, Full
+
+from steamboat.thread_pool_executor import ThreadPoolExecutor
+from steamboat.cabin import CabinBuilder, ShutDownError
+from steamboat.sharded_cabin import ShardedCabin, TooManyShardsError
+from steamboat.steamboat import SteamBoat
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ShardedCabinTest(TestCase):
+    def setUp(self):
+        def reject_handler(queue, task_item):
+            raise Full
+
+        self._thread_pool_executor = ThreadPoolExecutor(
+            3, Queue(10), reject_handler)
+        builder = CabinBuilder() \
+            .with_name("template") \
+            .with_executor(self._thread_pool_executor) \
+            .with_timeout(1) \
+            .with_open_length(10) \
+            .with_closed_length(2) \
+            .with_half_open_length(3) \
+            .with_failure_ratio_threshold(0.8) \
+            .with_failure_count_threshold(5) \
+            .with_half_failure_count_threshold(2)
+        self._builder = builder
+        self._sharded_cabin = ShardedCabin(
+            "tenant", builder, idle_timeout=0.2, max_shards=2)
+        self._steamboat = SteamBoat().add_sharded_cabin(self._sharded_cabin)
+
+    def tearDown(self):
+        self._sharded_cabin.shutdown()
+        self._thread_pool_executor.shutdown()
+
+    def testRouteByKey(self):
+        cabin_a = self._sharded_cabin.get_shard("a")
+        self.assertIs(cabin_a, self._sharded_cabin.get_shard("a"))
+        self.assertEqual("tenant[a]", cabin_a.get_name())
+
+        ar = self._steamboat.submit_task_by_key("tenant", "b", lambda: "b")
+        self.assertEqual("b", ar.result())
+        self.assertEqual(2, self._sharded_cabin.get_shard_count())
+        self.assertEqual(
+            1,
+            self._sharded_cabin.get_shard("b").get_window().get_success_count())
+
+        @self._steamboat.push_into_shard("tenant", lambda tenant: tenant)
+        def echo(tenant):
+            return tenant
+        self.assertEqual("a", echo("a").result())
+
+    def testEviction(self):
+        self._sharded_cabin.get_shard("a")
+        self._sharded_cabin.get_shard("b")
+        self._sharded_cabin.get_shard("c")
+        self.assertEqual(2, self._sharded_cabin.get_shard_count())
+
+        time.sleep(0.3)
+        self._sharded_cabin.evict_idle_shards()
+        self.assertEqual(0, self._sharded_cabin.get_shard_count())
+
+        event = threading.Event()
+        self._steamboat.submit_task_by_key("tenant", "a", event.wait)
+        self._steamboat.submit_task_by_key("tenant", "b", event.wait)
+        self.assertRaises(
+            TooManyShardsError, self._sharded_cabin.get_shard, "c")
+        event.set()
+
+    def testLeastRecentlyUsedEviction(self):
+        cabin_a = self._sharded_cabin.get_shard("a")
+        time.sleep(0.01)
+        self._sharded_cabin.get_shard("b")
+        time.sleep(0.01)
+        # touching "a" makes "b" the least recently used shard
+        self.assertIs(cabin_a, self._sharded_cabin.get_shard("a"))
+        self._sharded_cabin.get_shard("c")
+        self.assertIs(cabin_a, self._sharded_cabin.get_shard("a"))
+        self.assertEqual(1, self._sharded_cabin.get_retired_shard_count())
+
+    def testRetiredShardGracePeriod(self):
+        sharded_cabin = ShardedCabin(
+            "grace", self._builder, idle_timeout=0.1, max_shards=2,
+            retire_grace_period=0.3)
+        try:
+            cabin = sharded_cabin.get_shard("a")
+            time.sleep(0.15)
+            sharded_cabin.evict_idle_shards()
+            self.assertEqual(0, sharded_cabin.get_shard_count())
+            self.assertEqual(1, sharded_cabin.get_retired_shard_count())
+
+            # a caller that got the cabin before it was retired can still
+            # submit during the grace period, even after another pass
+            sharded_cabin.evict_idle_shards()
+            self.assertEqual("ok", cabin.execute(lambda: "ok").result(1))
+
+            time.sleep(0.35)
+            sharded_cabin.evict_idle_shards()
+            self.assertEqual(0, sharded_cabin.get_retired_shard_count())
+            self.assertIsInstance(
+                cabin.execute(lambda: "ok").exception(1), ShutDownError)
+        finally:
+            sharded_cabin.shutdown()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format="[%(asctime)s] [%(filename)s:%(lineno)d] %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S")
+    main()
@@ -0,0 +1,175 @@
+import logging
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase, main
+from Queue import Queue, Full
+
+from steamboat.cabin import CabinBuilder
+from steamboat import shared_window
+from steamboat.shared_window import SharedWindow, shared_window_factory
+from steamboat.thread_pool_executor import ThreadPoolExecutor
+from steamboat.window import Window, WindowStatus
+
+LOGGER = logging.getLogger(__name__)
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def count_open_fds():
+    return len(os.listdir("/proc/self/fd"))
+
+
+def create_window(path, failure_count_threshold=10):
+    return SharedWindow(path, 0, WindowStatus.OPEN, 10, 10, 10,
+                        0.5, failure_count_threshold, 2, None, None)
+
+
+class SharedWindowTest(TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._path = os.path.join(self._directory, "window")
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def testWindowsShareState(self):
+        window_a = create_window(self._path)
+        window_b = create_window(self._path)
+        now = time.time()
+        for _ in range(10):
+            window_a.update_status(now, 0, 1, 0, 0)
+        self.assertEqual(window_b.get_status(now), WindowStatus.CLOSED)
+        # a window opened later keeps the existing state
+        window_c = create_window(self._path)
+        self.assertEqual(window_c.get_status(now), WindowStatus.CLOSED)
+        self.assertEqual(window_c.get_status(now + 10), WindowStatus.HALF_OPEN)
+
+    def testForkedProcesses(self):
+        window = create_window(self._path, failure_count_threshold=10 ** 9)
+        now = time.time()
+        pids = []
+        for _ in range(4):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    for _ in range(500):
+                        window.update_status(now, 1, 0, 0, 0)
+                finally:
+                    os._exit(0)
+            pids.append(pid)
+        for pid in pids:
+            os.waitpid(pid, 0)
+        self.assertEqual(window.get_success_count(), 2000)
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                create_window(self._path).update_status(now, 0, 2000, 0, 0)
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual(window.get_status(now), WindowStatus.CLOSED)
+
+    def testStatusIsReadWithoutLocking(self):
+        window = create_window(self._path, failure_count_threshold=1)
+        now = time.time()
+        # the window starts at 0, so the first read moves it to now
+        self.assertEqual(window.get_status(now), WindowStatus.OPEN)
+        flock = shared_window.fcntl.flock
+        locks = []
+
+        def counting_flock(fd, operation):
+            locks.append(operation)
+            flock(fd, operation)
+
+        shared_window.fcntl.flock = counting_flock
+        try:
+            for _ in range(10):
+                self.assertEqual(window.get_status(now + 1), WindowStatus.OPEN)
+            self.assertEqual(locks, [])
+            window.update_status(now + 2, 0, 1, 0, 0)
+            self.assertTrue(locks)
+            # the transition is seen by the next lock-free read
+            del locks[:]
+            self.assertEqual(window.get_status(now + 3), WindowStatus.CLOSED)
+            self.assertEqual(locks, [])
+        finally:
+            shared_window.fcntl.flock = flock
+        window.close()
+
+    def testCloseRemovesFileWithLastWindow(self):
+        fds = count_open_fds()
+        window_a = create_window(self._path, failure_count_threshold=1)
+        window_b = create_window(self._path)
+        now = time.time()
+        window_a.close()
+        self.assertTrue(os.path.exists(self._path))
+        # a closed window keeps working on a private copy of its state
+        window_a.update_status(now, 0, 1, 0, 0)
+        self.assertEqual(window_a.get_status(now), WindowStatus.CLOSED)
+        self.assertEqual(window_b.get_status(now), WindowStatus.OPEN)
+        window_b.close()
+        self.assertFalse(os.path.exists(self._path))
+        self.assertEqual(count_open_fds(), fds)
+
+        window_c = create_window(self._path)
+        self.assertEqual(window_c.get_status(now), WindowStatus.OPEN)
+        window_c.close()
+
+    def testFallbackToLocalWindow(self):
+        handler = RecordingHandler()
+        shared_window.LOGGER.addHandler(handler)
+        try:
+            factory = shared_window_factory(
+                os.path.join(self._directory, "missing"))
+            window = factory("cabin", 0, WindowStatus.OPEN, 10, 10, 10,
+                             0.5, 10, 2, None, None)
+        finally:
+            shared_window.LOGGER.removeHandler(handler)
+        self.assertIs(type(window), Window)
+        self.assertEqual([record.levelno for record in handler.records],
+                         [logging.WARNING])
+
+    def testCabinWithWindowFactory(self):
+        def reject_handler(queue, task_item):
+            raise Full
+
+        executor = ThreadPoolExecutor(1, Queue(10), reject_handler)
+        cabin = CabinBuilder() \
+            .with_name("cabin/a") \
+            .with_executor(executor) \
+            .with_timeout(1) \
+            .with_open_length(10) \
+            .with_closed_length(2) \
+            .with_half_open_length(3) \
+            .with_failure_ratio_threshold(0.8) \
+            .with_failure_count_threshold(5) \
+            .with_half_failure_count_threshold(2) \
+            .with_window_factory(shared_window_factory(self._directory)) \
+            .build()
+        try:
+            self.assertIsInstance(cabin.get_window(), SharedWindow)
+            self.assertEqual(cabin.get_window().get_path(),
+                             os.path.join(self._directory,
+                                          "steamboat-window-cabin_a"))
+            self.assertEqual(cabin.execute(lambda: 1).result(), 1)
+            time.sleep(0.01)
+            self.assertEqual(cabin.get_window().get_success_count(), 1)
+        finally:
+            cabin.shutdown()
+            executor.shutdown()
+        # shutting down the cabin closes the window and removes the file
+        self.assertFalse(os.path.exists(cabin.get_window().get_path()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import logging
+import threading
+import time
+from unittest import TestCase, main
+
+from steamboat.slow_action_recorder import SlowActionRecorder, AsyncLogSink
+
+LOGGER = logging.getLogger(__name__)
+
+
+class LogCollector(object):
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    def __call__(self, message, extra=None):
+        with self._lock:
+            self.records.append((message, extra))
+
+
+class SlowActionRecorderTest(TestCase):
+    def testRateLimit(self):
+        collector = LogCollector()
+        recorder = SlowActionRecorder(
+            collector, 0, "slow", max_logs_per_second=2, top_n=3)
+
+        @recorder
+        def action(seconds):
+            time.sleep(seconds)
+
+        for seconds in (0.001, 0.005, 0.003, 0.002, 0.004):
+            action(seconds)
+        self.assertEqual(len(collector.records), 2)
+        self.assertEqual(collector.records[0][1]["func_name"], "action")
+        slowest = [r["time_elapsed"] for r in recorder.get_slowest_calls()]
+        self.assertEqual(len(slowest), 3)
+        self.assertEqual(slowest, sorted(slowest, reverse=True))
+        self.assertGreaterEqual(slowest[-1], 0.003)
+        self.assertEqual(len(recorder.get_recent_slow_calls()), 3)
+
+        time.sleep(0.6)
+        action(0)
+        self.assertEqual(collector.records[-1][1]["suppressed_count"], 3)
+
+    def testSampling(self):
+        collector = LogCollector()
+        recorder = SlowActionRecorder(collector, 0, "slow", sample_rate=0)
+
+        @recorder
+        def action():
+            return 1
+
+        self.assertEqual(action(), 1)
+        self.assertEqual(collector.records, [])
+
+    def testAggregation(self):
+        collector = LogCollector()
+        sink = AsyncLogSink(collector)
+        recorder = SlowActionRecorder(
+            sink, 0, "slow", aggregate_interval=60)
+
+        @recorder("slow action")
+        def action():
+            pass
+
+        for _ in range(10):
+            action()
+        self.assertEqual(collector.records, [])
+        recorder.shutdown()
+        sink.shutdown()
+        self.assertEqual(len(collector.records), 1)
+        message, extra = collector.records[0]
+        self.assertEqual(message, "slow action")
+        self.assertEqual(extra["count"], 10)
+        self.assertTrue(extra["aggregated"])
+        self.assertIn("p99_time_elapsed", extra)
+
+    def testAggregationAcrossFlushes(self):
+        collector = LogCollector()
+        recorder = SlowActionRecorder(
+            collector, 0, "slow", aggregate_interval=60)
+
+        @recorder("slow action")
+        def action(seconds):
+            time.sleep(seconds)
+
+        def run(count):
+            threads = [threading.Thread(target=action, args=(0, ))
+                       for _ in range(count)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        run(4)
+        action(0.05)
+        recorder.flush()
+        run(3)
+        recorder.flush()
+        # nothing new, so nothing is logged
+        recorder.flush()
+        recorder.shutdown()
+
+        self.assertEqual([extra["count"] for _, extra in collector.records],
+                         [5, 3])
+        first, second = [extra for _, extra in collector.records]
+        self.assertGreaterEqual(first["max_time_elapsed"], 0.05)
+        self.assertGreaterEqual(first["mean_time_elapsed"], 0.01)
+        # the slow call of the first period is not counted again
+        self.assertLess(second["max_time_elapsed"], 0.05)
+        self.assertLess(second["p99_time_elapsed"], 0.05)
+
+if __name__ == "__main__":
+    main()
@@ -3,11 +3,13 @@ from unittest import TestCase, main
 import time
 from Queue import Queue, Full
 import random
+import threading
 
-from steamboat.steamboat import SteamBoat
-from steamboat.cabin import CabinBuilder
+from steamboat.steamboat import SteamBoat, QuorumNotReachedError
+from steamboat.cabin import CabinBuilder, SubmitTaskError
 from steamboat.degradation_strategy import DegradationStrategy
 from steamboat.thread_pool_executor import ThreadPoolExecutor
+from steamboat.executor import ShutDownError
 
 LOGGER = logging.getLogger(__name__)
 
@@ -33,6 +35,10 @@ class TestDegradationStrategy(DegradationStrategy):
             % (exc, f.__name__, a, kw))
 
 
+class CheapDegradationStrategy(TestDegradationStrategy):
+    cheap = True
+
+
 class SteamBoatTest(TestCase):
     def setUp(self):
         def reject_handler(queue, item):
@@ -58,6 +64,7 @@ class SteamBoatTest(TestCase):
         self._steamboat = steamboat
 
     def tearDown(self):
+        self._steamboat.shutdown()
         self._thread_pool_executor.shutdown()
         self._cabin.shutdown()
 
@@ -83,6 +90,238 @@ class SteamBoatTest(TestCase):
         ar.result()
         LOGGER.info(ar.time_info)
 
+    def testSubmitMany(self):
+        degraded = []
+
+        class RecordingStrategy(TestDegradationStrategy):
+            # degrade inline, not by resubmitting into the full cabin
+            cheap = True
+
+            def on_submit_task_error(self, exc, f, a, kw):
+                degraded.append(a[0])
+                return "degraded"
+
+        self._steamboat.set_default_cabin(self._cabin, RecordingStrategy())
+        fs = self._steamboat.submit_many(
+            "cabin",
+            [(lambda ind: ind * 2, (ind, ), {}) for ind in range(10)])
+        self.assertEqual(10, len(fs))
+        for ind, f in enumerate(fs):
+            if ind in degraded:
+                self.assertEqual(f.result(), "degraded")
+            else:
+                self.assertEqual(f.result(), ind * 2)
+            LOGGER.info(f.time_info)
+        # the queue holds two tasks, the rest are rejected and degraded
+        self.assertEqual(len(degraded), len(set(degraded)))
+        self.assertGreaterEqual(10 - len(degraded), 2)
+
+    def testSharedAsyncResult(self):
+        def reject_handler(queue, item):
+            raise Full
+        executor = ThreadPoolExecutor(2, Queue(4), reject_handler)
+        cabin = CabinBuilder() \
+            .with_name("shared") \
+            .with_executor(executor) \
+            .with_timeout(0.5) \
+            .with_open_length(1) \
+            .with_half_open_length(0.4) \
+            .with_closed_length(0.2) \
+            .with_failure_ratio_threshold(0.95) \
+            .with_failure_count_threshold(1) \
+            .with_half_failure_count_threshold(1) \
+            .with_shared_async_result(True) \
+            .build()
+        self._steamboat.add_cabin(cabin, TestDegradationStrategy())
+
+        try:
+            f = self._steamboat.submit_task("shared", lambda: "ok")
+            self.assertEqual("ok", f.result())
+            self.assertEqual(
+                set(["putted_into_steamboat_at",
+                     "putted_into_cabin_at",
+                     "submitted_to_queue_at",
+                     "consumed_from_queue_at",
+                     "executed_completion_at",
+                     "left_cabin_at",
+                     "left_steamboat_at"]),
+                set(f.time_info))
+            self.assertEqual(1, cabin.get_window().get_success_count())
+
+            def err_func():
+                raise RuntimeError("err func")
+            f = self._steamboat.submit_task("shared", err_func)
+            self.assertIsNone(f.result())
+
+            fs = [self._steamboat.submit_task("shared", time.sleep, 0.2)
+                  for _ in range(10)]
+            for f in fs:
+                if f.exception() is None:
+                    self.assertIsNone(f.result())
+                else:
+                    self.assertIsInstance(f.exception(), SubmitTaskError)
+        finally:
+            executor.shutdown()
+            cabin.shutdown()
+
+    def testFallbackExecutor(self):
+        def reject_handler(queue, item):
+            raise Full
+        fallback_executor = ThreadPoolExecutor(1, Queue(100), reject_handler)
+        self._steamboat.set_fallback_executor(fallback_executor)
+        try:
+            fs = [self._steamboat.submit_task("cabin", time.sleep, 0.1)
+                  for _ in range(20)]
+            for f in fs:
+                self.assertIsNone(f.result())
+            stats = self._steamboat.get_fallback_stats()
+            LOGGER.info(stats)
+            self.assertEqual(0, stats["rejected_count"])
+            self.assertEqual(stats["submitted_count"], stats["success_count"])
+            self.assertTrue(stats["submitted_count"] > 0)
+        finally:
+            fallback_executor.shutdown()
+
+    def testDefaultFallbackExecutor(self):
+        f = self._steamboat.submit_task("cabin", lambda: 1 / 0)
+        self.assertIsNone(f.result(1))
+        fallback_executor = self._steamboat.get_fallback_executor()
+        self.assertIsInstance(fallback_executor, ThreadPoolExecutor)
+        self.assertIs(self._steamboat.get_fallback_executor(),
+                      fallback_executor)
+        stats = self._steamboat.get_fallback_stats()
+        self.assertEqual(1, stats["submitted_count"])
+        self.assertEqual(1, stats["success_count"])
+
+        # shutdown only closes the executor the boat created itself
+        self._steamboat.shutdown()
+        self.assertIsInstance(
+            fallback_executor.submit_task(abs, -1).exception(), ShutDownError)
+        self.assertIsNot(self._steamboat.get_fallback_executor(),
+                         fallback_executor)
+
+    def testFallbackExecutorShutDown(self):
+        def reject_handler(queue, item):
+            raise Full
+        fallback_executor = ThreadPoolExecutor(1, Queue(1), reject_handler)
+        fallback_executor.shutdown()
+        self._steamboat.set_fallback_executor(fallback_executor)
+        f = self._steamboat.submit_task("cabin", lambda: 1 / 0)
+        # the caller keeps the original exception, not ShutDownError
+        self.assertIsInstance(f.exception(1), ZeroDivisionError)
+        stats = self._steamboat.get_fallback_stats()
+        self.assertEqual(1, stats["rejected_count"])
+        self.assertEqual(0, stats["failure_count"])
+
+    def testCheapDegradationStrategy(self):
+        self._steamboat.set_default_cabin(
+            self._cabin, CheapDegradationStrategy())
+        fs = [self._steamboat.submit_task("cabin", time.sleep, 0.1)
+              for _ in range(20)]
+        for f in fs:
+            self.assertIsNone(f.result())
+        stats = self._steamboat.get_fallback_stats()
+        self.assertEqual(0, stats["submitted_count"])
+        self.assertEqual(stats["inline_count"], stats["success_count"])
+        self.assertTrue(stats["inline_count"] > 0)
+
+    def testMap(self):
+        def square(x):
+            time.sleep(random.random() * 0.01)
+            return x * x
+
+        indexes = []
+        for index, f in self._steamboat.map("cabin", square, xrange(50),
+                                            max_in_flight=2):
+            self.assertEqual(index * index, f.result())
+            indexes.append(index)
+        self.assertEqual(range(50), sorted(indexes))
+
+    def testAsCompleted(self):
+        fs = [self._steamboat.submit_task("cabin", time.sleep, t)
+              for t in (0.3, 0.1, 0.2)]
+        completed = list(SteamBoat.as_completed(fs, timeout=5))
+        self.assertEqual([fs[1], fs[2], fs[0]], completed)
+
+    def testScatterGather(self):
+        def reject_handler(queue, item):
+            raise Full
+
+        names = ("r1", "r2", "r3")
+        executors = []
+        replica_names = {}  # Map: worker thread ident -> cabin name
+        for name in names:
+            executor = ThreadPoolExecutor(
+                1, Queue(4), reject_handler, thread_pool_name=name)
+            executors.append(executor)
+            for ident in executor.get_worker_thread_idents():
+                replica_names[ident] = name
+            cabin = CabinBuilder() \
+                .with_name(name) \
+                .with_executor(executor) \
+                .with_open_length(10) \
+                .with_half_open_length(1) \
+                .with_closed_length(10) \
+                .with_failure_ratio_threshold(0.5) \
+                .with_failure_count_threshold(2) \
+                .with_half_failure_count_threshold(1) \
+                .build()
+            self._steamboat.add_cabin(cabin)
+        # trip r3
+        self._steamboat.get_cabin("r3").get_window().update_status(
+            time.time(), 0, 2, 0, 0)
+
+        # r1 blocks until its event is set, r2 returns immediately
+        events = {}
+
+        def replica():
+            name = replica_names[threading.current_thread().ident]
+            event = events.get(name)
+            if event is not None:
+                event.wait(5)
+            return name
+
+        try:
+            events["r1"] = threading.Event()
+            ar = self._steamboat.scatter_gather(names, replica, quorum=1)
+            self.assertEqual(["r2"], ar.result(timeout=5))
+            events["r1"].set()
+
+            # a straggler queued behind a busy worker is cancelled through
+            # its cabin and leaves the pending tasks at once
+            r1 = self._steamboat.get_cabin("r1")
+            started = threading.Event()
+            events["busy"] = threading.Event()
+
+            def busy():
+                started.set()
+                events["busy"].wait(5)
+
+            blocker = r1.execute(busy)
+            # the single worker of r1 is done with the previous replica
+            started.wait(5)
+            ar = self._steamboat.scatter_gather(names, replica, quorum=1)
+            self.assertEqual(["r2"], ar.result(timeout=5))
+            self.assertEqual(1, r1.get_pending_task_count())
+            events["busy"].set()
+            blocker.result(timeout=5)
+
+            events["r1"] = threading.Event()
+            ar = self._steamboat.scatter_gather(names, replica, quorum=2)
+            events["r1"].set()
+            self.assertEqual(["r1", "r2"], sorted(ar.result(timeout=5)))
+
+            ar = self._steamboat.scatter_gather(names, replica, quorum=3)
+            exc = ar.exception(timeout=5)
+            self.assertIsInstance(exc, QuorumNotReachedError)
+            self.assertEqual(["r3"], exc.exceptions.keys())
+        finally:
+            for event in events.itervalues():
+                event.set()
+            for executor in executors:
+                executor.shutdown()
+            for name in names:
+                self._steamboat.get_cabin(name).shutdown()
 
 if __name__ == "__main__":
     logging.basicConfig(
@@ -1,10 +1,11 @@
 import logging
-from Queue import Queue
+from Queue import Queue, Full
 import time
 import random
 import unittest
 
 from steamboat.thread_pool_executor import ThreadPoolExecutor
+from steamboat.executor import RejectedError, ShutDownError
 
 LOGGER = logging.getLogger(__name__)
 
@@ -37,6 +38,59 @@ class ThreadPoolExecutorTest(unittest.TestCase):
         future = executor.submit_task(func, 100)
         LOGGER.info(future.exception())
 
+    def testSubmitMany(self):
+        def reject_handler(queue, task_item):
+            raise Full
+
+        def func(ind):
+            return "this is %d" % ind
+
+        executor = ThreadPoolExecutor(2, Queue(5), reject_handler)
+        futures = executor.submit_many(
+            [(func, (ind, ), {}) for ind in range(8)])
+        self.assertEqual(8, len(futures))
+        results = []
+        rejected_count = 0
+        for future in futures:
+            exc = future.exception()
+            if exc is None:
+                results.append(future.result())
+            else:
+                self.assertIsInstance(exc, RejectedError)
+                rejected_count = rejected_count + 1
+        LOGGER.info("results: %s, rejected: %d", results, rejected_count)
+        self.assertEqual(8, len(results) + rejected_count)
+        self.assertTrue(len(results) >= 5)
+
+        executor.shutdown()
+        for future in executor.submit_many([(func, (0, ), None)]):
+            self.assertIsInstance(future.exception(), ShutDownError)
+
+    def testSubmitManyHonoursQueueSubclass(self):
+        class CountingQueue(Queue):
+            def __init__(self, maxsize=0):
+                Queue.__init__(self, maxsize)
+                self.put_count = 0
+
+            def put(self, item, block=True, timeout=None):
+                self.put_count = self.put_count + 1
+                Queue.put(self, item, block, timeout)
+
+        def reject_handler(queue, task_item):
+            raise Full
+
+        queue = CountingQueue()
+        executor = ThreadPoolExecutor(2, queue, reject_handler)
+        try:
+            futures = executor.submit_many(
+                [(lambda ind: ind, (ind, ), {}) for ind in range(4)])
+            self.assertEqual([future.result(1) for future in futures],
+                             [0, 1, 2, 3])
+            # the batched fast path must not bypass an overridden put
+            self.assertEqual(queue.put_count, 4)
+        finally:
+            executor.shutdown()
+
 
 if __name__ == "__main__":
     logging.basicConfig(
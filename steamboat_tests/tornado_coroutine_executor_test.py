@@ -0,0 +1,94 @@
+import logging
+import threading
+import unittest
+
+from tornado.ioloop import IOLoop
+from tornado.queues import Queue, QueueFull
+from tornado.gen import coroutine, moment, Return
+
+from steamboat.tornado_coroutine_executor import TornadoCoroutineExecutor
+from steamboat.executor import ShutDownError
+
+LOGGER = logging.getLogger(__name__)
+
+
+class TornadoCoroutineExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self._io_loop_ready = threading.Event()
+        self._io_loop_thread = threading.Thread(target=self._run_io_loop)
+        self._io_loop_thread.setDaemon(True)
+        self._io_loop_thread.start()
+        self._io_loop_ready.wait()
+
+    def _run_io_loop(self):
+        def reject_handler(queue, task_item):
+            raise QueueFull()
+
+        self._io_loop = IOLoop()
+        self._io_loop.make_current()
+        self._executor = TornadoCoroutineExecutor(3, Queue(), reject_handler)
+        self._io_loop.add_callback(self._io_loop_ready.set)
+        self._io_loop.start()
+
+    def tearDown(self):
+        @coroutine
+        def stop():
+            yield self._executor.shutdown()
+            self._io_loop.stop()
+        self._io_loop.add_callback(stop)
+        self._io_loop_thread.join()
+
+    def testSubmitTaskFromOtherThreads(self):
+        @coroutine
+        def func(ind):
+            yield moment
+            raise Return("this is %d" % ind)
+
+        futures = {}
+
+        def submit(thread_id):
+            for ind in range(thread_id * 100, thread_id * 100 + 20):
+                futures[ind] = self._executor.submit_task(func, ind)
+
+        threads = [threading.Thread(target=submit, args=(thread_id, ))
+                   for thread_id in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(80, len(futures))
+        for ind, future in futures.items():
+            self.assertEqual("this is %d" % ind, future.result(timeout=5))
+        LOGGER.info(futures[0].time_info)
+
+        futures = self._executor.submit_many(
+            [(func, (ind, ), None) for ind in range(10)])
+        self.assertEqual(
+            ["this is %d" % ind for ind in range(10)],
+            [future.result(timeout=5) for future in futures])
+
+    def testSubmitTaskAfterShutdown(self):
+        done = threading.Event()
+
+        @coroutine
+        def shutdown():
+            yield self._executor.shutdown()
+            done.set()
+        self._io_loop.add_callback(shutdown)
+        done.wait()
+
+        @coroutine
+        def func():
+            yield moment
+
+        future = self._executor.submit_task(func)
+        self.assertIsInstance(future.exception(timeout=5), ShutDownError)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format="[%(asctime)s] %(filename)s:%(lineno)d %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S")
+    unittest.main()
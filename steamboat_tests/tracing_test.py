@@ -0,0 +1,128 @@
+import logging
+import time
+from unittest import TestCase, main
+from Queue import Queue, Full
+
+from steamboat.steamboat import SteamBoat
+from steamboat.cabin import CabinBuilder
+from steamboat.degradation_strategy import DegradationStrategy
+from steamboat.thread_pool_executor import ThreadPoolExecutor
+from steamboat.tracing import Tracer, RingBufferExporter, start_span
+
+LOGGER = logging.getLogger(__name__)
+
+
+class DefaultValueStrategy(DegradationStrategy):
+    cheap = True
+
+    def on_submit_task_error(self, exc, f, a, kw):
+        return "default"
+
+    def on_window_half_open(self, f, a, kw):
+        return "default"
+
+    def on_window_closed(self, f, a, kw):
+        return "default"
+
+    def on_timeout_reached(self, f, a, kw):
+        return "default"
+
+    def on_exception(self, exc, f, a, kw):
+        return "default"
+
+
+def wait_for_traces(exporter, count, timeout=1):
+    # traces are exported from a done callback, which may run after result()
+    deadline = time.time() + timeout
+    while len(exporter.get_traces()) < count and time.time() < deadline:
+        time.sleep(0.005)
+    return exporter.get_traces()
+
+
+def spans_by_name(trace):
+    return dict((span["name"], span) for span in trace)
+
+
+class TracingTest(TestCase):
+    def setUp(self):
+        def reject_handler(queue, item):
+            raise Full
+        self._executor = ThreadPoolExecutor(2, Queue(4), reject_handler)
+        self._cabin = CabinBuilder() \
+            .with_name("cabin") \
+            .with_executor(self._executor) \
+            .with_open_length(10) \
+            .with_half_open_length(1) \
+            .with_closed_length(10) \
+            .with_failure_ratio_threshold(0.95) \
+            .with_failure_count_threshold(1) \
+            .with_half_failure_count_threshold(1) \
+            .build()
+        self._exporter = RingBufferExporter(capacity=10)
+        self._steamboat = SteamBoat(tracer=Tracer(self._exporter))
+        self._steamboat.set_default_cabin(self._cabin, DefaultValueStrategy())
+
+    def tearDown(self):
+        self._executor.shutdown()
+        self._cabin.shutdown()
+
+    def testTraceSpans(self):
+        def task(x):
+            span = start_span("inner", {"x": x})
+            span.end()
+            return x
+
+        self.assertEqual(self._steamboat.submit_task("cabin", task, 1).result(), 1)
+        traces = wait_for_traces(self._exporter, 1)
+        self.assertEqual(len(traces), 1)
+        spans = spans_by_name(traces[0])
+        LOGGER.info(spans)
+        root = spans["steamboat.dispatch"]
+        self.assertIsNone(root["parent_id"])
+        self.assertEqual(root["attributes"]["cabin"], "cabin")
+        admission = spans["cabin.admission"]
+        self.assertTrue(admission["attributes"]["admitted"])
+        self.assertEqual(admission["attributes"]["window_status"], "open")
+        self.assertEqual(spans["executor.queue_wait"]["parent_id"],
+                         root["span_id"])
+        self.assertEqual(spans["inner"]["parent_id"],
+                         spans["executor.execute"]["span_id"])
+        for span in traces[0]:
+            self.assertEqual(span["trace_id"], root["trace_id"])
+            self.assertFalse(span["attributes"].get("unfinished", False))
+
+    def testTraceFailureAndRejection(self):
+        def task():
+            raise RuntimeError("backend failure")
+
+        # the first failure trips the window, so the second call is rejected
+        for _ in range(2):
+            self.assertEqual(
+                self._steamboat.submit_task("cabin", task).result(), "default")
+        failed, rejected = sorted(
+            wait_for_traces(self._exporter, 2),
+            key=lambda trace: min(span["start_time"] for span in trace))
+
+        spans = spans_by_name(failed)
+        self.assertEqual(spans["executor.execute"]["attributes"]["error"],
+                         "RuntimeError")
+        self.assertEqual(spans["steamboat.fallback"]["attributes"]["mode"],
+                         "inline")
+
+        spans = spans_by_name(rejected)
+        self.assertFalse(spans["cabin.admission"]["attributes"]["admitted"])
+        self.assertEqual(spans["cabin.admission"]["attributes"]["reason"],
+                         "WindowClosedError")
+        self.assertNotIn("executor.execute", spans)
+        self.assertIn("steamboat.fallback", spans)
+
+    def testHeadSampling(self):
+        self._steamboat.set_tracer(Tracer(self._exporter, sample_rate=0))
+        self.assertEqual(
+            self._steamboat.submit_task("cabin", abs, -1).result(), 1)
+        time.sleep(0.05)
+        self.assertEqual(self._exporter.get_traces(), [])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import logging
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase, main, skipUnless
+from Queue import Queue, Full
+
+from steamboat.thread_pool_executor import ThreadPoolExecutor
+from steamboat.cabin import CabinBuilder
+from steamboat.window import WindowStatus
+from steamboat import traffic_recorder
+from steamboat.traffic_recorder import TrafficRecorder, read_all, \
+    read_header, list_files, to_trace, TooManyCabinsError, MAX_CABINS
+
+LOGGER = logging.getLogger(__name__)
+
+
+@skipUnless(traffic_recorder.np is not None, "numpy is not installed")
+class TrafficRecorderTest(TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._path = os.path.join(self._directory, "traffic.bin")
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def testCabinCalls(self):
+        def reject_handler(queue, task_item):
+            raise Full
+
+        recorder = TrafficRecorder(self._path, flush_interval=0.01)
+        executor = ThreadPoolExecutor(2, Queue(10), reject_handler)
+        cabin = CabinBuilder() \
+            .with_name("cabin") \
+            .with_executor(executor) \
+            .with_timeout(1) \
+            .with_open_length(10) \
+            .with_closed_length(10) \
+            .with_half_open_length(3) \
+            .with_failure_ratio_threshold(0.5) \
+            .with_failure_count_threshold(2) \
+            .with_half_failure_count_threshold(2) \
+            .with_traffic_recorder(recorder) \
+            .build()
+
+        def func(fail):
+            time.sleep(0.01)
+            if fail:
+                raise RuntimeError("fail")
+
+        try:
+            for fail in (False, True, True):
+                cabin.execute(func, fail).exception()
+            # two failures out of three trip the window
+            self.assertIsInstance(cabin.execute(func, False).exception(),
+                                  Exception)
+            time.sleep(0.05)
+        finally:
+            cabin.shutdown()
+            executor.shutdown()
+            recorder.shutdown()
+
+        records, cabin_names = read_all(self._path)
+        LOGGER.info(records)
+        self.assertEqual(cabin_names, ["cabin"])
+        self.assertEqual(records["outcome"].tolist(), [
+            traffic_recorder.SUCCESS,
+            traffic_recorder.FAILURE,
+            traffic_recorder.FAILURE,
+            traffic_recorder.REJECTED_CLOSED])
+        self.assertEqual(records["window_status"][-1], WindowStatus.CLOSED)
+        self.assertTrue((records["cabin_id"] == 0).all())
+        self.assertTrue((records["execution_time"][:3] >= 0.005).all())
+        self.assertTrue((records["queue_wait"][:3] >= 0).all())
+        self.assertTrue((records["timestamp"][1:] >= records["timestamp"][:-1]).all())
+
+        timestamps, outcomes, durations = to_trace(records, 1)
+        self.assertEqual(len(timestamps), 3)
+        self.assertTrue((durations >= 0.005).all())
+
+    def testRotation(self):
+        recorder = TrafficRecorder(self._path, max_records=10, max_files=3)
+        cabin_id = recorder.register_cabin("a")
+        self.assertEqual(recorder.register_cabin("b"), 1)
+        self.assertEqual(recorder.register_cabin("a"), cabin_id)
+        for index in range(35):
+            recorder.record(float(index), index % 2, 0, WindowStatus.OPEN)
+        recorder.shutdown()
+
+        self.assertEqual(recorder.get_written_count(), 35)
+        self.assertEqual(list_files(self._path),
+                         [self._path + ".2", self._path + ".1", self._path])
+        self.assertEqual(read_header(self._path), (5, ["a", "b"]))
+        records, cabin_names = read_all(self._path)
+        self.assertEqual(cabin_names, ["a", "b"])
+        # the oldest file was removed
+        self.assertEqual(records["timestamp"].tolist(),
+                         [float(index) for index in range(10, 35)])
+
+    def testManyCabins(self):
+        recorder = TrafficRecorder(self._path, max_records=10, max_files=2)
+        names = ["tenant[%d]" % index for index in range(MAX_CABINS)]
+        for index, name in enumerate(names):
+            self.assertEqual(recorder.register_cabin(name), index)
+        # a failed registration never hands out an id
+        for _ in range(2):
+            self.assertRaises(TooManyCabinsError, recorder.register_cabin,
+                              "tenant[%d]" % MAX_CABINS)
+        self.assertEqual(recorder.register_cabin(names[-1]), MAX_CABINS - 1)
+        for index in range(15):
+            recorder.record(float(index), MAX_CABINS - 1, 0, WindowStatus.OPEN)
+        recorder.shutdown()
+
+        # the names are copied into the file created by the rotation
+        for path in list_files(self._path):
+            _, cabin_names = read_header(path)
+            self.assertEqual(cabin_names, names)
+        records, _ = read_all(self._path)
+        self.assertEqual(records["cabin_id"].tolist(), [MAX_CABINS - 1] * 15)
+
+    def testDropWhenBufferIsFull(self):
+        recorder = TrafficRecorder(self._path, flush_interval=60, max_pending=5)
+        for index in range(8):
+            recorder.record(float(index), 0, 0, WindowStatus.OPEN)
+        self.assertEqual(recorder.get_dropped_count(), 3)
+        recorder.shutdown()
+        records, _ = read_all(self._path)
+        self.assertEqual(len(records), 5)
+
+
+if __name__ == "__main__":
+    main()
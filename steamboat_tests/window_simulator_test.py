@@ -0,0 +1,92 @@
+import logging
+import random
+from unittest import TestCase, main, skipUnless
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+LOGGER = logging.getLogger(__name__)
+
+
+def generate_trace(request_count, seed):
+    """
+    Poisson arrivals with alternating healthy and failing periods
+    """
+    from steamboat.window_simulator import SUCCESS, FAILURE, TIMEOUT
+
+    rng = random.Random(seed)
+    timestamps, outcomes, durations = [], [], []
+    timestamp = 1000.
+    for index in range(request_count):
+        timestamp = timestamp + rng.expovariate(200.)
+        failing = int(timestamp * 0.5) % 3 == 1
+        value = rng.random()
+        if failing and value < 0.7 or not failing and value < 0.05:
+            outcome = FAILURE if value < 0.5 else TIMEOUT
+        else:
+            outcome = SUCCESS
+        timestamps.append(timestamp)
+        outcomes.append(outcome)
+        durations.append(0.5 if outcome == TIMEOUT else rng.uniform(0, 0.05))
+    return timestamps, outcomes, durations
+
+
+@skipUnless(numpy is not None, "numpy is not installed")
+class WindowSimulatorTest(TestCase):
+    def testMatchesScalarWindow(self):
+        from steamboat.window_simulator import parameter_grid, \
+            simulate, simulate_scalar
+
+        trace = generate_trace(3000, seed=7)
+        grid = parameter_grid(
+            open_length=[0.5, 2],
+            closed_length=[0.3, 1],
+            half_open_length=[0.2, 1],
+            failure_ratio_threshold=[0.3, 0.6],
+            failure_count_threshold=[None, 20],
+            half_failure_count_threshold=[None, 3],
+            recovery_ratio_threshold=[None, 0.8],
+            recovery_count_threshold=[None, 5],
+            half_open_probability=[0, 0.3, 1])
+        combination_count = len(grid["open_length"])
+        uniforms = numpy.random.RandomState(1).random_sample(3000)
+
+        results = simulate(*trace, params=grid, uniforms=uniforms)
+        self.assertEqual(len(results["trip_count"]), combination_count)
+        self.assertGreater(results["trip_count"].max(), 0)
+        self.assertGreater(results["rejected_success_count"].max(), 0)
+
+        for index in range(0, combination_count, 7):
+            params = dict((key, values[index])
+                          for key, values in grid.iteritems())
+            expected = simulate_scalar(*trace, params=params,
+                                       uniforms=uniforms)
+            for key, value in expected.iteritems():
+                self.assertEqual(results[key][index], value,
+                                 "%s of %s" % (key, params))
+
+    def testNoBreaker(self):
+        from steamboat.window_simulator import simulate
+
+        trace = generate_trace(500, seed=3)
+        # a failure ratio above 1 never trips the window
+        results = simulate(*trace, params={
+            "open_length": 1,
+            "closed_length": 1,
+            "half_open_length": 1,
+            "failure_ratio_threshold": 1.1,
+            "failure_count_threshold": None,
+            "half_failure_count_threshold": None,
+            "recovery_ratio_threshold": None,
+            "recovery_count_threshold": None,
+            "half_open_probability": 0.5,
+        })
+        self.assertEqual(results["trip_count"].tolist(), [0])
+        self.assertEqual(results["admitted_count"].tolist(), [500])
+        self.assertEqual(results["protection_coverage"].tolist(), [0.])
+
+
+if __name__ == "__main__":
+    main()